@@ -16,6 +16,14 @@ import numpy as np
 import datetime
 import websockets
 import math
+import socket
+import zlib
+import itertools
+import tempfile
+import multiprocessing
+import threading
+import concurrent.futures
+from multiprocessing import shared_memory
 
 def quant_cdf_score(z_value, limit=100.0):
     """
@@ -64,7 +72,7 @@ from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice, PreCheckoutQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, LabeledPrice, PreCheckoutQuery, FSInputFile
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -224,101 +232,676 @@ import xgboost as xgb
 import pandas as pd
 import numpy as np
 
-# تخزين النموذج في الذاكرة الحية
-AI_QUANT_MODEL = None
+# تخزين النموذج في الذاكرة الحية: (رقم الجيل، النموذج، بياناته الوصفية) كوحدة واحدة.
+# لا نعدل النموذج النشط في مكانه أبداً: التبديل إسناد واحد لصف جديد، فأي تنبؤ جارٍ يرى النسخة القديمة كاملة.
+AI_MODEL_ACTIVE = (0, None, {
+    "version": None, "sample_count": 0, "features": [], "metrics": {},
+    "kind": None, "label_watermark": None, "full_refit_at": 0.0
+})
+MODEL_SWAP_LOCK = threading.Lock()
 MIN_TRAINING_SAMPLES = 100 # أقل عدد صفقات مطلوب لتدريب الذكاء الاصطناعي
 
-def train_xgboost_sync(records):
+ML_XGB_PARAMS = dict(
+    max_depth=5,
+    learning_rate=0.03,
+    subsample=0.8,
+    colsample_bytree=0.8,
+    objective='reg:squarederror' # التنبؤ برقم مستمر من -1 إلى 1
+)
+
+def fit_xgboost_model(X, y, xgb_model=None, n_estimators=400, params=None):
     """
     [Institutional Level] تدريب النموذج على التنبؤ بـ (Trade Quality Score)
     بدلاً من مجرد 0 أو 1، ليعرف البوت "مدى جودة" الإشارة.
+    دالة نقية تعيد النموذج (بدون لمس المتغيرات العامة) لتعمل داخل عامل الـ Process Pool.
+    X: مصفوفة (N × 13) بترتيب ML_FEATURE_SPEC، y: جودة الصفقة (من -1 إلى 1).
+    xgb_model: Booster سابق لمواصلة التعزيز (Continued Boosting) بدل البدء من الصفر.
+    params: تعديلات على ML_XGB_PARAMS (مثل العمق ومعدل التعلم الفائزين في /ml_search).
     """
-    global AI_QUANT_MODEL
-    df = pd.DataFrame(records)
-    
-    # 1. تنظيف البيانات من القيم المفقودة
-    df = df.dropna(subset=['trade_quality_score'])
-    
-    # 2. تحديد المدخلات المؤسساتية (15 بُعداً)
-    X = df[['market_regime', 'sp500_trend_pct', 'sentiment_score', 
-            'vol_z_score', 'cvd_to_vol_ratio', 'imbalance_ratio', 
-            'ob_skewness', 'whale_dominance_pct', 'adx', 'rsi', 
-            'micro_volatility_pct', 'cvd_divergence', 'funding_rate']]
-
-    # 3. الهدف هو التنبؤ بجودة الصفقة (Regression)
-    y = df['trade_quality_score']
+    # غلاف بدون نسخ: أسماء الأعمدة تبقى محفوظة داخل النموذج
+    X = pd.DataFrame(X, columns=ml_feature_columns(), copy=False)
     
     import xgboost as xgb
     # إعدادات متقدمة جداً لمنع الـ Overfitting (حفظ البيانات بدلاً من فهمها)
-    model = xgb.XGBRegressor(
-        n_estimators=400,
-        max_depth=5,
-        learning_rate=0.03,
-        subsample=0.8,
-        colsample_bytree=0.8,
-        objective='reg:squarederror' # التنبؤ برقم مستمر من -1 إلى 1
-    )
+    model = xgb.XGBRegressor(n_estimators=n_estimators, **{**ML_XGB_PARAMS, **(params or {})})
     
-    model.fit(X, y)
-    AI_QUANT_MODEL = model
+    model.fit(X, y, xgb_model=xgb_model)
+    return model
+
+def install_model(model, expected_generation=None, **meta):
+    """
+    تبديل ذري للنموذج النشط مع رفع رقم الجيل. expected_generation: إذا تغير الجيل
+    منذ بدء التدريب (تبديل آخر سبقنا) نرفض التبديل بدل الكتابة فوق نموذج أحدث.
+    """
+    global AI_MODEL_ACTIVE
+    with MODEL_SWAP_LOCK:
+        generation, _, current_meta = AI_MODEL_ACTIVE
+        if expected_generation is not None and generation != expected_generation:
+            return None
+        AI_MODEL_ACTIVE = (generation + 1, model, {**current_meta, **meta})
+        return generation + 1
+
+def update_model_meta(**meta):
+    """تحديث البيانات الوصفية فقط (بدون تغيير النموذج أو الجيل)"""
+    global AI_MODEL_ACTIVE
+    with MODEL_SWAP_LOCK:
+        generation, model, current_meta = AI_MODEL_ACTIVE
+        AI_MODEL_ACTIVE = (generation, model, {**current_meta, **meta})
+
+# ====================================================================
+# 💾 أرشيف النماذج (Model Registry): النموذج يُحفظ في Postgres ويُحمّل فوراً عند الإقلاع
+# ====================================================================
+ML_MODEL_MIN_NEW_LABELS = 50 # تحديث تزايدي بعد تراكم هذا العدد من العينات الموسومة الجديدة
+ML_MODEL_KEEP_VERSIONS = 10
+ML_INCREMENTAL_ROUNDS = 40 # أشجار إضافية لكل تحديث تزايدي
+ML_FULL_REFIT_SECONDS = 7 * 86400 # إعادة بناء كاملة أسبوعياً (تنظيف تراكم الأشجار)
+ML_TRAINER_CHECK_SECONDS = 1800
+ML_HOLDOUT_MODULUS = 5 # id % 5 == 0 -> عينة اختبار ثابتة لا يتدرب عليها أي نموذج
+ML_HOLDOUT_MIN_ROWS = 20
+ML_HOLDOUT_TOLERANCE = 0.01 # نرفض أي تحديث يرفع RMSE الاختبار بأكثر من 1%
+
+def ml_feature_columns():
+    return [col for col, _, _, _ in ML_FEATURE_SPEC]
+
+def serialize_model(model) -> bytes:
+    return bytes(model.get_booster().save_raw(raw_format="ubj"))
+
+def deserialize_model(blob: bytes):
+    model = xgb.XGBRegressor()
+    model.load_model(bytearray(blob))
+    return model
+
+def holdout_rmse(model, X, y):
+    if y is None or len(y) < ML_HOLDOUT_MIN_ROWS:
+        return None
+    pred = model.get_booster().inplace_predict(X)
+    return float(np.sqrt(np.mean((pred.astype(np.float64) - y.astype(np.float64)) ** 2)))
+
+def update_model_artifact(prev_blob, train_X, train_y, holdout_X, holdout_y, full_refit, params=None):
+    """
+    تدريب كامل أو تزايدي (يكمل من الـ Booster السابق على العينات الجديدة فقط)،
+    ثم حارس الاختبار: يعيد (النموذج المسلسل، المقاييس، مقبول؟) كبايتات فقط عبر حدود العملية.
+    params: معاملات البحث المعتمدة ({n_estimators, max_depth, learning_rate}) تُحفظ مع المقاييس وتُورَّث.
+    """
+    prev = deserialize_model(prev_blob) if prev_blob else None
+    tree_params = {k: v for k, v in (params or {}).items() if k != "n_estimators"}
+    if full_refit or prev is None:
+        model = fit_xgboost_model(train_X, train_y, n_estimators=(params or {}).get("n_estimators", 400), params=tree_params)
+    else:
+        model = fit_xgboost_model(
+            train_X, train_y, xgb_model=prev.get_booster(), n_estimators=ML_INCREMENTAL_ROUNDS, params=tree_params
+        )
+
+    old_rmse = holdout_rmse(prev, holdout_X, holdout_y) if prev is not None else None
+    new_rmse = holdout_rmse(model, holdout_X, holdout_y)
+    accepted = old_rmse is None or new_rmse is None or new_rmse <= old_rmse * (1 + ML_HOLDOUT_TOLERANCE)
+    metrics = {
+        "holdout_rmse": new_rmse,
+        "prev_holdout_rmse": old_rmse,
+        "holdout_rows": len(holdout_y),
+        "train_rows": len(train_y),
+        "n_trees": int(model.get_booster().num_boosted_rounds())
+    }
+    if params:
+        metrics["params"] = dict(params)
+    return serialize_model(model), metrics, accepted
+
+async def save_model_version(pool, blob: bytes, sample_count: int, metrics: dict, kind="full",
+                             label_watermark=None, full_refit_at=None, parent_id=None, role="challenger"):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if role == "champion":
+                # بطل واحد فقط: أي بطل سابق (مثلاً رُفض عند التحميل لاختلاف الميزات) يُؤرشف في نفس المعاملة
+                await conn.execute("UPDATE ml_models SET role = 'archived' WHERE role = 'champion'")
+            version = await conn.fetchval("""
+                INSERT INTO ml_models (model_blob, feature_list, sample_count, metrics, kind, label_watermark, full_refit_at, parent_id, role)
+                VALUES ($1, $2, $3, $4, $5, to_timestamp($6)::timestamp, to_timestamp($7)::timestamp, $8, $9) RETURNING id
+            """, blob, ml_feature_columns(), sample_count, json.dumps(metrics), kind, label_watermark, full_refit_at, parent_id, role)
+            # أقدم المتحدين يخرج من المنافسة، والأرشيف يحتفظ بآخر النسخ فقط (البطل والمتحدون لا يُحذفون)
+            await conn.execute("""
+                UPDATE ml_models SET role = 'archived'
+                WHERE role = 'challenger' AND id NOT IN (
+                    SELECT id FROM ml_models WHERE role = 'challenger' ORDER BY id DESC LIMIT $1
+                )
+            """, ML_MAX_CHALLENGERS)
+            await conn.execute("""
+                DELETE FROM ml_models WHERE role = 'archived'
+                AND id NOT IN (SELECT id FROM ml_models ORDER BY id DESC LIMIT $1)
+            """, ML_MODEL_KEEP_VERSIONS)
+    return version
+
+# ====================================================================
+# 🥊 البطل والمتحدون (Champion / Challenger Registry)
+# ====================================================================
+# كل نموذج جديد يجتاز حارس الاختبار يدخل كمتحدٍ ظلي. كل عينة تُقيّم بكل النماذج في نداء واحد
+# وتُحفظ التنبؤات مع العينة، ثم تُحدّث الدقة المتدحرجة عند وصول الوسم، ويُرقّى المتحدي الأفضل تلقائياً.
+AI_CHALLENGERS = () # ((version, model, meta), ...) يُستبدل ذرياً مثل AI_MODEL_ACTIVE
+ML_MAX_CHALLENGERS = 2
+ML_SHADOW_HALF_LIFE = 300 # عدد الوسوم حتى يفقد الخطأ القديم نصف وزنه
+ML_PROMOTION_MIN_LABELS = 200
+ML_PROMOTION_MARGIN = 0.02 # المتحدي يجب أن يخفض RMSE البطل بـ 2% على نفس العينات
+ML_REGISTRY_SYNC_SECONDS = 300
+ML_REGISTRY_COLUMNS = """
+    id, role, feature_list, sample_count, metrics, kind,
+    EXTRACT(EPOCH FROM label_watermark) AS label_watermark,
+    EXTRACT(EPOCH FROM full_refit_at) AS full_refit_at
+"""
+
+def set_challengers(entries):
+    global AI_CHALLENGERS
+    with MODEL_SWAP_LOCK:
+        AI_CHALLENGERS = tuple(entries)[:ML_MAX_CHALLENGERS]
+
+def _registry_meta(row):
+    return {
+        "version": row['id'], "sample_count": row['sample_count'], "features": list(row['feature_list']),
+        "metrics": json.loads(row['metrics'] or "{}"), "kind": row['kind'],
+        "label_watermark": float(row['label_watermark']) if row['label_watermark'] is not None else None,
+        "full_refit_at": float(row['full_refit_at'] or 0.0)
+    }
+
+async def load_model_registry(pool):
+    """
+    مزامنة البطل والمتحدين من ml_models (عند الإقلاع ودورياً في كل النسخ).
+    النماذج المحمّلة مسبقاً لا يُعاد جلبها ولا فكها؛ البايتات تُقرأ فقط للنسخ الجديدة.
+    """
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT 1 FROM ml_models WHERE role = 'champion'"):
+            # أول إقلاع بعد إضافة الأدوار: آخر نسخة محفوظة تصبح البطل
+            await conn.execute("UPDATE ml_models SET role = 'champion' WHERE id = (SELECT MAX(id) FROM ml_models)")
+        rows = await conn.fetch(
+            f"SELECT {ML_REGISTRY_COLUMNS} FROM ml_models WHERE role IN ('champion', 'challenger') ORDER BY id DESC"
+        )
+        rows = [r for r in rows if list(r['feature_list']) == ml_feature_columns() or r['role'] == 'champion']
+        champion_row = next((r for r in rows if r['role'] == 'champion'), None)
+        challenger_rows = [r for r in rows if r['role'] == 'challenger'][:ML_MAX_CHALLENGERS]
+        if champion_row is None:
+            print("💾 [Model Registry] No saved model yet.")
+            return False
+        if list(champion_row['feature_list']) != ml_feature_columns():
+            print(f"⚠️ [Model Registry] Model v{champion_row['id']} has a different feature list. Waiting for a retrain.")
+            return False
+
+        _, champion, champion_meta = AI_MODEL_ACTIVE
+        loaded = {v: m for v, m, _ in AI_CHALLENGERS}
+        if champion is not None:
+            loaded[champion_meta["version"]] = champion
+        missing = [r['id'] for r in [champion_row, *challenger_rows] if r['id'] not in loaded]
+        blobs = await conn.fetch("SELECT id, model_blob FROM ml_models WHERE id = ANY($1::int[])", missing) if missing else []
+    for row in blobs:
+        loaded[row['id']] = await asyncio.to_thread(deserialize_model, row['model_blob'])
+
+    set_challengers([(r['id'], loaded[r['id']], _registry_meta(r)) for r in challenger_rows])
+    if champion_row['id'] != champion_meta["version"] or champion is None:
+        install_model(loaded[champion_row['id']], **_registry_meta(champion_row))
+        print(f"💾 [Model Registry] Champion v{champion_row['id']} ({champion_row['sample_count']} samples) | Challengers: {[r['id'] for r in challenger_rows]}")
     return True
 
+async def model_registry_worker(pool):
+    """كل النسخ (وليس القائد فقط) تتبع الترقيات والمتحدين الجدد لأنها كلها تكتب عينات"""
+    while True:
+        await asyncio.sleep(ML_REGISTRY_SYNC_SECONDS)
+        try:
+            await load_model_registry(pool)
+        except Exception as e:
+            print(f"⚠️ [Model Registry] Sync Error: {e}")
+
+def shadow_outcome_deltas(rows, champion_version):
+    """
+    لكل نموذج: مصفوفة (k × 4) = [خطأه², إصابة الاتجاه، خطأ البطل², إصابة البطل] على نفس العينات.
+    نحتسب فقط العينات التي قيّمها البطل الحالي (أول عنصر في المصفوفة) حتى تبقى المقارنة زوجية.
+    """
+    per_model = {}
+    for model_ids, preds, target in rows:
+        if not model_ids or model_ids[0] != champion_version or preds is None or target is None:
+            continue
+        champion_err = (preds[0] - target) ** 2
+        champion_hit = float((preds[0] > 0) == (target > 0))
+        for model_id, pred in zip(model_ids, preds):
+            if model_id is None or pred is None:
+                continue
+            per_model.setdefault(model_id, []).append(
+                ((pred - target) ** 2, float((pred > 0) == (target > 0)), champion_err, champion_hit)
+            )
+    return {model_id: np.asarray(values, dtype=np.float64) for model_id, values in per_model.items()}
+
+async def record_shadow_outcomes(conn, rows):
+    """تحديث تزايدي للدقة المتدحرجة (تضاؤل أسّي لكل وسم) بدل إعادة حسابها من كل التاريخ"""
+    deltas = shadow_outcome_deltas(rows, AI_MODEL_ACTIVE[2]["version"])
+    if not deltas:
+        return 0
+    decay = 0.5 ** (1.0 / ML_SHADOW_HALF_LIFE)
+    async with conn.transaction():
+        existing = {r['model_id']: r for r in await conn.fetch("""
+            SELECT model_id, weight, sse, hits, champion_sse, champion_hits, labels
+            FROM ml_model_scores WHERE model_id = ANY($1::int[]) FOR UPDATE
+        """, list(deltas))}
+        updates = []
+        for model_id, values in deltas.items():
+            k = len(values)
+            weights = decay ** np.arange(k - 1, -1, -1, dtype=np.float64) # الأحدث بوزن 1
+            old = existing.get(model_id)
+            prev = np.array([old[c] for c in ("weight", "sse", "hits", "champion_sse", "champion_hits")]) if old else np.zeros(5)
+            state = prev * decay ** k + np.concatenate([[weights.sum()], weights @ values])
+            updates.append((model_id, *map(float, state), (old['labels'] if old else 0) + k))
+        cols = [list(c) for c in zip(*updates)]
+        await conn.execute("""
+            INSERT INTO ml_model_scores (model_id, weight, sse, hits, champion_sse, champion_hits, labels, updated_at)
+            SELECT u.*, CURRENT_TIMESTAMP FROM unnest($1::int[], $2::float8[], $3::float8[], $4::float8[],
+                                                    $5::float8[], $6::float8[], $7::bigint[]) AS u
+            ON CONFLICT (model_id) DO UPDATE SET
+                weight = EXCLUDED.weight, sse = EXCLUDED.sse, hits = EXCLUDED.hits,
+                champion_sse = EXCLUDED.champion_sse, champion_hits = EXCLUDED.champion_hits,
+                labels = EXCLUDED.labels, updated_at = CURRENT_TIMESTAMP
+        """, *cols)
+    return sum(len(v) for v in deltas.values())
+
+def shadow_score_summary(row):
+    weight = max(row['weight'], 1e-9)
+    return {
+        "rmse": math.sqrt(row['sse'] / weight), "hit_rate": row['hits'] / weight * 100,
+        "champion_rmse": math.sqrt(row['champion_sse'] / weight), "champion_hit_rate": row['champion_hits'] / weight * 100,
+        "labels": row['labels']
+    }
+
+async def maybe_promote_challenger(pool):
+    """
+    ترقية تلقائية: متحدٍ بعدد وسوم كافٍ يخفض RMSE البطل بالهامش المطلوب على نفس العينات
+    دون أن يخسر في نسبة إصابة الاتجاه. الإحصاءات تُصفّر بعد الترقية (خط أساس جديد).
+    """
+    champion_version = AI_MODEL_ACTIVE[2]["version"]
+    challengers = [v for v, _, _ in AI_CHALLENGERS]
+    if champion_version is None or not challengers:
+        return None
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT model_id, weight, sse, hits, champion_sse, champion_hits, labels
+            FROM ml_model_scores WHERE model_id = ANY($1::int[]) AND labels >= $2
+        """, challengers, ML_PROMOTION_MIN_LABELS)
+        best = None
+        for row in rows:
+            summary = shadow_score_summary(row)
+            wins = (
+                summary["rmse"] <= summary["champion_rmse"] * (1 - ML_PROMOTION_MARGIN)
+                and summary["hit_rate"] >= summary["champion_hit_rate"]
+            )
+            if wins and (best is None or summary["rmse"] < best[1]["rmse"]):
+                best = (row['model_id'], summary)
+        if best is None:
+            return None
+        async with conn.transaction():
+            await conn.execute("UPDATE ml_models SET role = 'archived' WHERE role = 'champion'")
+            await conn.execute("UPDATE ml_models SET role = 'champion' WHERE id = $1", best[0])
+            await conn.execute("DELETE FROM ml_model_scores")
+    await load_model_registry(pool)
+    summary = best[1]
+    print(f"🥊 [Model Registry] Challenger v{best[0]} promoted over v{champion_version}: "
+          f"RMSE {summary['rmse']:.4f} vs {summary['champion_rmse']:.4f} | hit {summary['hit_rate']:.1f}% vs {summary['champion_hit_rate']:.1f}% "
+          f"({summary['labels']} shadow labels)")
+    return best[0]
+
 async def ai_trainer_worker(pool):
-    """عامل التدريب: يستيقظ كل 12 ساعة لتطوير عقل البوت"""
+    """
+    عامل التدريب: يفحص كل 30 دقيقة. تحديث تزايدي عند تراكم عينات موسومة جديدة كافية،
+    وإعادة بناء كاملة أسبوعياً، وأي نموذج يسوء على عينة الاختبار الثابتة يُرفض.
+    التدريب نفسه يجري في عملية مستقلة محدودة الموارد (run_training_task)، والنتيجة بايتات.
+    النموذج المقبول يدخل كمتحدٍ ظلي (إلا أول نموذج فيصبح البطل مباشرة) والترقية تتم عبر maybe_promote_challenger.
+    """
     await asyncio.sleep(60) 
+    retry_after_fresh = ML_MODEL_MIN_NEW_LABELS
     while True:
+        await wait_for_leadership("AI Trainer")
         try:
+            generation, current_model, meta = AI_MODEL_ACTIVE
+            challengers = AI_CHALLENGERS
+            since = meta["label_watermark"] or 0.0
+            # الجديد يُقاس منذ آخر نموذج مُدرَّب (بطلاً أو متحدياً) حتى لا نعيد إنتاج نفس المتحدي كل دورة
+            trained_until = max([since] + [c_meta["label_watermark"] or 0.0 for _, _, c_meta in challengers])
+            last_full_refit = max([meta["full_refit_at"]] + [c_meta["full_refit_at"] for _, _, c_meta in challengers])
             async with pool.acquire() as conn:
-                # جلب البيانات المؤسساتية بالكامل
-                records = await conn.fetch("""
-                    SELECT market_regime, sp500_trend_pct, sentiment_score, 
-                           vol_z_score, cvd_to_vol_ratio, imbalance_ratio, 
-                           ob_skewness, whale_dominance_pct, adx, rsi, 
-                           micro_volatility_pct, cvd_divergence, funding_rate,
-                           trade_quality_score
-                    FROM ml_training_data 
-                    WHERE is_processed = 1
-                """)
-                
-                if len(records) >= 100: # 🎯 عتبة الانطلاق (Critical Mass)
-                    print(f"🧠 [AI Trainer] Mass training on {len(records)} samples...")
-                    records_dict = [dict(r) for r in records]
-                    await asyncio.to_thread(train_xgboost_sync, records_dict)
-                    print("✅ [AI Trainer] Engine Optimized to Hedge Fund Level.")
+                counts = await conn.fetchrow("""
+                    SELECT COUNT(*) AS labeled,
+                           COUNT(*) FILTER (WHERE labeled_at > to_timestamp($1)::timestamp) AS fresh,
+                           EXTRACT(EPOCH FROM MAX(labeled_at)) AS watermark
+                    FROM ml_training_data WHERE is_processed = 1
+                """, trained_until)
+                labeled, fresh = counts['labeled'], counts['fresh']
+                watermark = float(counts['watermark']) if counts['watermark'] is not None else None
+
+            full_refit = current_model is None or time.time() - last_full_refit >= ML_FULL_REFIT_SECONDS
+            train = None
+            if labeled < MIN_TRAINING_SAMPLES: # 🎯 عتبة الانطلاق (Critical Mass)
+                print(f"⏳ [AI Trainer] Collecting data... ({labeled}/{MIN_TRAINING_SAMPLES})")
+            elif full_refit:
+                train = await stream_training_arrays(pool, f" AND id % {ML_HOLDOUT_MODULUS} <> 0")
+            elif fresh >= retry_after_fresh:
+                train = await stream_training_arrays(
+                    pool,
+                    f" AND id % {ML_HOLDOUT_MODULUS} <> 0"
+                    " AND labeled_at > to_timestamp($1)::timestamp AND labeled_at <= to_timestamp($2)::timestamp",
+                    since, watermark
+                )
+
+            if train is not None and len(train["y"]):
+                holdout = await stream_training_arrays(pool, f" AND id % {ML_HOLDOUT_MODULUS} = 0")
+                train_rows = len(train["y"])
+                mode = "full" if full_refit else "incremental"
+                print(f"🧠 [AI Trainer] {mode.title()} training on {train_rows} samples (holdout: {len(holdout['y'])})...")
+                # في إعادة البناء الكاملة يُستخدم النموذج الحالي للمقارنة فقط في حارس الاختبار
+                prev_blob = serialize_model(current_model) if current_model is not None else None
+                # معاملات /ml_search المعتمدة (إن وُجدت) تبقى مع البطل عبر التحديثات وإعادة البناء
+                blob, metrics, accepted = await run_training_task(
+                    update_model_artifact, prev_blob, train["X"], train["y"], holdout["X"], holdout["y"], full_refit,
+                    meta["metrics"].get("params")
+                )
+                del train, holdout
+                now = time.time()
+                if accepted:
+                    sample_count = train_rows if full_refit else meta["sample_count"] + train_rows
+                    full_refit_at = now if full_refit else meta["full_refit_at"]
+                    new_model = await asyncio.to_thread(deserialize_model, blob)
+                    role = "champion" if current_model is None else "challenger"
+                    version = await save_model_version(
+                        pool, blob, sample_count, metrics, kind=mode, label_watermark=watermark,
+                        full_refit_at=full_refit_at, parent_id=None if full_refit else meta["version"], role=role
+                    )
+                    new_meta = dict(
+                        version=version, sample_count=sample_count, features=ml_feature_columns(), metrics=metrics,
+                        kind=mode, label_watermark=watermark, full_refit_at=full_refit_at
+                    )
+                    retry_after_fresh = ML_MODEL_MIN_NEW_LABELS
+                    if role == "challenger":
+                        set_challengers(((version, new_model, new_meta),) + AI_CHALLENGERS)
+                        print(f"🥊 [AI Trainer] v{version} entered shadow evaluation as a challenger to v{meta['version']} ({mode}, {metrics['n_trees']} trees, holdout RMSE: {metrics['holdout_rmse']}).")
+                    elif install_model(new_model, expected_generation=generation, **new_meta) is None:
+                        print(f"⚠️ [AI Trainer] v{version} saved but not activated: the active model changed during training.")
+                    else:
+                        print(f"✅ [AI Trainer] Engine Optimized to Hedge Fund Level. Saved as champion v{version} ({mode}, {metrics['n_trees']} trees, holdout RMSE: {metrics['holdout_rmse']}).")
                 else:
-                    print(f"⏳ [AI Trainer] Collecting data... ({len(records)}/100)")
+                    # نبقي النموذج الحالي، وننتظر دفعة جديدة كاملة قبل المحاولة التالية
+                    if full_refit:
+                        update_model_meta(full_refit_at=now)
+                    retry_after_fresh = fresh + ML_MODEL_MIN_NEW_LABELS
+                    print(f"🛡️ [AI Trainer] {mode.title()} update rejected: holdout RMSE {metrics['holdout_rmse']:.4f} vs {metrics['prev_holdout_rmse']:.4f}. Keeping v{meta['version']}.")
                     
         except Exception as e:
             print(f"⚠️ AI Trainer Error: {e}")
-        await asyncio.sleep(43200) # 12 ساعة
+        await asyncio.sleep(ML_TRAINER_CHECK_SECONDS)
+
+# ====================================================================
+# 🔬 بحث المعاملات الفائقة (Purged Walk-Forward CV) ومقايضة الدقة/زمن التنبؤ
+# ====================================================================
+# الطيات زمنية متوسعة حسب signal_time: كل طية تتدرب على الماضي فقط وتُختبر على الكتلة التالية،
+# وتُحذف (Purge) عينات التدريب التي تتداخل نافذة وسمها (24 ساعة) مع بداية الاختبار.
+# عينة الاختبار الثابتة (id % 5 == 0) خارج البحث تماماً لتبقى حكماً نظيفاً للفائز.
+ML_SEARCH_WORKERS = int(os.getenv("ML_SEARCH_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+ML_SEARCH_FOLDS = 4
+ML_SEARCH_PURGE_SECONDS = 24 * 3600 # نفس أفق الوسم: النتيجة تُعرف بعد 24 ساعة من الإشارة
+ML_SEARCH_MIN_ROWS = 500
+ML_SEARCH_PARALLEL_MIN_ROWS = 10_000 # أقل من ذلك يكون التدريب داخل العملية أسرع من تشغيل عمال spawn
+ML_SEARCH_LATENCY_TARGET_US = float(os.getenv("ML_SEARCH_LATENCY_TARGET_US", 500)) # زمن تنبؤ صف واحد (الوسيط)
+ML_SEARCH_LATENCY_CALLS = 300
+ML_SEARCH_BATCH_ROWS = 256 # دفعة الرادار النموذجية لقياس زمن الصف داخل الدفعة
+ML_SEARCH_SPACE = {
+    "n_estimators": (100, 200, 400, 800),
+    "max_depth": (3, 5, 7),
+    "learning_rate": (0.03, 0.1)
+}
+_ML_SEARCH_SHARED = {"shm": None, "data": None}
 
-def predict_signal_sync(features: dict) -> float:
-    """يتوقع جودة الصفقة بناءً على النموذج المدرب"""
-    if AI_QUANT_MODEL is None:
-        return -1.0 
-        
-    input_data = pd.DataFrame([{
-        'market_regime': int(features.get('market_regime', 0)),
-        'sp500_trend_pct': float(features.get('sp500_trend', 0.0)),
-        'sentiment_score': float(features.get('sentiment_score', 50.0)),
-        'vol_z_score': float(features.get('z_score', 0.0)),
-        'cvd_to_vol_ratio': float(features.get('cvd_to_vol_ratio', 0.0)),
-        'imbalance_ratio': float(features.get('ofi_imbalance', 0.0)),
-        'ob_skewness': float(features.get('ob_skewness', 1.0)),
-        'whale_dominance_pct': float(features.get('whale_inflow', 0.0)),
-        'adx': float(features.get('adx', 0.0)),
-        'rsi': float(features.get('rsi', 50.0)),
-        'micro_volatility_pct': float(features.get('micro_volatility', 0.0)),
-        'cvd_divergence': float(features.get('cvd_divergence', 0.0)),
-        'funding_rate': float(features.get('funding_rate', 0.0))
-    }])
-
-    # التنبؤ بسكور الجودة المتوقع
-    predicted_quality = AI_QUANT_MODEL.predict(input_data)[0]
-    
+def build_search_configs(space=None):
+    space = space or ML_SEARCH_SPACE
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+def build_purged_folds(signal_time, n_folds=ML_SEARCH_FOLDS, purge_seconds=ML_SEARCH_PURGE_SECONDS):
+    """
+    signal_time مرتب تصاعدياً -> [(train_end, test_start, test_end)] كنطاقات صفوف متصلة.
+    الكتلة الأولى تدريب فقط، وكل طية تتدرب على ما قبل اختبارها ناقصاً فترة التطهير.
+    """
+    edges = np.linspace(0, len(signal_time), n_folds + 2).astype(np.int64)
+    folds = []
+    for k in range(1, n_folds + 1):
+        test_start, test_end = int(edges[k]), int(edges[k + 1])
+        if test_end - test_start < ML_HOLDOUT_MIN_ROWS:
+            continue
+        train_end = int(np.searchsorted(signal_time, signal_time[test_start] - purge_seconds, side="left"))
+        if train_end >= ML_HOLDOUT_MIN_ROWS:
+            folds.append((train_end, test_start, test_end))
+    return folds
+
+def evaluate_search_config(data, folds, config, n_jobs=None):
+    """
+    RMSE كل الطيات لإعداد واحد. data: (N, 14) = الميزات ثم الجودة، مرتبة زمنياً.
+    يعيد نموذج الطية الأخيرة (الأكبر تدريباً) مسلسلاً لقياس زمن التنبؤ خارج العمال.
+    """
+    X, y = data[:, :-1], data[:, -1]
+    params = {k: v for k, v in config.items() if k != "n_estimators"}
+    if n_jobs:
+        params["n_jobs"] = n_jobs
+    fold_rmse, fit_seconds, model = [], 0.0, None
+    for train_end, test_start, test_end in folds:
+        started = time.perf_counter()
+        model = fit_xgboost_model(X[:train_end], y[:train_end], n_estimators=config["n_estimators"], params=params)
+        fit_seconds += time.perf_counter() - started
+        fold_rmse.append(holdout_rmse(model, X[test_start:test_end], y[test_start:test_end]))
+    return {
+        "config": config, "rmse": float(np.mean(fold_rmse)), "rmse_std": float(np.std(fold_rmse)),
+        "fold_rmse": fold_rmse, "fit_seconds": fit_seconds, "blob": serialize_model(model)
+    }
+
+def _ml_search_worker_init(shm_name, shape):
+    """العامل يرتبط بمصفوفة التدريب المشتركة مرة واحدة (بدون نسخ ولا Pickle)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _ML_SEARCH_SHARED["shm"] = shm
+    _ML_SEARCH_SHARED["data"] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+
+def _ml_search_worker_eval(config, folds):
+    # خيط واحد لكل عامل: التوازي بين الإعدادات وليس داخل الشجرة
+    return evaluate_search_config(_ML_SEARCH_SHARED["data"], folds, config, n_jobs=1)
+
+def measure_predict_latency(model, X, calls=ML_SEARCH_LATENCY_CALLS, batch_rows=ML_SEARCH_BATCH_ROWS):
+    """زمن صف واحد (الوسيط وp95 بالميكروثانية) وزمن الصف داخل دفعة، عبر نفس inplace_predict الحي"""
+    booster = model.get_booster()
+    rng = np.random.default_rng(0)
+    rows = X[rng.integers(0, len(X), size=calls)]
+    for i in range(min(20, calls)): # إحماء
+        booster.inplace_predict(rows[i:i + 1])
+    single = np.empty(calls)
+    for i in range(calls):
+        started = time.perf_counter_ns()
+        booster.inplace_predict(rows[i:i + 1])
+        single[i] = (time.perf_counter_ns() - started) / 1000.0
+    batch = np.ascontiguousarray(X[:batch_rows])
+    started = time.perf_counter_ns()
+    for _ in range(10):
+        booster.inplace_predict(batch)
+    batch_us = (time.perf_counter_ns() - started) / 1000.0 / 10 / max(1, len(batch))
+    return {
+        "latency_p50_us": float(np.median(single)), "latency_p95_us": float(np.percentile(single, 95)),
+        "batch_row_us": float(batch_us), "n_trees": int(booster.num_boosted_rounds())
+    }
+
+def search_pareto_front(results):
+    """الإعدادات التي لا يتفوق عليها أي إعداد أسرع منها في الدقة"""
+    front, best = [], float("inf")
+    for r in sorted(results, key=lambda r: (r["latency_p50_us"], r["rmse"])):
+        if r["rmse"] < best:
+            front.append(r)
+            best = r["rmse"]
+    return front
+
+def run_hyperparam_search(X, y, signal_time, configs=None, workers=ML_SEARCH_WORKERS,
+                          latency_target_us=ML_SEARCH_LATENCY_TARGET_US):
+    """
+    يعمل داخل عملية التدريب المعزولة: ترتيب زمني وطيات مطهرة، ثم توزيع الإعدادات على Pool عمال (spawn)
+    فوق ذاكرة مشتركة، ثم قياس زمن التنبؤ لكل نموذج بالتتابع (بدون تزاحم العمال على المعالج).
+    الفائز = أقل RMSE بين الإعدادات التي يحقق وسيط زمن صفها الواحد الهدف.
+    """
+    started = time.perf_counter()
+    configs = configs or build_search_configs()
+    order = np.argsort(signal_time, kind="stable")
+    data = np.empty((len(order), X.shape[1] + 1), dtype=np.float32)
+    data[:, :-1] = X[order]
+    data[:, -1] = y[order]
+    folds = build_purged_folds(np.asarray(signal_time, dtype=np.float64)[order])
+    if len(order) < ML_SEARCH_MIN_ROWS or not folds:
+        raise ValueError(f"Not enough labeled rows for {ML_SEARCH_FOLDS} purged folds ({len(order)} rows)")
+
+    if len(configs) < 2 or len(order) < ML_SEARCH_PARALLEL_MIN_ROWS:
+        workers = 1
+    if workers <= 1:
+        results = [evaluate_search_config(data, folds, c) for c in configs]
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        try:
+            np.ndarray(data.shape, dtype=np.float32, buffer=shm.buf)[:] = data
+            ctx = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=ctx, initializer=_ml_search_worker_init, initargs=(shm.name, data.shape)
+            ) as executor:
+                results = list(executor.map(_ml_search_worker_eval, configs, [folds] * len(configs)))
+        finally:
+            shm.close()
+            shm.unlink()
+    cv_done = time.perf_counter()
+
+    for r in results:
+        r.update(measure_predict_latency(deserialize_model(r.pop("blob")), data[:, :-1]))
+    eligible = [r for r in results if r["latency_p50_us"] <= latency_target_us]
+    results.sort(key=lambda r: r["rmse"])
+    return {
+        "rows": len(order), "configs": len(results), "workers": workers,
+        "folds": [{"train": train_end, "test": test_end - test_start} for train_end, test_start, test_end in folds],
+        "results": results, "pareto": search_pareto_front(results),
+        "winner": min(eligible, key=lambda r: r["rmse"]) if eligible else None,
+        "latency_target_us": latency_target_us,
+        "cv_seconds": cv_done - started, "bench_seconds": time.perf_counter() - cv_done
+    }
+
+async def register_search_winner(pool, params):
+    """
+    الفائز يُدرَّب على كل عينات التدريب ويمر بنفس حارس الاختبار ضد البطل، ثم يدخل كمتحدٍ ظلي
+    (الترقية تبقى لقرار maybe_promote_challenger على الوسوم الحية). يعيد (رقم النسخة أو None، المقاييس).
+    """
+    _, champion, meta = AI_MODEL_ACTIVE
+    train = await stream_training_arrays(pool, f" AND id % {ML_HOLDOUT_MODULUS} <> 0")
+    holdout = await stream_training_arrays(pool, f" AND id % {ML_HOLDOUT_MODULUS} = 0")
+    prev_blob = serialize_model(champion) if champion is not None else None
+    blob, metrics, accepted = await run_training_task(
+        update_model_artifact, prev_blob, train["X"], train["y"], holdout["X"], holdout["y"], True, params
+    )
+    if not accepted:
+        return None, metrics
+    labeled = np.concatenate([train["labeled_at"], holdout["labeled_at"]])
+    watermark = float(np.nanmax(labeled)) if len(labeled) else None
+    sample_count, now = len(train["y"]), time.time()
+    role = "champion" if champion is None else "challenger"
+    version = await save_model_version(
+        pool, blob, sample_count, metrics, kind="search", label_watermark=watermark, full_refit_at=now, role=role
+    )
+    new_model = await asyncio.to_thread(deserialize_model, blob)
+    new_meta = dict(
+        version=version, sample_count=sample_count, features=ml_feature_columns(), metrics=metrics,
+        kind="search", label_watermark=watermark, full_refit_at=now
+    )
+    if role == "challenger":
+        set_challengers(((version, new_model, new_meta),) + AI_CHALLENGERS)
+    else:
+        install_model(new_model, **new_meta)
+    return version, metrics
+
+def features_to_vector(features: dict):
+    """قاموس الميزات -> صف float32 بترتيب ML_FEATURE_SPEC الثابت (نفس أعمدة التدريب)"""
+    return np.array([cast(features.get(key, default)) for _, key, default, cast in ML_FEATURE_SPEC], dtype=np.float32)
+
+def features_to_matrix(feature_dicts):
+    if not feature_dicts:
+        return np.empty((0, len(ML_FEATURE_SPEC)), dtype=np.float32)
+    return np.vstack([features_to_vector(f) for f in feature_dicts])
+
+def predict_quality_batch(matrix) -> np.ndarray:
+    """
+    تنبؤ دفعي لمصفوفة (N × 13) عبر inplace_predict (بدون DataFrame ولا DMatrix).
+    يعيد نسب الثقة (0-100%) أو -1 لكل صف إذا لم يتدرب النموذج بعد.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    model = AI_MODEL_ACTIVE[1] # قراءة واحدة: التبديل المتزامن لا يؤثر على هذا التنبؤ
+    if model is None or len(matrix) == 0:
+        return np.full(len(matrix), -1.0)
+    predicted_quality = model.get_booster().inplace_predict(matrix)
     # تحويل السكور (من -1 إلى 1) إلى نسبة مئوية (0% إلى 100%) لسهولة القراءة
-    confidence_pct = ((predicted_quality + 1) / 2) * 100
-    return float(confidence_pct)
+    return ((predicted_quality.astype(np.float64) + 1) / 2) * 100
+
+def predict_all_models(matrix):
+    """
+    البطل + كل المتحدين على نفس المصفوفة: (أرقام النسخ، تنبؤات خام (M × N) من -1 إلى 1)، البطل أولاً.
+    بدون بطل لا يوجد تقييم ظلي (المقارنة زوجية دائماً).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    _, champion, meta = AI_MODEL_ACTIVE
+    if champion is None or len(matrix) == 0:
+        return [], np.empty((0, len(matrix)), dtype=np.float32)
+    models = [(meta["version"], champion)] + [(v, m) for v, m, _ in AI_CHALLENGERS]
+    preds = np.vstack([m.get_booster().inplace_predict(matrix) for _, m in models]).astype(np.float32)
+    return [v for v, _ in models], preds
+
+def predict_signal_sync(features: dict) -> float:
+    """يتوقع جودة الصفقة بناءً على النموذج المدرب (صف واحد عبر نفس المسار الدفعي)"""
+    return float(predict_quality_batch(features_to_vector(features)[None, :])[0])
+
+def attach_ai_scores(results):
+    """
+    يقيّم كل المرشحين الناجين من دورة الرادار في استدعاء واحد،
+    ويضع ai_raw_score و ai_status في كل نتيجة (الوضع الظلي: لا يغير قرار الرادار).
+    """
+    metas = [r for r in results if r and r.get("ml_features")]
+    if not metas:
+        return results
+    # نداء واحد لكل النماذج: رأي البطل للعرض، وتنبؤات الجميع تُحفظ مع العينة للتقييم الظلي
+    model_ids, preds = predict_all_models(features_to_matrix([r["ml_features"] for r in metas]))
+    scores = (preds[0].astype(np.float64) + 1) / 2 * 100 if model_ids else np.full(len(metas), -1.0)
+    for i, (meta, ai_confidence) in enumerate(zip(metas, scores)):
+        ai_confidence = round(float(ai_confidence), 1)
+        meta["ml_predictions"] = (model_ids, preds[:, i].tolist()) if model_ids else None
+        meta["ai_raw_score"] = ai_confidence
+        if ai_confidence != -1.0:
+            # طباعة النسبة للأدمن دون أي تدخل في القرار
+            meta["ai_status"] = f"Shadow Mode 👁️ (Score: {ai_confidence:.1f}%)"
+        else:
+            # في حال لم يتدرب النموذج بعد (أقل من 100 صفقة)
+            meta["ai_status"] = "Training & Learning ⏳"
+    return results
+
+def benchmark_ml_inference(n_rows: int = 350, repeats: int = 5):
+    """
+    مقارنة زمن التنبؤ (ملي ثانية لكل دورة من n_rows عملة):
+    المسار القديم (DataFrame بصف واحد لكل عملة)، inplace_predict لكل عملة، ودفعة واحدة.
+    """
+    model = AI_MODEL_ACTIVE[1]
+    if model is None:
+        return None
+    rng = np.random.default_rng(11)
+    matrix = rng.normal(0.0, 1.0, size=(n_rows, len(ML_FEATURE_SPEC))).astype(np.float32)
+    columns = ml_feature_columns()
+    frames = [pd.DataFrame([dict(zip(columns, row))]) for row in matrix[: min(n_rows, 50)]]
+
+    start = time.perf_counter()
+    for frame in frames:
+        model.predict(frame)
+    legacy_ms = (time.perf_counter() - start) * 1000.0 * n_rows / len(frames)
+
+    booster = model.get_booster()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(n_rows):
+            booster.inplace_predict(matrix[i:i + 1])
+    single_ms = (time.perf_counter() - start) * 1000.0 / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict_quality_batch(matrix)
+    batch_ms = (time.perf_counter() - start) * 1000.0 / repeats
+    return {"rows": n_rows, "legacy_ms": legacy_ms, "single_ms": single_ms, "batch_ms": batch_ms}
 
 # --- دوال الرادار المساعدة (ضعها فوق دالة الرادار) ---
 async def get_recent_orderflow_delta(symbol, client, limit=500):
@@ -352,6 +935,130 @@ async def get_recent_orderflow_delta(symbol, client, limit=500):
 # البنية: {"BTCUSDT": {"volume": 1000000, "price": 65000, "last_update": 1712000000}}
 live_market_memory = {}
 
+# ====================================================================
+# 🛰️ طبقة التنسيق بين النسخ (Postgres-Coordinated Sharding & Leader Election)
+# ====================================================================
+# كل نسخة (Container) تحجز مجموعة أقسام (Shards) من كون العملات عبر SKIP LOCKED وتجددها بنبضات،
+# فتمسح كل نسخة شريحة منفصلة. العمال الفرديون (المدرب، الماكرو، المفتش) يعملون على القائد فقط.
+SCAN_SHARD_COUNT = int(os.getenv("SCAN_SHARD_COUNT", 8))
+CLUSTER_LEASE_TTL = 90 # ثانية: أي حجز لم يتجدد خلالها يصبح متاحاً لنسخة أخرى
+CLUSTER_HEARTBEAT_SECONDS = 30
+CLUSTER_STATE = {
+    "replica_id": f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}",
+    "shards": set(),
+    "is_leader": False,
+    "members": 1
+}
+
+def symbol_shard(symbol: str) -> int:
+    """نفس العملة تقع دائماً في نفس القسم (بغض النظر عن لاحقة USDT)"""
+    base = symbol[:-4] if symbol.endswith("USDT") else symbol
+    return zlib.crc32(base.encode()) % SCAN_SHARD_COUNT
+
+def owns_symbol(symbol: str) -> bool:
+    """
+    Fail-Open: ما دامت النسخة لا ترى أقراناً (قبل أول نبضة ناجحة، أو نسخة وحيدة فعلاً) تملك كل الأقسام،
+    فلا يتوقف المسح إذا فشل أول حجز أو بقيت أقسام محجوزة باسم نسخة سابقة ميتة حتى تنتهي صلاحيتها.
+    """
+    if CLUSTER_STATE["members"] <= 1:
+        return True
+    return symbol_shard(symbol) in CLUSTER_STATE["shards"]
+
+async def cluster_heartbeat_tick(pool):
+    me = CLUSTER_STATE["replica_id"]
+    ttl = float(CLUSTER_LEASE_TTL)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO cluster_members (replica_id, last_seen) VALUES ($1, CURRENT_TIMESTAMP)
+                ON CONFLICT (replica_id) DO UPDATE SET last_seen = CURRENT_TIMESTAMP
+            """, me)
+            await conn.execute("DELETE FROM cluster_members WHERE last_seen < CURRENT_TIMESTAMP - make_interval(secs => $1)", ttl * 10)
+            members = await conn.fetchval("SELECT COUNT(*) FROM cluster_members WHERE last_seen > CURRENT_TIMESTAMP - make_interval(secs => $1)", ttl)
+
+            # 1. تجديد الأقسام المحجوزة حالياً
+            renewed = await conn.fetch("""
+                UPDATE scan_shard_leases SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => $2)
+                WHERE owner = $1 AND shard_id < $3 RETURNING shard_id
+            """, me, ttl, SCAN_SHARD_COUNT)
+            mine = {r['shard_id'] for r in renewed}
+
+            # 2. الموازنة: كل نسخة تأخذ حصتها العادلة فقط
+            fair_share = math.ceil(SCAN_SHARD_COUNT / max(1, members))
+            if len(mine) > fair_share:
+                extra = sorted(mine)[fair_share:]
+                await conn.execute("""
+                    UPDATE scan_shard_leases SET owner = NULL, lease_until = NULL
+                    WHERE owner = $1 AND shard_id = ANY($2::int[])
+                """, me, extra)
+                mine -= set(extra)
+            elif len(mine) < fair_share:
+                claimed = await conn.fetch("""
+                    UPDATE scan_shard_leases SET owner = $1, lease_until = CURRENT_TIMESTAMP + make_interval(secs => $2)
+                    WHERE shard_id IN (
+                        SELECT shard_id FROM scan_shard_leases
+                        WHERE shard_id < $4 AND (owner IS NULL OR lease_until < CURRENT_TIMESTAMP)
+                        ORDER BY shard_id
+                        LIMIT $3
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING shard_id
+                """, me, ttl, fair_share - len(mine), SCAN_SHARD_COUNT)
+                mine |= {r['shard_id'] for r in claimed}
+
+            # 3. انتخاب القائد (Lease-Based): نحتفظ بالقيادة أو نأخذها إذا انتهت صلاحية القائد السابق
+            leader = await conn.fetchval("""
+                INSERT INTO cluster_leader (id, owner, lease_until)
+                VALUES (1, $1, CURRENT_TIMESTAMP + make_interval(secs => $2))
+                ON CONFLICT (id) DO UPDATE SET owner = EXCLUDED.owner, lease_until = EXCLUDED.lease_until
+                WHERE cluster_leader.owner = EXCLUDED.owner OR cluster_leader.lease_until < CURRENT_TIMESTAMP
+                RETURNING owner
+            """, me, ttl)
+            is_leader = leader == me
+
+            # 4. حالة الماكرو المشتركة: القائد ينشرها والبقية يقرؤونها
+            if is_leader:
+                await conn.execute("""
+                    INSERT INTO cluster_shared_state (key, value, updated_at) VALUES ('macro_cache', $1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
+                """, json.dumps(MACRO_CACHE, default=float))
+            else:
+                shared_macro = await conn.fetchval("SELECT value FROM cluster_shared_state WHERE key = 'macro_cache'")
+                if shared_macro:
+                    MACRO_CACHE.update(json.loads(shared_macro))
+
+    if mine != CLUSTER_STATE["shards"] or is_leader != CLUSTER_STATE["is_leader"]:
+        print(f"🛰️ [Cluster] {me} | Shards: {sorted(mine)}/{SCAN_SHARD_COUNT} | Replicas: {members} | Leader: {is_leader}")
+    CLUSTER_STATE.update({"shards": mine, "is_leader": is_leader, "members": members})
+
+async def cluster_coordinator_worker(pool):
+    while True:
+        await asyncio.sleep(CLUSTER_HEARTBEAT_SECONDS)
+        try:
+            await cluster_heartbeat_tick(pool)
+        except Exception as e:
+            print(f"⚠️ [Cluster] Heartbeat Error: {e}")
+
+async def release_cluster_leases(pool):
+    """تسليم الأقسام والقيادة فوراً عند الإغلاق بدل انتظار انتهاء الصلاحية"""
+    me = CLUSTER_STATE["replica_id"]
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE scan_shard_leases SET owner = NULL, lease_until = NULL WHERE owner = $1", me)
+            await conn.execute("DELETE FROM cluster_leader WHERE owner = $1", me)
+            await conn.execute("DELETE FROM cluster_members WHERE replica_id = $1", me)
+    except Exception as e:
+        print(f"⚠️ [Cluster] Release Error: {e}")
+
+async def wait_for_leadership(worker_name: str):
+    """العمال الفرديون ينتظرون هنا حتى تصبح هذه النسخة هي القائد"""
+    announced = False
+    while not CLUSTER_STATE["is_leader"]:
+        if not announced:
+            print(f"💤 [Cluster] {worker_name} is standing by (not the leader).")
+            announced = True
+        await asyncio.sleep(CLUSTER_HEARTBEAT_SECONDS)
+
 async def smart_radar_watchdog(pool):
     """
     مستشعر النبض اللحظي (Producer): وظيفته فقط التقاط الشذوذ ورميه في الطابور بسرعة البرق
@@ -386,6 +1093,8 @@ async def smart_radar_watchdog(pool):
                         clean_sym = symbol.replace("USDT", "")
                         # 🚫 الحظر الجذري قبل إدخالها للذاكرة اللحظية
                         if clean_sym in BLACKLISTED_COINS: continue
+                        # 🛰️ كل نسخة تراقب شريحتها فقط من الكون
+                        if not owns_symbol(clean_sym): continue
 
                         current_vol = float(ticker['q']) 
                         current_price = float(ticker['c'])
@@ -463,6 +1172,7 @@ async def radar_worker_process(pool):
                     meta = await analyze_radar_coin(coin_mock_data, client, market_regime, sem)
                     
                     if meta:
+                        attach_ai_scores([meta])
                         ai_confidence = meta.get('ai_raw_score', -1.0)
                         
                         # 🎯 The Apex Trigger اللحظي: إذا كان تقييم الـ AI الخفي 80% فما فوق
@@ -625,7 +1335,7 @@ async def detect_btc_relative_strength(symbol: str, client: httpx.AsyncClient, i
     if is_dex:
         return 0.0 # إرجاع حيادي للديكس
         
-    clean_sym = symbol.replace("USDT", "") + "USDT"
+    clean_sym = venue_symbol(symbol, "binance")
 
     
     alt_url = f"{get_random_binance_base()}/api/v3/klines?symbol={clean_sym}&interval=1m&limit=60"
@@ -693,7 +1403,7 @@ async def analyze_orderbook_spoofing_instant(symbol: str, client: httpx.AsyncCli
     if is_dex: # تخطي آمن لعملات الديكس
         return {"is_hollow": False, "imbalance": 0.0, "is_spoofed": False, "bid_pressure_ratio": 1.0}
 
-    clean_sym = symbol.replace("USDT", "") + "USDT"
+    clean_sym = venue_symbol(symbol, "binance")
     url = f"{get_random_binance_base()}/api/v3/depth?symbol={clean_sym}&limit=500"
     
     try:
@@ -738,6 +1448,144 @@ async def analyze_orderbook_spoofing_instant(symbol: str, client: httpx.AsyncCli
     except Exception:
         return {"is_hollow": False, "imbalance": 0.0, "is_spoofed": False}
 
+# ====================================================================
+# 📇 سجل الرموز الموحد (Symbol Registry) من exchangeInfo والمنصات الأخرى
+# ====================================================================
+# بدل بناء الرموز بالتلاعب النصي في كل دالة، نحمّل مرة واحدة: رقم تعريفي ثابت لكل أصل،
+# الصيغة الصحيحة لكل منصة، وجود السبوت/العقود، وحجم التيك. المجسات تتخطى المنصات غير المدرجة.
+SYMBOL_REGISTRY = {
+    "ids": {},        # base -> int id (ثابت عبر التحديثات)
+    "assets": [],     # id -> dict
+    "venues": {},     # venue -> set(base) للمنصات التي نجح تحميلها فقط
+    "updated": 0.0
+}
+SYMBOL_REGISTRY_REFRESH_SECONDS = 6 * 3600
+
+# الصيغ الثابتة لكل منصة (تُستخدم أيضاً كاحتياط عند فشل التحميل)
+VENUE_SYMBOL_FORMATS = {
+    "binance": lambda b: f"{b}USDT",
+    "binance_futures": lambda b: f"{b}USDT",
+    "bybit": lambda b: f"{b}USDT",
+    "okx": lambda b: f"{b}-USDT",
+    "kucoin": lambda b: f"{b}-USDT",
+    "gate": lambda b: f"{b}_USDT",
+    "mexc": lambda b: f"{b}USDT",
+    "bitget": lambda b: f"{b}USDT",
+    "htx": lambda b: f"{b.lower()}usdt"
+}
+
+def base_asset(symbol: str) -> str:
+    """XUSDT / X-USDT / X_USDT / xusdt / X  ->  X"""
+    s = symbol.upper().replace("-", "").replace("_", "")
+    return s[:-4] if s.endswith("USDT") and len(s) > 4 else s
+
+def venue_symbol(symbol: str, venue: str) -> str:
+    return VENUE_SYMBOL_FORMATS[venue](base_asset(symbol))
+
+def symbol_on_venue(symbol: str, venue: str) -> bool:
+    """هل الزوج مدرج فعلاً؟ (Fail-Open: إذا لم يُحمّل سجل المنصة نفترض الوجود)"""
+    listed = SYMBOL_REGISTRY["venues"].get(venue)
+    if listed is None:
+        return True
+    return base_asset(symbol) in listed
+
+def get_symbol_info(symbol: str):
+    sid = SYMBOL_REGISTRY["ids"].get(base_asset(symbol))
+    return SYMBOL_REGISTRY["assets"][sid] if sid is not None else None
+
+def _tick_from_filters(filters):
+    for f in filters:
+        if f.get("filterType") == "PRICE_FILTER":
+            return float(f.get("tickSize", 0) or 0)
+    return 0.0
+
+async def _load_venue_listings(client):
+    """يعيد {venue: {base: tick_size}} للمنصات التي نجح تحميلها"""
+    async def binance_spot():
+        res = await client.get(f"{get_random_binance_base()}/api/v3/exchangeInfo", params={"permissions": "SPOT"}, timeout=15)
+        res.raise_for_status()
+        return {
+            s["baseAsset"]: _tick_from_filters(s.get("filters", []))
+            for s in res.json().get("symbols", [])
+            if s.get("quoteAsset") == "USDT" and s.get("status") == "TRADING"
+        }
+
+    async def binance_futures():
+        res = await client.get("https://fapi.binance.com/fapi/v1/exchangeInfo", timeout=15)
+        res.raise_for_status()
+        return {
+            s["baseAsset"]: _tick_from_filters(s.get("filters", []))
+            for s in res.json().get("symbols", [])
+            if s.get("quoteAsset") == "USDT" and s.get("contractType") == "PERPETUAL" and s.get("status") == "TRADING"
+        }
+
+    async def bybit():
+        res = await client.get("https://api.bybit.com/v5/market/instruments-info", params={"category": "spot"}, timeout=15)
+        res.raise_for_status()
+        return {
+            s["baseCoin"]: float(s.get("priceFilter", {}).get("tickSize", 0) or 0)
+            for s in res.json().get("result", {}).get("list", [])
+            if s.get("quoteCoin") == "USDT" and s.get("status") == "Trading"
+        }
+
+    async def okx():
+        res = await client.get("https://www.okx.com/api/v5/public/instruments", params={"instType": "SPOT"}, timeout=15)
+        res.raise_for_status()
+        return {
+            s["baseCcy"]: float(s.get("tickSz", 0) or 0)
+            for s in res.json().get("data", [])
+            if s.get("quoteCcy") == "USDT" and s.get("state") == "live"
+        }
+
+    loaders = {"binance": binance_spot, "binance_futures": binance_futures, "bybit": bybit, "okx": okx}
+    await binance_rate_limit_event.wait()
+    results = await asyncio.gather(*(fn() for fn in loaders.values()), return_exceptions=True)
+    listings = {}
+    for venue, result in zip(loaders, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ [Symbol Registry] {venue} listing failed (fail-open): {result}")
+            continue
+        listings[venue] = result
+    return listings
+
+async def refresh_symbol_registry():
+    async with httpx.AsyncClient(event_hooks={"response": [track_binance_weight]}) as client:
+        listings = await _load_venue_listings(client)
+    if not listings:
+        return False
+
+    ids, assets = SYMBOL_REGISTRY["ids"], SYMBOL_REGISTRY["assets"]
+    all_bases = sorted(set().union(*(set(v) for v in listings.values())))
+    for base in all_bases:
+        if base not in ids:
+            ids[base] = len(assets)
+            assets.append({"id": ids[base], "base": base})
+
+    for base, sid in ids.items():
+        asset = assets[sid]
+        asset["forms"] = {venue: fmt(base) for venue, fmt in VENUE_SYMBOL_FORMATS.items()}
+        asset["listed"] = {venue for venue, listed in listings.items() if base in listed}
+        asset["spot"] = base in listings.get("binance", {})
+        asset["perp"] = base in listings.get("binance_futures", {})
+        asset["tick_size"] = listings.get("binance", {}).get(base) or next(
+            (listed[base] for listed in listings.values() if listed.get(base)), 0.0
+        )
+
+    # المنصات التي فشل تحميلها تبقى على آخر نسخة ناجحة (أو Fail-Open إن لم تُحمّل أبداً)
+    for venue, listed in listings.items():
+        SYMBOL_REGISTRY["venues"][venue] = set(listed)
+    SYMBOL_REGISTRY["updated"] = time.time()
+    print(f"📇 [Symbol Registry] {len(assets)} assets | " + " | ".join(f"{v}: {len(l)}" for v, l in listings.items()))
+    return True
+
+async def symbol_registry_worker():
+    while True:
+        await asyncio.sleep(SYMBOL_REGISTRY_REFRESH_SECONDS)
+        try:
+            await refresh_symbol_registry()
+        except Exception as e:
+            print(f"⚠️ [Symbol Registry] Refresh Error: {e}")
+
 async def get_institutional_orderflow(symbol, client, minutes=15):
     """ 
     [ULTRA UPGRADED] Global Tick-Level Footprint Engine 🌍
@@ -747,16 +1595,16 @@ async def get_institutional_orderflow(symbol, client, minutes=15):
     end_time = int(time.time() * 1000)
     start_time = end_time - (minutes * 60 * 1000)
     
-    clean_sym = symbol.replace("USDT", "")
-    sym_binance = f"{clean_sym}USDT"
-    sym_bybit = f"{clean_sym}USDT"
-    sym_okx = f"{clean_sym}-USDT"
+    sym_binance = venue_symbol(symbol, "binance")
+    sym_bybit = venue_symbol(symbol, "bybit")
+    sym_okx = venue_symbol(symbol, "okx")
 
     # 🧠 التصحيح المؤسساتي (Microstructure Fix):
     MIN_WHALE_TRADE_USD = 50.0 
     
     # --- دالة فرعية 1: بايننس ---    # --- دالة فرعية 1: بايننس (محدثة كمياً - Smart Money & Algo Detection) ---
     async def fetch_binance():
+        if not symbol_on_venue(sym_binance, "binance"): return 0.0, 0.0, []
         try:
             base_url = get_random_binance_base()
             res = await client.get(f"{base_url}/api/v3/aggTrades", params={
@@ -818,6 +1666,7 @@ async def get_institutional_orderflow(symbol, client, minutes=15):
 
     # --- دالة فرعية 2: Bybit ---
     async def fetch_bybit():
+        if not symbol_on_venue(sym_bybit, "bybit"): return 0.0, 0.0
         try:
             res = await client.get("https://api.bybit.com/v5/market/recent-trade", params={
                 "category": "spot", "symbol": sym_bybit, "limit": 1000
@@ -837,6 +1686,7 @@ async def get_institutional_orderflow(symbol, client, minutes=15):
 
     # --- دالة فرعية 3: OKX ---
     async def fetch_okx():
+        if not symbol_on_venue(sym_okx, "okx"): return 0.0, 0.0
         try:
             res = await client.get("https://www.okx.com/api/v5/market/trades", params={
                 "instId": sym_okx, "limit": 500
@@ -905,9 +1755,12 @@ async def detect_spot_perp_divergence(symbol: str, client: httpx.AsyncClient):
     [Quant Upgrade] True CVD Correlation Engine
     يقيس الانحراف بين سيولة السبوت والعقود عبر الارتباط الإحصائي
     """
-    clean_sym = symbol.replace("USDT", "") + "USDT"
+    clean_sym = venue_symbol(symbol, "binance")
+    # 📇 لا عقود دائمة = لا يوجد انحراف لقياسه (قيمة محايدة بدون طلب 404)
+    if not symbol_on_venue(symbol, "binance_futures") or not symbol_on_venue(symbol, "binance"):
+        return 0.0
     spot_url = f"{get_random_binance_base()}/api/v3/klines?symbol={clean_sym}&interval=1m&limit=60"
-    fapi_url = f"https://fapi.binance.com/fapi/v1/klines?symbol={clean_sym}&interval=1m&limit=60"
+    fapi_url = f"https://fapi.binance.com/fapi/v1/klines?symbol={venue_symbol(symbol, 'binance_futures')}&interval=1m&limit=60"
     
     try:
         await binance_rate_limit_event.wait()
@@ -1024,7 +1877,7 @@ async def detect_flash_spoofing_ws(symbol: str, duration: float = 12.0):
     """
     [UPGRADED] True Order Flow Imbalance (OFI) & Delta Tracking
     """
-    clean_symbol = symbol.replace("USDT", "").lower() + "usdt"
+    clean_symbol = venue_symbol(symbol, "binance").lower() # اسم الستريم بالحروف الصغيرة
     ws_url = f"wss://stream.binance.com:9443/ws/{clean_symbol}@depth20@250ms"
     
     frames = []
@@ -1082,21 +1935,18 @@ async def get_aggregated_orderbook(client: httpx.AsyncClient, symbol: str):
     جلب ودمج الأوردر بوك من 8 منصات لقراءة ضغط الحيتان
     Binance, Bybit, Gate.io, KuCoin, OKX, MEXC, Bitget, HTX
     """
-    sym_binance_mexc = f"{symbol}USDT"
-    sym_gate = f"{symbol}_USDT"
-    sym_kucoin_okx = f"{symbol}-USDT"
-    sym_htx = f"{symbol.lower()}usdt" # HTX تتطلب الحروف الصغيرة
-
     urls = {
-        "binance": f"{get_random_binance_base()}/api/v3/depth?symbol={sym_binance_mexc}&limit=50",
-        "bybit": f"https://api.bybit.com/v5/market/orderbook?category=spot&symbol={sym_binance_mexc}&limit=50",
-        "gate": f"https://api.gateio.ws/api/v4/spot/order_book?currency_pair={sym_gate}&limit=50",
-        "kucoin": f"https://api.kucoin.com/api/v1/market/orderbook/level2_100?symbol={sym_kucoin_okx}",
-        "okx": f"https://www.okx.com/api/v5/market/books?instId={sym_kucoin_okx}&sz=50",
-        "mexc": f"https://api.mexc.com/api/v3/depth?symbol={sym_binance_mexc}&limit=50",
-        "bitget": f"https://api.bitget.com/api/v2/spot/market/orderbook?symbol={sym_binance_mexc}&type=step0&limit=50",
-        "htx": f"https://api.huobi.pro/market/depth?symbol={sym_htx}&type=step0"
+        "binance": f"{get_random_binance_base()}/api/v3/depth?symbol={venue_symbol(symbol, 'binance')}&limit=50",
+        "bybit": f"https://api.bybit.com/v5/market/orderbook?category=spot&symbol={venue_symbol(symbol, 'bybit')}&limit=50",
+        "gate": f"https://api.gateio.ws/api/v4/spot/order_book?currency_pair={venue_symbol(symbol, 'gate')}&limit=50",
+        "kucoin": f"https://api.kucoin.com/api/v1/market/orderbook/level2_100?symbol={venue_symbol(symbol, 'kucoin')}",
+        "okx": f"https://www.okx.com/api/v5/market/books?instId={venue_symbol(symbol, 'okx')}&sz=50",
+        "mexc": f"https://api.mexc.com/api/v3/depth?symbol={venue_symbol(symbol, 'mexc')}&limit=50",
+        "bitget": f"https://api.bitget.com/api/v2/spot/market/orderbook?symbol={venue_symbol(symbol, 'bitget')}&type=step0&limit=50",
+        "htx": f"https://api.huobi.pro/market/depth?symbol={venue_symbol(symbol, 'htx')}&type=step0" # HTX تتطلب الحروف الصغيرة
     }
+    # 📇 تخطي المنصات التي لا يوجد فيها الزوج أصلاً (المنصات غير المفهرسة تبقى Fail-Open)
+    urls = {ex: url for ex, url in urls.items() if symbol_on_venue(symbol, ex)}
 
     async def fetch_ob(exchange, url):
         try:
@@ -1235,7 +2085,9 @@ def detect_smart_money_absorption(df):
 
 async def get_futures_liquidity(symbol: str, client: httpx.AsyncClient, current_price: float, old_price: float):
     fapi_base = "https://fapi.binance.com"
-    pair = f"{symbol}USDT"
+    pair = venue_symbol(symbol, "binance_futures")
+    if not symbol_on_venue(symbol, "binance_futures"):
+        return 0.0, None, 0.0, 0.0 # 📇 لا يوجد عقد دائم لهذه العملة
 
     try:
         # 1. جلب التغير اللحظي للـ OI
@@ -1346,22 +2198,274 @@ def calculate_volume_zscore(df, window=720):
     # إرجاع 3 قيم تماماً كما يتوقع باقي الكود
     return float(current_z), float(last_median), float(last_mad)
 
+# ====================================================================
+# 🌾 ميزانية وزن بايننس للحصاد (Token Bucket)
+# ====================================================================
+HARVEST_CADENCE_SECONDS = 900 # لقطة كاملة للكون كل 15 دقيقة
+HARVEST_CONCURRENCY = 8
+HARVEST_WEIGHT_SHARE = 0.30 # حصة الحاصد من حد الوزن في الدقيقة
+# أوزان السبوت الرسمية (REQUEST_WEIGHT): العمق يتدرج مع limit، والباقي ثابت.
+# طلبات fapi (التمويل، OI، الحيتان) تُحسب على حد العقود المنفصل فلا تدخل هنا.
+BINANCE_SPOT_WEIGHTS = {"/api/v3/klines": 2, "/api/v3/aggTrades": 4, "/api/v3/trades": 25}
+
+def binance_spot_weight(path: str, limit: int = None) -> int:
+    if path == "/api/v3/depth":
+        limit = limit or 100
+        return 5 if limit <= 100 else 25 if limit <= 500 else 50 if limit <= 1000 else 250
+    return BINANCE_SPOT_WEIGHTS.get(path, 2)
+
+# طلبات السبوت الفعلية لكل عملة في harvest_coin (المسار، limit) - أي تعديل هناك يُعدل هنا
+HARVEST_SPOT_CALLS = (
+    ("/api/v3/klines", 750),    # شموع 15 دقيقة
+    ("/api/v3/klines", 120),    # get_micro_cvd_absorption (فريم 1m)
+    ("/api/v3/depth", 50),      # get_aggregated_orderbook (جزء بايننس)
+    ("/api/v3/depth", 500),     # analyze_orderbook_spoofing_instant
+    ("/api/v3/aggTrades", 1000) # get_institutional_orderflow
+)
+HARVEST_WEIGHT_PER_COIN = sum(binance_spot_weight(path, limit) for path, limit in HARVEST_SPOT_CALLS) # = 38
+
+class BinanceWeightBudget:
+    """
+    دلو رموز (Token Bucket) يمتلئ بمعدل حصتنا من حد الوزن في الدقيقة.
+    كل عملة تسحب وزنها المقدر قبل الانطلاق، ونتوقف إذا اقترب الوزن الفعلي (من الهيدر) من السقف.
+    """
+    def __init__(self, share=HARVEST_WEIGHT_SHARE, weight_ceiling=0.85):
+        self.rate = BINANCE_WEIGHT_LIMIT_1M * share / 60.0 # وزن/ثانية
+        self.capacity = BINANCE_WEIGHT_LIMIT_1M * share / 4.0 # نسمح بدفعة ربع دقيقة فقط
+        self.tokens = self.capacity
+        self.weight_ceiling = weight_ceiling
+        self.last_refill = time.monotonic()
+        self.spent = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self, weight):
+        async with self._lock: # طابور عادل: من يسبق يأخذ أولاً
+            while True:
+                await binance_rate_limit_event.wait()
+                self._refill()
+                if self.tokens >= weight and binance_weight_usage_ratio() < self.weight_ceiling:
+                    self.tokens -= weight
+                    self.spent += weight
+                    return
+                await asyncio.sleep(max(0.25, (weight - self.tokens) / self.rate))
+
+    def reset_cycle(self):
+        spent, self.spent = self.spent, 0
+        return spent
+
+async def harvest_coin(c, client, market_regime, pool):
+    """
+    حصاد عملة واحدة: شموع 15 دقيقة + البيانات اللحظية -> عينة ML، ثم فحص قناص الـ Apex.
+    يعيد True إذا سُجلت العينة.
+    """
+    sym = c["symbol"]
+    price = c["price"]
+    pair = f"{sym}USDT"
+    sampled = False
+    
+    try:
+        # 1. جلب الشموع (15 دقيقة للتدريب السريع والدقيق)
+        candles = await get_candles_binance(pair, "15m", limit=750)
+        if not candles: return False
+        
+        df, last_rsi, current_adx, current_z, vol_mean, vol_std = await run_cpu_task(process_dataframe_sync, candles)
+                                # 🎯 التحديث اللحظي للسعر لحل مشكلة السعر القديم والأوردر بوك المجنون
+        price = float(df["close"].iloc[-1])
+
+        # 2. جلب البيانات اللحظية (التي لا تحفظها بايننس تاريخياً)
+        cvd_boost, cvd_sig, cvd_trend = await get_micro_cvd_absorption(pair, client, "15m")
+        global_ob_pressure = await get_aggregated_orderbook(client, sym)
+        depth_data = await analyze_orderbook_spoofing_instant(sym, client, price)
+        tick_delta, tick_buy, tick_sell, limit_abs = await get_institutional_orderflow(pair, client)
+        _, fut_sig, funding_val, oi_change_pct = await get_futures_liquidity(sym, client, price, float(df["close"].iloc[-3]))
+        
+        avg_vol_20 = df["volume"].tail(20).mean()
+        avg_vol_usd = avg_vol_20 * price if avg_vol_20 > 0 else 1.0
+        cvd_ratio_pct = (cvd_trend * price / avg_vol_usd) * 100 if avg_vol_usd > 0 else 0.0
+        
+        # حساب القوة النسبية للماكرو والتذبذب
+        ema200_val = df["close"].ewm(span=200).mean().iloc[-1] if len(df) >= 200 else df["close"].ewm(span=50).mean().iloc[-1]
+        cvd_divergence = 1.0 if (price > ema200_val and cvd_trend < 0) else -1.0 if (price < ema200_val and cvd_trend > 0) else 0.0
+        micro_volatility = df['close'].tail(20).pct_change().std() * 100
+        
+        current_regime_trend = market_regime['trend'] if isinstance(market_regime, dict) else "Unknown"
+        regime_map = {"Trending_Bull": 1, "Trending_Bear": 2, "Ranging": 3}
+        
+        # تجهيز الميزات (Features) وتسجيلها
+        ml_features = {
+            'market_regime': regime_map.get(current_regime_trend, 0),
+            'sp500_trend': float(MACRO_CACHE.get("sp500_trend", 0.0)),
+            'sentiment_score': float(MACRO_CACHE.get("sentiment_score", 50.0)),
+            'z_score': float(current_z),
+            'cvd_to_vol_ratio': float(cvd_ratio_pct),
+            'ofi_imbalance': float(depth_data.get('imbalance', 0.0)),
+            'ob_skewness': float(depth_data.get('bid_pressure_ratio', 1.0)),
+            'whale_inflow': await get_whale_inflow_score(),
+            'adx': float(current_adx),
+            'rsi': float(last_rsi),
+            'micro_volatility': float(micro_volatility) if not pd.isna(micro_volatility) else 0.0,
+            'cvd_divergence': float(cvd_divergence),
+            'funding_rate': float(funding_val)
+        }
+        
+        # تسجيل البيانات بصمت
+        await log_signal_for_ml(pool, sym, price, ml_features)
+        # 🧱 متجه جزئي لمخزن الميزات في كل دورة (بدون فلتر الـ 5 ساعات): ركائز HARVESTER_MISSING_FEATURES
+        # لا تُحسب هنا (مجسات شبكة إضافية أو نوافذ معايرة على شموع الساعة) فتبقى NaN والصف يحمل تاج "partial"
+        candle_spread_pct = (df["high"].iloc[-1] - df["low"].iloc[-1]) / df["low"].iloc[-1] * 100
+        avg_spread = (abs(df["high"] - df["low"]) / df["low"]).tail(5).mean() * 100
+        vwap_z, _ = calculate_vwap_zscore(df, window=24)
+        await FEATURE_STORE_WRITER.add(sym, "harvester", price, {
+            **ml_features,
+            "current_z": current_z,
+            "lar_score": current_z / max(candle_spread_pct, avg_spread, 0.15),
+            "cvd_ratio": cvd_ratio_pct / 100,
+            "imbalance": depth_data.get('imbalance', 0.0),
+            "global_ob_pressure": global_ob_pressure,
+            "ob_trap_flag": depth_data.get('is_hollow', False) or depth_data.get('is_spoofed', False),
+            "oi_rising_flag": fut_sig == "OI_Rising",
+            "regime_code": ml_features['market_regime'],
+            "limit_absorption_flag": bool(limit_abs),
+            "vwap_z": vwap_z,
+            "tick_delta": tick_delta,
+            "cvd_boost": cvd_boost,
+            "oi_change_pct": oi_change_pct
+        }, [FEATURE_STORE_PARTIAL_TAG])
+        sampled = True
+        # ==========================================
+        # 🎯 The Apex Trigger: فحص تقييم الذكاء الاصطناعي
+        # ==========================================
+        ai_confidence = predict_signal_sync(ml_features) # inplace_predict بالميكروثانية: لا حاجة لقفزة خيط
+        ai_confidence = round(ai_confidence, 1) # 👈 هذا السطر سيجبر السكور على أن يكون برقم عشري واحد فقط (مثال: 84.2)
+
+        
+        if ai_confidence >= 75.0:
+            # التحقق مما إذا تم إرسال هذه العملة مؤخراً لتجنب الإزعاج
+            async with pool.acquire() as conn:
+                is_signaled = await conn.fetchval("""
+                    SELECT 1 FROM radar_history 
+                    WHERE symbol = $1 AND last_signaled > CURRENT_TIMESTAMP - INTERVAL '24 hours'
+                """, sym)
+                
+            if not is_signaled:
+                # تسجيل العملة كمرسلة
+                async with pool.acquire() as conn:
+                    await conn.execute("""
+                        INSERT INTO radar_history (symbol, last_signaled)
+                        VALUES ($1, CURRENT_TIMESTAMP)
+                        ON CONFLICT (symbol) DO UPDATE SET last_signaled = CURRENT_TIMESTAMP
+                    """, sym)
+
+                # تجهيز البيانات للعرض
+                z_val = float(current_z)
+                avg_vol_5 = df["volume"].tail(5).mean()
+                vol_ratio = (avg_vol_5 / avg_vol_20) if avg_vol_20 > 0 else 1.0
+                cvd_val = float(cvd_trend * price)
+                ob_val = float(depth_data.get('bid_pressure_ratio', 1.0))
+                funding = float(funding_val)
+                adx = float(current_adx)
+                rsi = float(last_rsi)
+
+                # صياغة التحليل (باستخدام مصطلحات السيولة والتدفق)
+                vol_ar = f"شذوذ فوليوم مؤسساتي (Z-Score: {z_val:.2f}) مع ضخ سيولة حاد ({vol_ratio:.2f}x)." if z_val > 2 else f"انضغاط سيولة صامت (Z-Score: {z_val:.2f})."
+                cvd_ar = f"امتصاص شرائي خفي (CVD: +${cvd_val:,.0f})" if cvd_val > 0 else f"ضغط بيعي وتصريف (CVD: ${cvd_val:,.0f})"
+                ob_ar = f"مع تكدس طلبات هجومي (OB: {ob_val:.2f}x)." if ob_val > 1 else f"مع سيطرة وتكدس لعروض البيع (OB: {ob_val:.2f}x)."
+                
+                if funding < -0.0005:
+                    fund_ar = "تمركز بيعي قوي مع احتمالية لتصفية البائعين (Short Squeeze)."
+                elif funding > 0.0005:
+                    fund_ar = "طمع شرائي ومعدل تمويل إيجابي ينذر بخطر تصفية المشترين (Long Squeeze)."
+                else:
+                    fund_ar = "استقرار وتوازن في معدلات تمويل عقود المشتقات."
+                
+                tech_ar = f"ADX: {adx:.1f} | RSI: {rsi:.1f}"
+
+                insight_ar = (
+                    f"• <b>السيولة:</b> {vol_ar}\n"
+                    f"• <b>التدفق:</b> {cvd_ar} {ob_ar}\n"
+                    f"• <b>المشتقات:</b> {fund_ar}\n"
+                    f"• <b>الهيكلة:</b> {tech_ar}"
+                )
+
+                vol_en = f"Institutional volume anomaly (Z-Score: {z_val:.2f}) with aggressive inflow ({vol_ratio:.2f}x)." if z_val > 2 else f"Silent liquidity compression (Z-Score: {z_val:.2f})."
+                cvd_en = f"Hidden buy absorption (CVD: +${cvd_val:,.0f})" if cvd_val > 0 else f"Selling pressure & distribution (CVD: ${cvd_val:,.0f})"
+                ob_en = f"with aggressive bid stacking (OB: {ob_val:.2f}x)." if ob_val > 1 else f"with heavy ask supply dominance (OB: {ob_val:.2f}x)."
+                
+                if funding < -0.0005:
+                    fund_en = "Heavy short positioning with high (Short Squeeze) probability."
+                elif funding > 0.0005:
+                    fund_en = "Overleveraged longs with high (Long Squeeze/Correction) risk."
+                else:
+                    fund_en = "Stable futures open interest and neutral funding rates."
+                    
+                tech_en = f"ADX: {adx:.1f} | RSI: {rsi:.1f}"
+
+                insight_en = (
+                    f"• <b>Liquidity:</b> {vol_en}\n"
+                    f"• <b>Orderflow:</b> {cvd_en} {ob_en}\n"
+                    f"• <b>Derivatives:</b> {fund_en}\n"
+                    f"• <b>Structure:</b> {tech_en}"
+                )
+
+                signal_id = str(uuid.uuid4())[:8] 
+                signal_type = f"🤖 AI APEX Pick"
+                
+                radar_pending_approvals[signal_id] = {
+                    "symbol": sym, "price": price, "signal": signal_type, "score": ai_confidence,
+                    "insight_ar": insight_ar, "insight_en": insight_en
+                }
+
+                admin_kb = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="✅ موافقة ونشر للمشتركين", callback_data=f"rad_app_{signal_id}")],
+                    [InlineKeyboardButton(text="❌ إلغاء وتجاهل", callback_data=f"rad_rej_{signal_id}")]
+                ])
+
+                admin_text = (
+                    f"🦅 <b>تنبيه طوارئ: قناص الذكاء الاصطناعي (Apex) التقط جوهرة!</b>\n"
+                    f"🏆 <b>العملة:</b> #{sym}\n"
+                    f"💵 السعر: ${format_price(price)}\n"
+                    f"⚡ نوع التجميع: {signal_type}\n"
+                    f"🤖 تقييم الذكاء الاصطناعي: <b>{ai_confidence:.1f}%</b>\n\n"
+                    f"📝 <b>التحليل:</b>\n{insight_ar}\n\n"
+                    f"هل تريد الموافقة على نشرها؟"
+                )
+
+                await bot.send_message(ADMIN_USER_ID, admin_text, reply_markup=admin_kb, parse_mode=ParseMode.HTML)
+                print(f"🎯 [Apex Sniper] {sym} fired with AI score {ai_confidence:.1f}%!")
+
+    except Exception as e:
+        pass # صمت تام عند الأخطاء لتستمر الحلقة
+    return sampled
+
 async def silent_data_harvester_worker(pool):
     """
     عامل الحصاد الصامت (The Apex Sniper): 
-    يعمل في الخلفية بهدوء، يحلل عملة واحدة كل دقيقة لجمع البيانات اللحظية.
+    يلتقط لقطة كاملة للكون كل 15 دقيقة بعدة عملات متزامنة ضمن حصة محددة من وزن بايننس.
     إذا وجد فرصة بتقييم ذكاء اصطناعي (AI) أعلى من 80%، يكسر الصمت ويرسل إشعار طوارئ.
     """
     await asyncio.sleep(120) # ننتظر دقيقتين بعد تشغيل البوت ليستقر
     print("🌾 [Data Harvester & Apex Sniper] Engine is Online. Hunting silently...")
+    budget = BinanceWeightBudget()
+    sem = asyncio.Semaphore(HARVEST_CONCURRENCY)
+
+    async def budgeted_harvest(c, client, market_regime):
+        async with sem:
+            await budget.acquire(HARVEST_WEIGHT_PER_COIN)
+            return await harvest_coin(c, client, market_regime, pool)
 
     while True:
+        cycle_start = time.time()
         try:
             async with pool.acquire() as conn:
                 records = await conn.fetch("SELECT symbol FROM radar_history")
                 ignored_symbols = {r['symbol'] for r in records}
 
-            async with httpx.AsyncClient(timeout=30) as client:
+            async with httpx.AsyncClient(timeout=30, event_hooks={"response": [track_binance_weight]}) as client:
                 await binance_rate_limit_event.wait()
                 
                 # جلب حالة الماكرو
@@ -1383,6 +2487,7 @@ async def silent_data_harvester_worker(pool):
                     if not symbol.endswith("USDT"): continue
                     clean_sym = symbol.replace("USDT", "")
                     if clean_sym in BLACKLISTED_COINS: continue
+                    if not owns_symbol(clean_sym): continue # 🛰️ شريحة هذه النسخة فقط
                     
                     vol_usd = float(t["quoteVolume"])
                     if vol_usd >= 200_000: # الفلتر المبدئي للسيولة
@@ -1393,170 +2498,25 @@ async def silent_data_harvester_worker(pool):
                 
                 print(f"🔄 [Apex Sniper] Starting new silent cycle for {len(coins)} coins...")
 
-                # ⏳ التقطير الصامت: معالجة عملة واحدة فقط كل 50 ثانية
-                for c in coins:
-                    await binance_rate_limit_event.wait()
-                    sym = c["symbol"]
-                    price = c["price"]
-                    pair = f"{sym}USDT"
-                    
-                    try:
-                        # 1. جلب الشموع (15 دقيقة للتدريب السريع والدقيق)
-                        candles = await get_candles_binance(pair, "15m", limit=750)
-                        if not candles: continue
-                        
-                        df, last_rsi, current_adx, current_z, vol_mean, vol_std = await asyncio.to_thread(process_dataframe_sync, candles)
-                                                # 🎯 التحديث اللحظي للسعر لحل مشكلة السعر القديم والأوردر بوك المجنون
-                        price = float(df["close"].iloc[-1])
-
-                        # 2. جلب البيانات اللحظية (التي لا تحفظها بايننس تاريخياً)
-                        cvd_boost, cvd_sig, cvd_trend = await get_micro_cvd_absorption(pair, client, "15m")
-                        global_ob_pressure = await get_aggregated_orderbook(client, sym)
-                        depth_data = await analyze_orderbook_spoofing_instant(sym, client, price)
-                        tick_delta, tick_buy, tick_sell, limit_abs = await get_institutional_orderflow(pair, client)
-                        _, fut_sig, funding_val, _ = await get_futures_liquidity(sym, client, price, float(df["close"].iloc[-3]))
-                        
-                        avg_vol_20 = df["volume"].tail(20).mean()
-                        avg_vol_usd = avg_vol_20 * price if avg_vol_20 > 0 else 1.0
-                        cvd_ratio_pct = (cvd_trend * price / avg_vol_usd) * 100 if avg_vol_usd > 0 else 0.0
-                        
-                        # حساب القوة النسبية للماكرو والتذبذب
-                        ema200_val = df["close"].ewm(span=200).mean().iloc[-1] if len(df) >= 200 else df["close"].ewm(span=50).mean().iloc[-1]
-                        cvd_divergence = 1.0 if (price > ema200_val and cvd_trend < 0) else -1.0 if (price < ema200_val and cvd_trend > 0) else 0.0
-                        micro_volatility = df['close'].tail(20).pct_change().std() * 100
-                        
-                        current_regime_trend = market_regime['trend'] if isinstance(market_regime, dict) else "Unknown"
-                        regime_map = {"Trending_Bull": 1, "Trending_Bear": 2, "Ranging": 3}
-                        
-                        # تجهيز الميزات (Features) وتسجيلها
-                        ml_features = {
-                            'market_regime': regime_map.get(current_regime_trend, 0),
-                            'sp500_trend': float(MACRO_CACHE.get("sp500_trend", 0.0)),
-                            'sentiment_score': float(MACRO_CACHE.get("sentiment_score", 50.0)),
-                            'z_score': float(current_z),
-                            'cvd_to_vol_ratio': float(cvd_ratio_pct),
-                            'ofi_imbalance': float(depth_data.get('imbalance', 0.0)),
-                            'ob_skewness': float(depth_data.get('bid_pressure_ratio', 1.0)),
-                            'whale_inflow': await get_whale_inflow_score(),
-                            'adx': float(current_adx),
-                            'rsi': float(last_rsi),
-                            'micro_volatility': float(micro_volatility) if not pd.isna(micro_volatility) else 0.0,
-                            'cvd_divergence': float(cvd_divergence),
-                            'funding_rate': float(funding_val)
-                        }
-                        
-                        # تسجيل البيانات بصمت
-                        await log_signal_for_ml(pool, sym, price, ml_features)
-                        # ==========================================
-                        # 🎯 The Apex Trigger: فحص تقييم الذكاء الاصطناعي
-                        # ==========================================
-                        ai_confidence = await asyncio.to_thread(predict_signal_sync, ml_features)
-                        ai_confidence = round(ai_confidence, 1) # 👈 هذا السطر سيجبر السكور على أن يكون برقم عشري واحد فقط (مثال: 84.2)
-
-                        
-                        if ai_confidence >= 75.0:
-                            # التحقق مما إذا تم إرسال هذه العملة مؤخراً لتجنب الإزعاج
-                            async with pool.acquire() as conn:
-                                is_signaled = await conn.fetchval("""
-                                    SELECT 1 FROM radar_history 
-                                    WHERE symbol = $1 AND last_signaled > CURRENT_TIMESTAMP - INTERVAL '24 hours'
-                                """, sym)
-                                
-                            if not is_signaled:
-                                # تسجيل العملة كمرسلة
-                                async with pool.acquire() as conn:
-                                    await conn.execute("""
-                                        INSERT INTO radar_history (symbol, last_signaled)
-                                        VALUES ($1, CURRENT_TIMESTAMP)
-                                        ON CONFLICT (symbol) DO UPDATE SET last_signaled = CURRENT_TIMESTAMP
-                                    """, sym)
-
-                                # تجهيز البيانات للعرض
-                                z_val = float(current_z)
-                                avg_vol_5 = df["volume"].tail(5).mean()
-                                vol_ratio = (avg_vol_5 / avg_vol_20) if avg_vol_20 > 0 else 1.0
-                                cvd_val = float(cvd_trend * price)
-                                ob_val = float(depth_data.get('bid_pressure_ratio', 1.0))
-                                funding = float(funding_val)
-                                adx = float(current_adx)
-                                rsi = float(last_rsi)
-
-                                # صياغة التحليل (باستخدام مصطلحات السيولة والتدفق)
-                                vol_ar = f"شذوذ فوليوم مؤسساتي (Z-Score: {z_val:.2f}) مع ضخ سيولة حاد ({vol_ratio:.2f}x)." if z_val > 2 else f"انضغاط سيولة صامت (Z-Score: {z_val:.2f})."
-                                cvd_ar = f"امتصاص شرائي خفي (CVD: +${cvd_val:,.0f})" if cvd_val > 0 else f"ضغط بيعي وتصريف (CVD: ${cvd_val:,.0f})"
-                                ob_ar = f"مع تكدس طلبات هجومي (OB: {ob_val:.2f}x)." if ob_val > 1 else f"مع سيطرة وتكدس لعروض البيع (OB: {ob_val:.2f}x)."
-                                
-                                if funding < -0.0005:
-                                    fund_ar = "تمركز بيعي قوي مع احتمالية لتصفية البائعين (Short Squeeze)."
-                                elif funding > 0.0005:
-                                    fund_ar = "طمع شرائي ومعدل تمويل إيجابي ينذر بخطر تصفية المشترين (Long Squeeze)."
-                                else:
-                                    fund_ar = "استقرار وتوازن في معدلات تمويل عقود المشتقات."
-                                
-                                tech_ar = f"ADX: {adx:.1f} | RSI: {rsi:.1f}"
-
-                                insight_ar = (
-                                    f"• <b>السيولة:</b> {vol_ar}\n"
-                                    f"• <b>التدفق:</b> {cvd_ar} {ob_ar}\n"
-                                    f"• <b>المشتقات:</b> {fund_ar}\n"
-                                    f"• <b>الهيكلة:</b> {tech_ar}"
-                                )
-
-                                vol_en = f"Institutional volume anomaly (Z-Score: {z_val:.2f}) with aggressive inflow ({vol_ratio:.2f}x)." if z_val > 2 else f"Silent liquidity compression (Z-Score: {z_val:.2f})."
-                                cvd_en = f"Hidden buy absorption (CVD: +${cvd_val:,.0f})" if cvd_val > 0 else f"Selling pressure & distribution (CVD: ${cvd_val:,.0f})"
-                                ob_en = f"with aggressive bid stacking (OB: {ob_val:.2f}x)." if ob_val > 1 else f"with heavy ask supply dominance (OB: {ob_val:.2f}x)."
-                                
-                                if funding < -0.0005:
-                                    fund_en = "Heavy short positioning with high (Short Squeeze) probability."
-                                elif funding > 0.0005:
-                                    fund_en = "Overleveraged longs with high (Long Squeeze/Correction) risk."
-                                else:
-                                    fund_en = "Stable futures open interest and neutral funding rates."
-                                    
-                                tech_en = f"ADX: {adx:.1f} | RSI: {rsi:.1f}"
-
-                                insight_en = (
-                                    f"• <b>Liquidity:</b> {vol_en}\n"
-                                    f"• <b>Orderflow:</b> {cvd_en} {ob_en}\n"
-                                    f"• <b>Derivatives:</b> {fund_en}\n"
-                                    f"• <b>Structure:</b> {tech_en}"
-                                )
-
-                                signal_id = str(uuid.uuid4())[:8] 
-                                signal_type = f"🤖 AI APEX Pick"
-                                
-                                radar_pending_approvals[signal_id] = {
-                                    "symbol": sym, "price": price, "signal": signal_type, "score": ai_confidence,
-                                    "insight_ar": insight_ar, "insight_en": insight_en
-                                }
-
-                                admin_kb = InlineKeyboardMarkup(inline_keyboard=[
-                                    [InlineKeyboardButton(text="✅ موافقة ونشر للمشتركين", callback_data=f"rad_app_{signal_id}")],
-                                    [InlineKeyboardButton(text="❌ إلغاء وتجاهل", callback_data=f"rad_rej_{signal_id}")]
-                                ])
-
-                                admin_text = (
-                                    f"🦅 <b>تنبيه طوارئ: قناص الذكاء الاصطناعي (Apex) التقط جوهرة!</b>\n"
-                                    f"🏆 <b>العملة:</b> #{sym}\n"
-                                    f"💵 السعر: ${format_price(price)}\n"
-                                    f"⚡ نوع التجميع: {signal_type}\n"
-                                    f"🤖 تقييم الذكاء الاصطناعي: <b>{ai_confidence:.1f}%</b>\n\n"
-                                    f"📝 <b>التحليل:</b>\n{insight_ar}\n\n"
-                                    f"هل تريد الموافقة على نشرها؟"
-                                )
-
-                                await bot.send_message(ADMIN_USER_ID, admin_text, reply_markup=admin_kb, parse_mode=ParseMode.HTML)
-                                print(f"🎯 [Apex Sniper] {sym} fired with AI score {ai_confidence:.1f}%!")
-
-                    except Exception as e:
-                        pass # صمت تام عند الأخطاء لتستمر الحلقة
-                    
-                    # 🛡️ الجدار السري لحماية السيرفر: استراحة 50 ثانية بين كل عملة وعملة
-                    await asyncio.sleep(50) 
+                # ⚡ خط أنابيب متزامن محكوم بالميزانية بدل عملة واحدة كل 50 ثانية
+                budget.reset_cycle()
+                results = await asyncio.gather(*(budgeted_harvest(c, client, market_regime) for c in coins))
+                sampled = sum(1 for r in results if r)
+                elapsed = time.time() - cycle_start
+                weight_spent = budget.reset_cycle()
+                coverage = (sampled / len(coins) * 100) if coins else 0.0
+                print(
+                    f"🌾 [Harvester] Cycle: {elapsed:.0f}s | Coverage: {sampled}/{len(coins)} ({coverage:.0f}%) | "
+                    f"Weight: {weight_spent} (~{weight_spent / max(elapsed / 60.0, 1e-6):.0f}/min)"
+                )
                     
         except Exception as e:
             print(f"⚠️ Harvester Error: {e}")
             await asyncio.sleep(300)
+            continue
+
+        # ⏱️ الالتزام بإيقاع ثابت: اللقطة التالية عند بداية النافذة القادمة
+        await asyncio.sleep(max(0.0, HARVEST_CADENCE_SECONDS - (time.time() - cycle_start)))
 
 
 def process_dataframe_sync(candles_data):
@@ -1583,13 +2543,160 @@ def process_dataframe_sync(candles_data):
     return df, last_rsi_val, current_adx_val, current_z_val, vol_mean_val, vol_std_val
 
 
+# ====================================================================
+# 🏭 طبقة الحوسبة المعزولة (Process Pool Compute Tier)
+# ====================================================================
+# الخيوط (to_thread) تتصارع على الـ GIL مع حلقة الأحداث فيتجمد الويب هوك أثناء المسح.
+# هنا نرسل التحليلات الثقيلة لعمليات مستقلة دافئة، والشموع تمر عبر ذاكرة مشتركة بدون Pickle.
+COMPUTE_POOL = None
+COMPUTE_POOL_WORKERS = int(os.getenv("COMPUTE_POOL_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+COMPUTE_MAX_IN_FLIGHT = COMPUTE_POOL_WORKERS * 2 # طابور محدود: لا نكدس مهام أكثر من ضعف العمال
+COMPUTE_SLOTS = asyncio.Semaphore(COMPUTE_MAX_IN_FLIGHT)
+
+def _compute_worker_init():
+    """تسخين العامل: استيراد المكتبات الثقيلة وتشغيل حساب وهمي مرة واحدة"""
+    import pandas, ta, xgboost # noqa: F401
+    warm = [[str(i * 3600), 1.0 + i % 5, 1.0 + i * 0.001, 1.01 + i * 0.001, 0.99 + i * 0.001, 1.0, 0.5] for i in range(60)]
+    try:
+        process_dataframe_sync(warm)
+    except Exception:
+        pass
+
+def _pack_candles_arg(arg, segments):
+    """تحويل قائمة شموع إلى مصفوفة float64 داخل ذاكرة مشتركة (أو تمريرها كما هي إن تعذر)"""
+    if isinstance(arg, BaseException):
+        return None # استثناءات httpx لا تقبل الـ Pickle دائماً، والدوال تعامل None كبيانات مفقودة
+    if not isinstance(arg, list) or not arg or not isinstance(arg[0], (list, tuple)):
+        return arg
+    try:
+        arr = np.asarray([row[:7] for row in arg], dtype=np.float64)
+    except (TypeError, ValueError):
+        return arg
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=np.float64, buffer=shm.buf)[:] = arr
+    segments.append(shm)
+    return ("__shm_candles__", shm.name, arr.shape)
+
+def _unpack_candles_arg(arg):
+    if not (isinstance(arg, tuple) and len(arg) == 3 and arg[0] == "__shm_candles__"):
+        return arg
+    # الأب هو المسؤول عن unlink (العمال يتشاركون متتبع الموارد مع الأب في وضع spawn)
+    shm = shared_memory.SharedMemory(name=arg[1])
+    try:
+        return np.ndarray(arg[2], dtype=np.float64, buffer=shm.buf).tolist()
+    finally:
+        shm.close()
+
+def _compute_pool_entry(func, packed_args):
+    """نقطة الدخول داخل العامل: فك الشموع من الذاكرة المشتركة ثم تنفيذ الدالة"""
+    return func(*[_unpack_candles_arg(a) for a in packed_args])
+
+def start_compute_pool():
+    global COMPUTE_POOL
+    if COMPUTE_POOL is not None:
+        return COMPUTE_POOL
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        COMPUTE_POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=COMPUTE_POOL_WORKERS, mp_context=ctx, initializer=_compute_worker_init
+        )
+        print(f"🏭 [Compute Tier] Process pool started with {COMPUTE_POOL_WORKERS} warm workers.")
+    except Exception as e:
+        print(f"⚠️ [Compute Tier] Process pool unavailable, falling back to threads: {e}")
+        COMPUTE_POOL = None
+    return COMPUTE_POOL
+
+def stop_compute_pool():
+    global COMPUTE_POOL
+    if COMPUTE_POOL is not None:
+        COMPUTE_POOL.shutdown(wait=False, cancel_futures=True)
+        COMPUTE_POOL = None
+
+async def run_cpu_task(func, *args):
+    """
+    بديل asyncio.to_thread للتحليلات الثقيلة: يرسلها لعامل في الـ Process Pool.
+    أي قائمة شموع في المعاملات تمر عبر Shared Memory. عند غياب الـ Pool أو انهياره نعود للخيوط.
+    """
+    if COMPUTE_POOL is None:
+        return await asyncio.to_thread(func, *args)
+
+    async with COMPUTE_SLOTS:
+        segments = []
+        try:
+            packed = [_pack_candles_arg(a, segments) for a in args]
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(COMPUTE_POOL, _compute_pool_entry, func, packed)
+        except concurrent.futures.process.BrokenProcessPool:
+            print("⚠️ [Compute Tier] Worker crashed, restarting pool...")
+            stop_compute_pool()
+            start_compute_pool()
+            return await asyncio.to_thread(func, *args)
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+# ====================================================================
+# 🎓 عملية التدريب المعزولة (Out-of-Process Training) بحدود موارد صارمة
+# ====================================================================
+# التدريب لا يشارك عمال المسح: عملية جديدة لكل مهمة (max_tasks_per_child=1) بأولوية منخفضة
+# وسقف للمعالج والذاكرة. إذا قتلها النظام لتجاوز الحد، يبقى البوت والنموذج النشط سليمين.
+TRAINING_POOL = None
+ML_TRAINING_CPU_SECONDS = int(os.getenv("ML_TRAINING_CPU_SECONDS", 1800))
+ML_TRAINING_MEMORY_MB = int(os.getenv("ML_TRAINING_MEMORY_MB", 4096))
+
+def _training_worker_init():
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_CPU, (ML_TRAINING_CPU_SECONDS, ML_TRAINING_CPU_SECONDS + 30))
+        memory_limit = ML_TRAINING_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"⚠️ [Training Process] Resource limits not applied: {e}")
+
+def start_training_pool():
+    global TRAINING_POOL
+    if TRAINING_POOL is not None:
+        return TRAINING_POOL
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        TRAINING_POOL = concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=ctx, initializer=_training_worker_init, max_tasks_per_child=1
+        )
+    except Exception as e:
+        print(f"⚠️ [Training Process] Unavailable, training will share the compute tier: {e}")
+        TRAINING_POOL = None
+    return TRAINING_POOL
+
+def stop_training_pool():
+    global TRAINING_POOL
+    if TRAINING_POOL is not None:
+        TRAINING_POOL.shutdown(wait=False, cancel_futures=True)
+        TRAINING_POOL = None
+
+async def run_training_task(func, *args):
+    """تشغيل مهمة تدريب في العملية المعزولة. النتيجة يجب أن تكون بايتات/قيم بسيطة (لا نماذج حية)"""
+    if start_training_pool() is None:
+        return await run_cpu_task(func, *args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(TRAINING_POOL, func, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        print("⚠️ [Training Process] Worker killed (resource limit?). The active model is unchanged.")
+        stop_training_pool()
+        raise
+
 async def detect_real_whale_trades(symbol: str, client: httpx.AsyncClient, volume_24h: float):
     """
     [Institutional Upgrade] Algorithmic Execution Detection (TWAP/VWAP & Iceberg)
     يبحث عن البصمة الإحصائية لخوارزميات المؤسسات التي تقوم بتقطيع الطلبات الكبيرة إلى 
     مئات الطلبات الصغيرة ذات الأحجام المتجانسة والكثافة الزمنية العالية.
     """
-    clean_sym = symbol.replace("USDT", "") + "USDT"
+    clean_sym = venue_symbol(symbol, "binance")
     # جلب آخر 1000 صفقة (تمثل دقائق أو ثواني في العملات النشطة)
     trades_url = f"{get_random_binance_base()}/api/v3/trades?symbol={clean_sym}&limit=1000"
     
@@ -1670,7 +2777,7 @@ async def detect_phantom_liquidity_ws(symbol: str, client: httpx.AsyncClient, cu
     [ULTRA INSTITUTIONAL] Phantom Liquidity & TWAP Rhythm Engine 🕸️
     يدمج بين Time-CV و Iceberg Regeneration لاصطياد نشاط الـ Dark Pools والـ OTC
     """
-    clean_sym = symbol.replace("USDT", "").lower() + "usdt"
+    clean_sym = venue_symbol(symbol, "binance").lower() # اسم الستريم بالحروف الصغيرة
     # دمج بثين في اتصال واحد: الصفقات اللحظية + الأوردر بوك السريع
     ws_url = f"wss://stream.binance.com:9443/stream?streams={clean_sym}@aggTrade/{clean_sym}@depth5@100ms"
     
@@ -1836,22 +2943,277 @@ def detect_dark_pool_vca(df, current_cvd_usd, oi_change_pct, funding_rate=0.0, o
 
     return round(vca_score, 1), signal_tag
 
-async def analyze_radar_coin(c, client, market_regime, sem):
+# ====================================================================
+# 🧮 نواة التسعير الدفعي (Batch Quant Scoring Kernel)
+# ====================================================================
+# ترتيب أعمدة مصفوفة الميزات (صف واحد لكل عملة). لا تغير الترتيب لأن الصفوف المخزنة تعتمد عليه.
+RADAR_FEATURE_COLUMNS = [
+    "current_z",            # Z-Score الفوليوم
+    "lar_score",            # نسبة امتصاص السيولة (LAR)
+    "cvd_ratio",            # CVD بالدولار / متوسط الفوليوم بالدولار
+    "spot_lead_score",      # ارتباط السبوت بالعقود
+    "whale_score",          # بصمة السيولة الشبحية
+    "funding_rate",
+    "oi_change_pct",
+    "oi_rising_flag",       # futures_signal == "OI_Rising"
+    "squeeze_ratio",        # عرض البولينجر الحالي / متوسطه
+    "rs_score",             # القوة النسبية أمام البيتكوين
+    "liquidity_sweep_flag",
+    "imbalance",
+    "global_ob_pressure",
+    "ob_trap_flag",         # جدران وهمية أو Spoofing
+    "vca_bonus",
+    "incubation_bonus",
+    "regime_code",          # 1: Bull, 2: Bear, 3: Ranging, 0: Unknown
+    "macro_coil_flag",      # DARK_POOL_COIL / Incubated_Macro_Coil / Whale_CVD
+    "deep_absorption_flag", # DEEP_ABSORPTION
+    "limit_absorption_flag" # Limit_Absorption
+]
+RADAR_FEATURE_INDEX = {name: i for i, name in enumerate(RADAR_FEATURE_COLUMNS)}
+RADAR_REGIME_CODES = {"Trending_Bull": 1, "Trending_Bear": 2, "Ranging": 3}
+
+# أوزان الركائز حسب حالة السوق (يمكن تعديلها وإعادة التسعير فوراً دون أي طلب API)
+RADAR_SCORING_PARAMS = {
+    "regime_weights": {
+        1: (0.55, 0.25, 0.20), # Trending_Bull: (cvd, deriv, tech)
+        2: (0.50, 0.35, 0.15), # Trending_Bear
+        0: (0.45, 0.25, 0.30)  # Ranging & Unknown
+    },
+    "directional_weight": 0.70,
+    "timing_weight": 0.30
+}
+
+# آخر دورة مسح (للتسعير الفوري عند تغير الأوزان أو حالة السوق)
+LAST_RADAR_FEATURES = {"symbols": [], "matrix": None, "updated": 0}
+
+def build_radar_feature_row(**values):
+    """يبني صف ميزات واحد بالترتيب الثابت (القيم المفقودة = 0)"""
+    row = np.zeros(len(RADAR_FEATURE_COLUMNS), dtype=np.float64)
+    for name, val in values.items():
+        row[RADAR_FEATURE_INDEX[name]] = float(val) if val is not None else 0.0
+    return row
+
+def _batch_sigmoid(values, sensitivity, limit):
+    """نسخة مصفوفية من quant_sigmoid_score (نفس الحماية من الطفح)"""
+    safe_value = np.clip(sensitivity * values, -20.0, 20.0)
+    return limit / (1.0 + np.exp(-safe_value))
+
+def regime_directional(dir_cvd, dir_deriv, dir_tech, regimes, weights):
+    """دمج ركائز الاتجاه الثلاث بأوزان حالة السوق لكل صف"""
+    w_bull, w_bear, w_other = weights[1], weights[2], weights[0]
+    w = np.where((regimes == 1)[:, None], w_bull, np.where((regimes == 2)[:, None], w_bear, w_other))
+    return dir_cvd * w[:, 0] + dir_deriv * w[:, 1] + dir_tech * w[:, 2]
+
+def combine_radar_score(directional, ob, volume_multiplier, effective_z, params):
+    """الدمج المضاعف + محفز الإجماع (مفصول ليُعاد استخدامه مع ركائز محسوبة مسبقاً)"""
+    base_conviction = directional * params["directional_weight"] + ob * params["timing_weight"]
+    final_raw = base_conviction * volume_multiplier
+
+    # 🚀 محفز الإجماع الأسّي
+    boost_mask = (directional >= 80.0) & (ob >= 80.0) & (effective_z >= 2.5)
+    boosted = np.minimum(99.5, final_raw * (1.05 + effective_z * 0.012))
+    final_raw = np.where(boost_mask, boosted, final_raw)
+    return np.round(np.clip(final_raw, 0.0, 99.5), 1)
+
+def compute_radar_pillars(features, params=None, regime_code=None):
+    """
+    يحسب الركائز الخمس (cvd, deriv, tech, ob, vol) لكل الصفوف دفعة واحدة.
+    regime_code: لتجاوز حالة السوق المخزنة في المصفوفة (إعادة تسعير سريعة).
+    """
+    params = params or RADAR_SCORING_PARAMS
+    F = np.atleast_2d(np.asarray(features, dtype=np.float64))
+    col = lambda name: F[:, RADAR_FEATURE_INDEX[name]]
+
+    # --- البُعد الأول: الاتجاه ---
+    cvd_ratio = col("cvd_ratio")
+    spot_lead_bonus = np.clip(col("spot_lead_score") * 2.0, 0.0, 20.0)
+    dir_cvd = np.minimum(100.0, _batch_sigmoid(cvd_ratio, 6.0, 100.0) + spot_lead_bonus)
+
+    phantom_bonus = _batch_sigmoid(col("whale_score"), 0.5, 50.0)
+    oi_rising = (col("oi_rising_flag") > 0) & (col("oi_change_pct") > 0.02)
+    funding_sensitivity = np.where(oi_rising, -3000.0, -1000.0)
+    dir_deriv = np.minimum(100.0, _batch_sigmoid(col("funding_rate"), funding_sensitivity, 100.0) + phantom_bonus)
+
+    squeeze_ratio = col("squeeze_ratio")
+    tech_base = 50.0 + np.where(squeeze_ratio < 0.8, _batch_sigmoid(1.0 - squeeze_ratio, 5.0, 30.0), 0.0)
+    tech_base = tech_base + _batch_sigmoid(col("rs_score"), 0.5, 20.0)
+    tech_base = tech_base + np.where((col("liquidity_sweep_flag") > 0) & (cvd_ratio > 0), 15.0, 0.0)
+    dir_tech = np.minimum(100.0, tech_base)
+
+    regimes = np.full(len(F), float(regime_code)) if regime_code is not None else col("regime_code")
+    directional = regime_directional(dir_cvd, dir_deriv, dir_tech, regimes, params["regime_weights"])
+
+    # --- البُعد الثاني: التوقيت ---
+    ob_base = _batch_sigmoid(col("imbalance"), 4.0, 100.0)
+    global_ob_bonus = np.minimum(20.0, np.log1p(np.maximum(0.0, col("global_ob_pressure") - 1.0)) * 10.0)
+    timing = np.minimum(100.0, ob_base + global_ob_bonus)
+    timing = np.where(col("ob_trap_flag") > 0, timing * 0.3, timing)
+
+    # --- البُعد الثالث: بوابة الفوليوم ---
+    effective_z = col("current_z") + col("vca_bonus") / 15.0 + col("incubation_bonus") / 15.0
+    safe_z_calc = np.clip(2.0 * (effective_z - 1.5), -10.0, 10.0)
+    raw_vol_multiplier = 1.0 / (1.0 + np.exp(-safe_z_calc))
+
+    lar = col("lar_score")
+    safe_lar = np.where(lar > 0.0, lar, 1.0) # لمنع القسمة على صفر في الفروع غير المستخدمة
+    vol_penalty = np.where(lar <= 0.0, 0.1, np.where(lar < 1.0, np.exp(-2.0 / (safe_lar + 1e-8)), 1.0))
+    volume_multiplier = raw_vol_multiplier * vol_penalty
+
+    return {
+        "cvd": dir_cvd, "deriv": dir_deriv, "tech": dir_tech, "ob": timing,
+        "vol": volume_multiplier * 100.0,
+        "directional": directional, "volume_multiplier": volume_multiplier, "effective_z": effective_z
+    }
+
+def radar_scores_and_pillars(F, params=None, regime_code=None):
+    """السكور النهائي فقط (بدون تسميات الإشارات) لمصفوفات كبيرة مثل الباك تست"""
+    params = params or RADAR_SCORING_PARAMS
+    p = compute_radar_pillars(F, params, regime_code)
+
+    # --- ⚖️ الدمج المضاعف ---
+    scores = combine_radar_score(p["directional"], p["ob"], p["volume_multiplier"], p["effective_z"], params)
+    return scores, p
+
+def score_radar_feature_matrix(features, params=None, regime_code=None):
+    """
+    [Batch Kernel] التسعير الكمي المضاعف لكل العملات في نداء واحد (بدون أي I/O).
+    يرجع: (scores, signal_labels, confluence_counts)
+    """
+    params = params or RADAR_SCORING_PARAMS
+    F = np.atleast_2d(np.asarray(features, dtype=np.float64))
+    if F.shape[0] == 0:
+        return np.zeros(0), [], np.zeros(0, dtype=int)
+    col = lambda name: F[:, RADAR_FEATURE_INDEX[name]]
+    scores, p = radar_scores_and_pillars(F, params, regime_code)
+
+    # --- 🏷️ تحديد نوع الإشارة (نفس ترتيب الركائز: أول ركيزة قصوى تفوز) ---
+    pillar_names = ["cvd", "deriv", "tech", "ob", "vol"]
+    pillar_matrix = np.column_stack([p[k] for k in pillar_names])
+    dominant_idx = np.argmax(pillar_matrix, axis=1)
+    strong_labels = {
+        "vol": "Deep MM Absorption 🏦", "cvd": "Stealth Accumulation 🦈", "deriv": "Derivatives Trapping 🔥",
+        "ob": "Orderflow Dominance 💸", "tech": "Pre-Breakout Squeeze ⚡"
+    }
+    labels = []
+    for i, score in enumerate(scores):
+        dominant = pillar_names[dominant_idx[i]]
+        if score >= 80.0:
+            labels.append(strong_labels[dominant] if pillar_matrix[i, dominant_idx[i]] >= 85.0 else "High Probability Setup 🎯")
+        elif score >= 70.0:
+            if dominant in ("cvd", "vol"): labels.append("Smart Money Inflow 🐋")
+            elif dominant == "ob": labels.append("Orderbook Pressure 🧱")
+            else: labels.append("Structural Compression 🗜️")
+        else:
+            labels.append("Active Accumulation 🧲")
+
+    # --- مصفوفة الإجماع (6 محاور) ---
+    axes = np.column_stack([
+        col("macro_coil_flag") > 0,
+        ((col("lar_score") >= 2.0) & (col("current_z") > 1.5)) | (col("deep_absorption_flag") > 0),
+        (col("imbalance") > 0.15) | (col("global_ob_pressure") > 1.2) | (col("limit_absorption_flag") > 0),
+        col("squeeze_ratio") < 0.8,
+        col("liquidity_sweep_flag") > 0,
+        (col("rs_score") > 5.0) | (col("oi_rising_flag") > 0)
+    ])
+    confluence = axes.sum(axis=1).astype(int)
+    return scores, labels, confluence
+
+def rescore_last_radar_cycle(params=None, regime_code=None):
+    """إعادة تسعير آخر دورة مسح فوراً (مثلاً بعد تغيير الأوزان أو حالة السوق)"""
+    matrix = LAST_RADAR_FEATURES.get("matrix")
+    if matrix is None or len(matrix) == 0:
+        return []
+    scores, labels, confluence = score_radar_feature_matrix(matrix, params, regime_code)
+    ranked = sorted(zip(LAST_RADAR_FEATURES["symbols"], scores, labels, confluence), key=lambda x: x[1], reverse=True)
+    return [{"symbol": s, "score": float(sc), "signal_type": lb, "confluence": int(cf)} for s, sc, lb, cf in ranked]
+
+def benchmark_radar_kernel(n_coins: int = 350, repeats: int = 50):
+    """قياس سرعة النواة بمعزل عن الشبكة (ملي ثانية لكل دورة كاملة)"""
+    rng = np.random.default_rng(7)
+    F = rng.normal(0.0, 1.5, size=(n_coins, len(RADAR_FEATURE_COLUMNS)))
+    for flag in ("oi_rising_flag", "liquidity_sweep_flag", "ob_trap_flag", "macro_coil_flag", "deep_absorption_flag", "limit_absorption_flag"):
+        F[:, RADAR_FEATURE_INDEX[flag]] = rng.random(n_coins) > 0.7
+    F[:, RADAR_FEATURE_INDEX["regime_code"]] = rng.integers(0, 4, n_coins)
+    F[:, RADAR_FEATURE_INDEX["funding_rate"]] *= 0.0005
+    start = time.perf_counter()
+    for _ in range(repeats):
+        score_radar_feature_matrix(F)
+    return (time.perf_counter() - start) * 1000.0 / repeats
+
+# ====================================================================
+# ⏱️ ميزانية زمنية لكل عملة (Deadline Budgets) مع إلغاء تعاوني للمجسات البطيئة
+# ====================================================================
+RADAR_COIN_DEADLINE = 25.0 # أقصى زمن لتحليل عملة واحدة داخل مقعد المُجدول
+RADAR_PROBE_SLICES = {
+    "candles": 8.0, "spot_perp": 4.0, "micro_cvd": 4.0, "agg_orderbook": 5.0,
+    "ob_spoofing": 4.0, "orderflow": 5.0, "futures": 5.0, "phantom_ws": 6.0,
+    "btc_rs": 4.0, "ws_depth": 5.0, "whale_inflow": 3.0
+}
+PROBE_TIMEOUT_STATS = {} # name -> {"calls", "timeouts", "cycle_timeouts", "max_seconds"}
+
+async def run_probe(name, coro, neutral, deadline_at, rec=None):
+    """
+    تشغيل مجس تحت شريحة من ميزانية العملة: min(شريحته، المتبقي من الموعد النهائي).
+    عند التجاوز يُلغى المجس (wait_for يلغي المهمة الداخلية) ونعيد قيمة محايدة،
+    ويُسجل اسمه في rec["timed_out"] حتى لا تُحفظ نتيجة ناقصة في كاشف التغيير.
+    """
+    stats = PROBE_TIMEOUT_STATS.setdefault(name, {"calls": 0, "timeouts": 0, "cycle_timeouts": 0, "max_seconds": 0.0})
+    stats["calls"] += 1
+    loop = asyncio.get_running_loop()
+    budget = min(RADAR_PROBE_SLICES.get(name, 5.0), deadline_at - loop.time())
+    if budget <= 0:
+        coro.close()
+        stats["timeouts"] += 1
+        stats["cycle_timeouts"] += 1
+        if rec is not None:
+            rec.setdefault("timed_out", []).append(name)
+        return neutral
+    started = loop.time()
+    try:
+        return await asyncio.wait_for(coro, timeout=budget)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        stats["cycle_timeouts"] += 1
+        if rec is not None:
+            rec.setdefault("timed_out", []).append(name)
+        return neutral
+    finally:
+        stats["max_seconds"] = max(stats["max_seconds"], loop.time() - started)
+
+def probe_timeout_report():
+    """ملخص مهلات الدورة الحالية (الأكثر تأخيراً أولاً) ثم تصفير عدادات الدورة"""
+    slow = sorted(
+        ((name, st["cycle_timeouts"], st["calls"]) for name, st in PROBE_TIMEOUT_STATS.items() if st["cycle_timeouts"]),
+        key=lambda x: x[1], reverse=True
+    )
+    for st in PROBE_TIMEOUT_STATS.values():
+        st["cycle_timeouts"] = 0
+    if not slow:
+        return "none"
+    return ", ".join(f"{name}: {t}" for name, t, _ in slow)
+
+async def analyze_radar_coin(c, client, market_regime, sem, scan_record=None):
+    # 🗃️ scan_record: قاموس اختياري يملؤه التحليل بمرحلة الرفض والركائز والتاجات للحفظ الجماعي
+    rec = scan_record if scan_record is not None else {}
     async with sem:  
         try:
+            deadline_at = asyncio.get_running_loop().time() + RADAR_COIN_DEADLINE
             symbol = c["symbol"]
             price = float(c["quote"]["USD"]["price"])
             
-            candles = await get_candles_binance(f"{symbol}USDT", "1h", limit=750)
-            if not candles: return None
+            candles = await run_probe("candles", get_candles_binance(f"{symbol}USDT", "1h", limit=750), None, deadline_at, rec)
+            if not candles:
+                rec["veto"] = "no_candles"
+                return None
 
                         # --- هذا هو الكود البديل (سطر واحد يستدعي الدالة اللي فوق في الخلفية) ---
-            df, last_rsi, current_adx, current_z, vol_mean, vol_std = await asyncio.to_thread(process_dataframe_sync, candles)
+            df, last_rsi, current_adx, current_z, vol_mean, vol_std = await run_cpu_task(process_dataframe_sync, candles)
                         # ====================================================================
             # 🧠 محرك التقييم الديناميكي المؤسساتي (Dynamic Quant Scoring Engine)
             # ====================================================================
             
             tags = [] # قائمة لتجميع نوع الحركات
+            rec["tags"] = tags
                         # ====================================================================
             # 🛡️ THE RUTHLESS FILTER: Liquidity Absorption Ratio (LAR) & Spot Lead
             # ====================================================================
@@ -1883,11 +3245,13 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             # أ. الهروب من الفومو (Late FOMO Veto):
             if current_z > z_threshold and candle_spread_pct > 4.0:
                 tags.append("Late_FOMO_Pump")
+                rec["veto"] = "stage1_late_fomo"
                 return None 
 
             # ب. فلتر العملات الميتة (Dead Asset Veto):
             if lar_score < lar_threshold and current_z < (z_threshold - 1.0):
                 print(f"🗑️ {symbol} - قُتلت مبكراً (انعدام الامتصاص)") 
+                rec["veto"] = "stage1_dead_asset"
                 return None 
 
             # إضافة الـ Tag للعملات القوية
@@ -1902,22 +3266,24 @@ async def analyze_radar_coin(c, client, market_regime, sem):
                         # ==========================================================
             # 🟢 المرحلة الثانية: جلب البيانات المؤسساتية أولاً (Data Fetching Block)
             # ==========================================================
-            spot_lead_score = await detect_spot_perp_divergence(symbol, client)
+            spot_lead_score = await run_probe("spot_perp", detect_spot_perp_divergence(symbol, client), 0.0, deadline_at, rec)
             if spot_lead_score < -3.0:
                 tags.append("Spot_Dumping_Fakeout")
+                rec["veto"] = "stage2_spot_dumping"
                 return None 
 
             old_price_val = df["close"].iloc[-3] if len(df) > 3 else df["open"].iloc[0]
             approx_24h_vol_usd = df["volume"].tail(24).sum() * price 
 
             # 🚀 جلب جميع المتغيرات اللحظية من الـ API لتجنب أي NameError لاحقاً
-            micro_cvd_boost, micro_cvd_signal, micro_cvd_trend = await get_micro_cvd_absorption(f"{symbol}USDT", client, "1h")
-            global_ob_pressure = await get_aggregated_orderbook(client, symbol)
-            depth_data = await analyze_orderbook_spoofing_instant(symbol, client, price)
-            tick_delta, tick_buy, tick_sell, limit_abs_signal = await get_institutional_orderflow(f"{symbol}USDT", client)
-            _, futures_signal, funding_val, oi_change_pct = await get_futures_liquidity(symbol, client, price, old_price_val)
-            whale_score, phantom_tags = await detect_phantom_liquidity_ws(symbol, client, price, approx_24h_vol_usd)
-            rs_score = await detect_btc_relative_strength(symbol, client)
+            # ⏱️ كل مجس يأخذ شريحة من ميزانية العملة، والمتأخر يُلغى ويُعامل كقيمة محايدة
+            micro_cvd_boost, micro_cvd_signal, micro_cvd_trend = await run_probe("micro_cvd", get_micro_cvd_absorption(f"{symbol}USDT", client, "1h"), (0.0, None, 0.0), deadline_at, rec)
+            global_ob_pressure = await run_probe("agg_orderbook", get_aggregated_orderbook(client, symbol), 1.0, deadline_at, rec)
+            depth_data = await run_probe("ob_spoofing", analyze_orderbook_spoofing_instant(symbol, client, price), {"is_hollow": False, "imbalance": 0.0, "is_spoofed": False, "bid_pressure_ratio": 1.0}, deadline_at, rec)
+            tick_delta, tick_buy, tick_sell, limit_abs_signal = await run_probe("orderflow", get_institutional_orderflow(f"{symbol}USDT", client), (0.0, 0.0, 0.0, None), deadline_at, rec)
+            _, futures_signal, funding_val, oi_change_pct = await run_probe("futures", get_futures_liquidity(symbol, client, price, old_price_val), (0.0, None, 0.0, 0.0), deadline_at, rec)
+            whale_score, phantom_tags = await run_probe("phantom_ws", detect_phantom_liquidity_ws(symbol, client, price, approx_24h_vol_usd), (0.0, []), deadline_at, rec)
+            rs_score = await run_probe("btc_rs", detect_btc_relative_strength(symbol, client), 0.0, deadline_at, rec)
             
             tags.extend(phantom_tags)
             if limit_abs_signal == "Limit_Absorption": tags.append("Limit_Absorption")
@@ -1927,7 +3293,7 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             # 🚀 استدعاء خوارزمية الدارك بول (VCA) وغرفة الاحتضان
             # ----------------------------------------------------
             # 🧬 1. فحص الانتماء لغرفة الاحتضان (The Incubation Synergy)
-            is_incubated = f"{symbol}USDT" in INCUBATION_MATRIX
+            is_incubated = is_incubated_pair(f"{symbol}USDT")
             # 🛡️ حاجز الأمان: لا نمنح علاوة الاحتضان والماكرو إلا إذا كانت السيولة اللحظية (CVD) للعملة نفسها إيجابية
             incubation_bonus = 20.0 if (is_incubated and micro_cvd_trend > 0) else 0.0
 
@@ -1957,111 +3323,38 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             # 🧠 المرحلة الثالثة: محرك التسعير الكمي المضاعف (Multiplicative Quant Engine)
             # ====================================================================
             # 1. فك القيود (Uncapped Limits): جعل جميع الركائز تتنفس حتى 100%
-            
-            # --- البُعد الأول: الاتجاه (Directional Conviction) ---
-            # يعتمد على السيولة الكلية (CVD)، المشتقات، والتحليل الفني
+            # 🧮 الحساب الفعلي يتم في النواة الدفعية (score_radar_feature_matrix) لتوحيد المنطق مع إعادة التسعير
             avg_vol_20_temp = df["volume"].tail(20).mean()
             avg_vol_usd_temp = avg_vol_20_temp * price if avg_vol_20_temp > 0 else 1.0
             real_cvd_usd_eval = float(micro_cvd_trend) * price 
             cvd_ratio = real_cvd_usd_eval / avg_vol_usd_temp
-            
-            cvd_score = quant_sigmoid_score(cvd_ratio, sensitivity=6.0, limit=100.0)
-            spot_lead_bonus = max(0.0, min(20.0, spot_lead_score * 2.0))
-            dir_cvd = min(100.0, cvd_score + spot_lead_bonus)
-            
-            phantom_bonus = quant_sigmoid_score(whale_score, sensitivity=0.5, limit=50.0)
-            funding_sensitivity = -3000.0 if (futures_signal == "OI_Rising" and oi_change_pct > 0.02) else -1000.0
-            dir_deriv = quant_sigmoid_score(funding_val, sensitivity=funding_sensitivity, limit=100.0)
-            dir_deriv = min(100.0, dir_deriv + phantom_bonus)
-            
-            tech_base = 50.0
             squeeze_ratio = current_bb_width / (avg_bb_width + 1e-8) if not pd.isna(avg_bb_width) and avg_bb_width > 0 else 1.0
-            if squeeze_ratio < 0.8: tech_base += quant_sigmoid_score(1.0 - squeeze_ratio, sensitivity=5.0, limit=30.0)
-            tech_base += quant_sigmoid_score(rs_score, sensitivity=0.5, limit=20.0)
-            if is_liquidity_sweep and real_cvd_usd_eval > 0: tech_base += 15.0
-            dir_tech = min(100.0, tech_base)
 
-            # 🛡️ استرجاع أوزان حالة السوق بدقة (Regime-based Weighting)
             current_regime_trend = market_regime['trend'] if isinstance(market_regime, dict) else "Unknown"
-            if current_regime_trend == "Trending_Bull":
-                directional_score = (dir_cvd * 0.55) + (dir_deriv * 0.25) + (dir_tech * 0.20)
-            elif current_regime_trend == "Trending_Bear":
-                directional_score = (dir_cvd * 0.50) + (dir_deriv * 0.35) + (dir_tech * 0.15)
-            else: # Ranging & Unknown
-                directional_score = (dir_cvd * 0.45) + (dir_deriv * 0.25) + (dir_tech * 0.30)
-
-            # --- البُعد الثاني: التوقيت (Timing & Execution) ---
-            imbalance = depth_data.get('imbalance', 0.0)
-            ob_base = quant_sigmoid_score(imbalance, sensitivity=4.0, limit=100.0)
-            global_ob_bonus = min(20.0, math.log1p(max(0, global_ob_pressure - 1.0)) * 10.0)
-            timing_score = min(100.0, ob_base + global_ob_bonus)
-            
-            if depth_data.get('is_hollow', False) or depth_data.get('is_spoofed', False):
-                timing_score *= 0.3 
-
-            # --- البُعد الثالث: الفوليوم كبوابة حتمية (The Volume Gatekeeper) ---
-            # تحويل VCA و Incubation إلى "زخم إضافي" للـ Z-Score
-            vca_z_boost = vca_bonus_score / 15.0  
-            inc_z_boost = incubation_bonus / 15.0
-            
-            effective_z = current_z + vca_z_boost + inc_z_boost
-            
-            # دالة Sigmoid قاسية تتمركز عند Z-Score = 1.5
-            safe_z_calc = max(-10.0, min(10.0, 2.0 * (effective_z - 1.5)))
-            raw_vol_multiplier = 1.0 / (1.0 + math.exp(-safe_z_calc))
-            
-            # 🚨 تم إصلاح الثغرة الرياضية (Negative Exponent Overflow) هنا:
-            if lar_score <= 0.0:
-                vol_penalty_factor = 0.1 # خنق تام إذا كان الامتصاص سلبياً أو معدوماً
-            elif lar_score < 1.0:
-                vol_penalty_factor = math.exp(-2.0 / (lar_score + 1e-8))
-            else:
-                vol_penalty_factor = 1.0
-                
-            volume_multiplier = raw_vol_multiplier * vol_penalty_factor
-
-            # --- ⚖️ الدمج المضاعف المؤسساتي (Multiplicative Fusion) ---
-            base_conviction = (directional_score * 0.70) + (timing_score * 0.30)
-            final_raw_score = base_conviction * volume_multiplier
-            
-            # 🚀 محفز الإجماع الأسّي (Exponential Confluence Boost)
-            if directional_score >= 80.0 and timing_score >= 80.0 and effective_z >= 2.5:
-                boost_factor = 1.05 + (effective_z * 0.012)
-                final_raw_score = min(99.5, final_raw_score * boost_factor)
-            
-            score = round(max(0.0, min(final_raw_score, 99.5)), 1)
-            
-            # 🔄 الحفاظ على التوافق التام مع المتغيرات اللاحقة (Dict compatibility)
-            scores = {
-                "cvd": dir_cvd, 
-                "deriv": dir_deriv, 
-                "tech": dir_tech, 
-                "ob": timing_score, 
-                "vol": volume_multiplier * 100.0
-            }
-
-            # --- 🏷️ تحديد نوع الإشارة بدقة ---
-                        # --- 🏷️ تحديد نوع الإشارة بدقة ---
-            dominant_pillar = max(scores, key=scores.get)
-            if score >= 80.0:
-                if dominant_pillar == "vol" and scores["vol"] >= 85.0: final_signal = "Deep MM Absorption 🏦"
-                elif dominant_pillar == "cvd" and scores["cvd"] >= 85.0: final_signal = "Stealth Accumulation 🦈"
-                elif dominant_pillar == "deriv" and scores["deriv"] >= 85.0: final_signal = "Derivatives Trapping 🔥"
-                elif dominant_pillar == "ob" and scores["ob"] >= 85.0: final_signal = "Orderflow Dominance 💸"
-                elif dominant_pillar == "tech" and scores["tech"] >= 85.0: final_signal = "Pre-Breakout Squeeze ⚡"
-                else: final_signal = "High Probability Setup 🎯"
-            
-            # التعديل الموضعي: تقسيم سكورات السبعينيات بناءً على محرك السوق الفعلي
-            elif score >= 70.0:
-                if dominant_pillar in ["cvd", "vol"]:
-                    final_signal = "Smart Money Inflow 🐋" # تدفق أموال ذكية (السيولة والفوليوم هي السبب)
-                elif dominant_pillar == "ob":
-                    final_signal = "Orderbook Pressure 🧱" # ضغط دفتر الأوامر (تكدس طلبات هجومية)
-                else:
-                    final_signal = "Structural Compression 🗜️" # انضغاط هيكلي (المشتقات والتحليل الفني هي السبب)
-            
-            else:
-                final_signal = "Active Accumulation 🧲" # لما دون السبعين (الوضع الافتراضي)
+            feature_row = build_radar_feature_row(
+                current_z=current_z, lar_score=lar_score, cvd_ratio=cvd_ratio,
+                spot_lead_score=spot_lead_score, whale_score=whale_score,
+                funding_rate=funding_val, oi_change_pct=oi_change_pct,
+                oi_rising_flag=futures_signal == "OI_Rising",
+                squeeze_ratio=squeeze_ratio, rs_score=rs_score,
+                liquidity_sweep_flag=bool(is_liquidity_sweep),
+                imbalance=depth_data.get('imbalance', 0.0), global_ob_pressure=global_ob_pressure,
+                ob_trap_flag=depth_data.get('is_hollow', False) or depth_data.get('is_spoofed', False),
+                vca_bonus=vca_bonus_score, incubation_bonus=incubation_bonus,
+                regime_code=RADAR_REGIME_CODES.get(current_regime_trend, 0),
+                macro_coil_flag=any(t in tags for t in ["DARK_POOL_COIL", "Incubated_Macro_Coil", "Whale_CVD"]),
+                deep_absorption_flag="DEEP_ABSORPTION" in tags,
+                limit_absorption_flag="Limit_Absorption" in tags
+            )
+            batch_scores, batch_labels, batch_confluence = score_radar_feature_matrix(feature_row)
+            score = float(batch_scores[0])
+            final_signal = batch_labels[0]
+            pillars = compute_radar_pillars(feature_row)
+            rec.update({
+                "score": score, "signal_type": final_signal, "confluence": int(batch_confluence[0]),
+                "pillars": [float(pillars[k][0]) for k in ("cvd", "deriv", "tech", "ob", "vol")],
+                "features": {**dict(zip(RADAR_FEATURE_COLUMNS, feature_row)), "vwap_z": current_vwap_z}
+            })
 
 
             # ==========================================
@@ -2107,15 +3400,18 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             if current_vwap_z > (dyn_vwap_z * veto_tolerance):
                 tags.append("Late_FOMO_Pump_VWAP")
                 print(f"🗑️ {symbol} - مرفوض: انحراف قوي عن VWAP (متجاوزاً عتبة الاحتضان {veto_tolerance}).")
+                rec["veto"] = "veto_vwap_fomo"
                 return None 
                 
             if is_orderbook_hollow_flag and current_cvd < 0:
                 tags.append("Liquidity_Void_Trap")
                 print(f"🗑️ {symbol} - مرفوض: جدران شراء وهمية والعمق الداعم فارغ تماماً!")
+                rec["veto"] = "veto_liquidity_void"
                 return None 
 
             if global_ob_pressure > dyn_ob_req and current_cvd < 0:
                 tags.append("Spoofing_Distribution_Trap")
+                rec["veto"] = "veto_spoofing_distribution"
                 return None 
 
             # ==========================================
@@ -2124,19 +3420,23 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             if is_strong_cvd:
                 if oi_change_pct < -0.015:  
                     tags.append("Short_Cover_Illusion")
+                    rec["veto"] = "veto_short_cover"
                     return None 
 
                 price_expansion = (current_high - current_low) / (current_low + 1e-8)
                 if price_expansion < dyn_expansion_threshold and limit_abs_signal != "Limit_Absorption" and "MM_Deep_Absorption_Phase" not in tags: 
                     tags.append("Limit_Absorption_Sell_Trap")
+                    rec["veto"] = "veto_limit_sell_trap"
                     return None 
 
             if current_cvd <= 0 and current_imbalance <= dyn_imbalance_req and global_ob_pressure < dyn_ob_req:
+                rec["veto"] = "veto_no_demand"
                 return None 
 
             ema200_veto = df["close"].ewm(span=200).mean().iloc[-1] if len(df) >= 200 else df["close"].ewm(span=50).mean().iloc[-1]
             if price < ema200_veto and current_adx < 20.0 and current_z > 2.0:
                 tags.append("Dead_Trend_Pump_Trap")
+                rec["veto"] = "veto_dead_trend"
                 return None  
 
                         # 1. تفعيل التاجات المخفية بناءً على الحسابات الموجودة مسبقاً
@@ -2153,18 +3453,8 @@ async def analyze_radar_coin(c, client, market_regime, sem):
             if rs_score > 5.0:
                 tags.append("Relative_Strength_Alpha")
 
-            # 2. مصفوفة الإجماع المؤسساتية المحدثة
-            confluence_axes = [
-                any(t in tags for t in ["DARK_POOL_COIL", "Incubated_Macro_Coil", "Whale_CVD"]), # المحرك الكلي والدارك بول
-                any(t in tags for t in ["High_Liquidity_Absorption", "DEEP_ABSORPTION"]),        # محرك امتصاص السيولة
-                any(t in tags for t in ["OB_Buy_Pressure", "Limit_Absorption"]),                 # محرك الأوردر بوك والطلبات المخفية
-                any(t in tags for t in ["Volatility_Squeeze"]),                                  # محرك الانضغاط السعري
-                any(t in tags for t in ["Liquidity_Sweep_Absorption"]),                          # محرك اختطاف السيولة (صيد القيعان)
-                any(t in tags for t in ["Relative_Strength_Alpha", "OI_Rising"])                 # محرك القوة النسبية والمشتقات
-            ]
-
-            
-            confluence_count = sum(1 for axis in confluence_axes if axis)
+            # 2. مصفوفة الإجماع المؤسساتية المحدثة (محسوبة مسبقاً في النواة الدفعية من نفس الإشارات)
+            confluence_count = int(batch_confluence[0])
 
             ema200_val = df["close"].ewm(span=200).mean().iloc[-1] if len(df) >= 200 else df["close"].ewm(span=50).mean().iloc[-1]
             is_macro_downtrend = price < ema200_val
@@ -2181,13 +3471,14 @@ async def analyze_radar_coin(c, client, market_regime, sem):
 
             if score >= required_score and confluence_count >= required_confluence:    
                 avg_vol_usd_for_depth = avg_vol_20 * price if avg_vol_20 > 0 else 15000.0
-                ws_depth_check = await analyze_orderbook_advanced_manual(symbol, client, price, avg_vol_usd_for_depth)
+                ws_depth_check = await run_probe("ws_depth", analyze_orderbook_advanced_manual(symbol, client, price, avg_vol_usd_for_depth), {}, deadline_at, rec)
 
                 if ws_depth_check.get('is_spoofed', False) or ws_depth_check.get('is_hollow', False):
                     print(f"🗑️ {symbol} - تم الإلغاء في اللحظة الأخيرة! الرادار اكتشف جدران وهمية عبر الـ WebSocket.")
+                    rec["veto"] = "ws_depth_spoof"
                     return None 
                 
-                whale_inflow = await get_whale_inflow_score()
+                whale_inflow = await run_probe("whale_inflow", get_whale_inflow_score(), 1.0, deadline_at, rec)
                 micro_volatility = df['close'].tail(20).pct_change().std() * 100
                 cvd_divergence = 1.0 if (price > ema200_val and current_cvd < 0) else -1.0 if (price < ema200_val and current_cvd > 0) else 0.0
 
@@ -2213,18 +3504,10 @@ async def analyze_radar_coin(c, client, market_regime, sem):
                     'funding_rate': float(funding_val)
                 }
 
-                                # 🧠 [Shadow Mode] استدعاء نموذج الذكاء الاصطناعي لمعرفة رأيه فقط
-                ai_confidence = await asyncio.to_thread(predict_signal_sync, ml_features)
-                
-                if ai_confidence != -1.0:
-                    # طباعة النسبة للأدمن دون أي تدخل في القرار
-                    ai_status = f"Shadow Mode 👁️ (Score: {ai_confidence:.1f}%)"
-                else:
-                    # في حال لم يتدرب النموذج بعد (أقل من 100 صفقة)
-                    ai_status = "Training & Learning ⏳"
-                
+                # 🧠 [Shadow Mode] رأي النموذج يُحسب دفعياً لكل الناجين عبر attach_ai_scores
                 # 🛡️ إجبار البوت على استخدام سكور الرادار الكلاسيكي فقط دون أي تغيير
                 final_score = score 
+                rec["veto"] = None # ✅ اجتازت كل المراحل
                 
                 return {
                     "symbol": symbol, "price": price, "score": final_score,
@@ -2235,253 +3518,1603 @@ async def analyze_radar_coin(c, client, market_regime, sem):
                     "signal_type": final_signal,
                     "confluence": confluence_count,
                     "ml_features": ml_features, 
-                    "ai_status": ai_status,
-                    "cvd_usd": float(current_cvd) # 👈 القيمة الدولارية الحقيقية جاهزة للطباعة بالرسالة
+                    "ai_status": "Training & Learning ⏳",
+                    "cvd_usd": float(current_cvd), # 👈 القيمة الدولارية الحقيقية جاهزة للطباعة بالرسالة
+                    "radar_features": feature_row # 🧮 صف الميزات الخام لإعادة التسعير الدفعي
                 }
+            rec["veto"] = "below_threshold"
             return None  
   
         except Exception as e:
             print(f"Error in analyze_radar_coin: {e}")
+            rec["veto"] = "error"
             return None  
 
 
 
-async def institutional_incubator_worker(pool):
+# ====================================================================
+# 🧬 نواة الاحتضان المتجهة (Vectorized Incubation Kernel)
+# ====================================================================
+INCUBATOR_CANDLES = 100 # عدد شموع 4 ساعات لكل عملة (نفس نافذة المحرك الأصلي)
+INCUBATOR_FETCH_CONCURRENCY = 5
+
+def build_aligned_candle_matrix(symbol_candles: dict, length=INCUBATOR_CANDLES, interval_seconds=14400):
+    """
+    يرصّ شموع كل العملات في مصفوفة واحدة (N, length, 4) = [volume, close, high, low]
+    على شبكة زمنية موحدة تنتهي عند أحدث شمعة. الشموع المفقودة تبقى NaN.
+    """
+    symbols = list(symbol_candles.keys())
+    matrix = np.full((len(symbols), length, 4), np.nan)
+    if not symbols:
+        return symbols, matrix
+    arrays = [np.asarray(symbol_candles[s], dtype=np.float64)[:, :5] for s in symbols]
+    latest_ts = max(a[-1, 0] for a in arrays if len(a))
+    grid_start = latest_ts - (length - 1) * interval_seconds
+    for i, a in enumerate(arrays):
+        idx = np.rint((a[:, 0] - grid_start) / interval_seconds).astype(np.int64)
+        ok = (idx >= 0) & (idx < length)
+        matrix[i, idx[ok]] = a[ok][:, [1, 2, 3, 4]]
+    return symbols, matrix
+
+def wilder_adx_series(high, low, close, window=14):
+    """
+    ADX (Wilder) لكل العملات وكل الشموع (N, T): متجه عبر العملات والحلقة فقط على محور الزمن.
+    نفس نتيجة ta.trend.ADXIndicator(fillna=True)؛ الشموع قبل اكتمال 2×window تساوي صفراً.
+    """
+    n, length = close.shape
+    prev_close = close[:, :-1]
+    tr = np.maximum(high[:, 1:], prev_close) - np.minimum(low[:, 1:], prev_close)
+    up = high[:, 1:] - high[:, :-1]
+    down = low[:, :-1] - low[:, 1:]
+    plus_dm = np.where((up > down) & (up > 0), up, 0.0)
+    minus_dm = np.where((down > up) & (down > 0), down, 0.0)
+    steps = tr.shape[1]
+    adx = np.zeros((n, length))
+    if steps < window * 2:
+        return adx
+    tr_s = tr[:, :window].sum(axis=1)
+    p_s = plus_dm[:, :window].sum(axis=1)
+    m_s = minus_dm[:, :window].sum(axis=1)
+    dx_hist = np.empty((n, steps - window + 1))
+    for j, t in enumerate(range(window, steps + 1)):
+        if t > window:
+            tr_s = tr_s - tr_s / window + tr[:, t - 1]
+            p_s = p_s - p_s / window + plus_dm[:, t - 1]
+            m_s = m_s - m_s / window + minus_dm[:, t - 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dip = 100 * p_s / tr_s
+            din = 100 * m_s / tr_s
+            dx = 100 * np.abs(dip - din) / (dip + din)
+        dx_hist[:, j] = np.nan_to_num(dx)
+    # العمود j في dx_hist يقابل الشمعة j + window
+    current = dx_hist[:, :window].mean(axis=1)
+    adx[:, 2 * window - 1] = current
+    for j in range(window, dx_hist.shape[1]):
+        current = (current * (window - 1) + dx_hist[:, j]) / window
+        adx[:, j + window] = current
+    return adx
+
+def compute_incubation_metrics(matrix, base_window=20, min_window=5, max_window=100, adx_window=14):
+    """
+    تمريرة متجهة واحدة لكل العملات: عرض البولينجر بنافذة ديناميكية، ADX (Wilder)، وZ-Score للفوليوم.
+    مطابقة لمنطق process_dataframe_sync + get_dynamic_window على آخر شمعة.
+    """
+    volume, close, high, low = (matrix[:, :, k] for k in range(4))
+    n, length = close.shape
+    valid = ~np.isnan(matrix).any(axis=(1, 2))
+
+    # 1. النافذة الديناميكية (Volatility-Adjusted Lookback)
+    returns = close[:, 1:] / close[:, :-1] - 1.0
+    hist_vol = np.std(returns[:, -max_window:], axis=1, ddof=1)
+    current_vol = np.std(returns[:, -min_window * 2:], axis=1, ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = hist_vol / current_vol
+        raw = np.where(
+            (hist_vol > 0) & np.isfinite(hist_vol) & np.isfinite(current_vol),
+            np.floor(np.minimum(base_window * ratio, max_window)), base_window
+        )
+    if length >= max_window:
+        window = np.clip(raw, min_window, max_window).astype(np.int64)
+    else:
+        window = np.full(n, base_window, dtype=np.int64)
+
+    # 2. عرض البولينجر الأخير عبر مجاميع تراكمية (نافذة مختلفة لكل عملة)
+    c0 = np.nan_to_num(close)
+    s1 = np.concatenate([np.zeros((n, 1)), np.cumsum(c0, axis=1)], axis=1)
+    s2 = np.concatenate([np.zeros((n, 1)), np.cumsum(c0 * c0, axis=1)], axis=1)
+    rows = np.arange(n)
+    w = np.minimum(window, length)
+    win_sum = s1[:, -1] - s1[rows, length - w]
+    win_sq = s2[:, -1] - s2[rows, length - w]
+    sma = win_sum / w
+    std = np.sqrt(np.maximum(win_sq / w - sma * sma, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bb_width = (4 * std) / sma
+
+    # 3. ADX (Wilder) متجه عبر العملات، والحلقة فقط على محور الزمن
+    adx = wilder_adx_series(high, low, close, adx_window)[:, -1]
+
+    # 4. Z-Score للفوليوم (نفس منطق calculate_volume_zscore على آخر شمعة)
+    vol_median = np.median(volume, axis=1)
+    clipped = volume.copy()
+    clipped[:, -1] = np.minimum(volume[:, -1], vol_median * 4)
+    vol_std = np.std(clipped, axis=1)
+    vol_z = (volume[:, -1] - vol_median) / (vol_std + 1e-8)
+    vol_z = np.where(np.isfinite(vol_z), vol_z, 0.0)
+
+    return {"valid": valid, "bb_width": bb_width, "adx": adx, "vol_z": vol_z, "window": window}
+
+# ====================================================================
+# 🧪 محرك الباك تست المتجه (Walk-Forward Candle Backtester)
+# ====================================================================
+# نعيد تشغيل منطق الرادار المشتق من الشموع فقط (Z-Score، LAR، فيتو VWAP، ضغط البولينجر،
+# كنس السيولة، VCA، فخ EMA200) على محور الزمن كاملاً لكل العملات دفعة واحدة.
+# الركائز التي تحتاج بيانات لحظية (الأوردر بوك، المشتقات، الحيتان) تبقى محايدة.
+BACKTEST_INTERVAL = "1h"
+BACKTEST_DEFAULT_DAYS = 365
+BACKTEST_MAX_SYMBOLS = 300
+BACKTEST_SYNC_CONCURRENCY = 6
+BACKTEST_WARMUP_BARS = 720 # نفس عمق الشموع الذي يراه الرادار الحي قبل أول قرار
+BACKTEST_PARAMS = {
+    "horizon": 24,            # أفق النتائج الأمامية (شموع)
+    "z_threshold": 2.5,       # عتبة الماكرو "Normal"
+    "lar_threshold": 0.8,
+    "vwap_z_threshold": 2.5,
+    "required_score": 70.0,   # 75 تحت EMA200 كما في الرادار الحي
+    "required_confluence": 2,
+    "score_buckets": (0, 40, 50, 60, 70, 80, 100)
+}
+
+async def sync_candle_store(pool, client, symbols, interval=BACKTEST_INTERVAL, days=BACKTEST_DEFAULT_DAYS, budget=None):
+    """
+    مزامنة تزايدية: لكل عملة نجلب فقط الشموع المغلقة بعد العلامة المائية (Watermark)،
+    ونكتبها مع تحديث العلامة في نفس المعاملة عبر COPY (لجدول مؤقت ثم دمج بدون تعارض).
+    """
+    step = CANDLE_INTERVAL_SECONDS[interval]
+    budget = budget or BinanceWeightBudget(share=LABEL_WEIGHT_SHARE)
+    now = time.time()
+    end = (now // step) * step # الشمعة الجارية لم تُغلق بعد
+    floor_start = ((now - days * 86400) // step) * step
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT symbol, last_open_ts FROM candle_store_watermarks WHERE interval = $1 AND symbol = ANY($2::text[])",
+            interval, list(symbols)
+        )
+    watermarks = {r['symbol']: r['last_open_ts'] for r in rows}
+
+    sem = asyncio.Semaphore(BACKTEST_SYNC_CONCURRENCY)
+    async def sync_one(sym):
+        start = max(floor_start, watermarks[sym] + step) if sym in watermarks else floor_start
+        if start >= end:
+            return 0
+        async with sem:
+            try:
+                candles = await fetch_kline_span(client, venue_symbol(sym, "binance"), start, end, budget, interval)
+            except Exception:
+                return 0
+        if candles is None or len(candles) == 0:
+            return 0
+        records = [(sym, interval, int(c[0]), *map(float, c[1:7])) for c in candles]
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # COPY لجدول مؤقت ثم دمج بـ ON CONFLICT: /backtest و /sweep المتزامنان قد يجلبان نفس الشموع
+                await conn.execute(
+                    "CREATE TEMP TABLE candle_store_stage (LIKE candle_store INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                await conn.copy_records_to_table(
+                    "candle_store_stage", records=records,
+                    columns=["symbol", "interval", "open_ts", "open", "high", "low", "close", "volume", "taker_buy"]
+                )
+                await conn.execute("""
+                    INSERT INTO candle_store SELECT * FROM candle_store_stage
+                    ON CONFLICT (symbol, interval, open_ts) DO NOTHING
+                """)
+                await conn.execute("""
+                    INSERT INTO candle_store_watermarks (symbol, interval, last_open_ts) VALUES ($1, $2, $3)
+                    ON CONFLICT (symbol, interval) DO UPDATE
+                    SET last_open_ts = GREATEST(candle_store_watermarks.last_open_ts, EXCLUDED.last_open_ts)
+                """, sym, interval, records[-1][2])
+        return len(records)
+
+    written = await asyncio.gather(*(sync_one(sym) for sym in symbols))
+    return {"symbols": len(symbols), "candles": int(sum(written)), "weight": budget.reset_cycle()}
+
+async def load_candle_panel(pool, symbols, interval=BACKTEST_INTERVAL, start_ts=0, end_ts=None):
+    """
+    لوحة شموع متراصة (N, T, 6) = [open, high, low, close, volume, taker_buy] على شبكة زمنية موحدة.
+    الشموع المفقودة NaN. القراءة عملة بعملة حتى لا نبني ملايين الـ Records دفعة واحدة.
+    """
+    step = CANDLE_INTERVAL_SECONDS[interval]
+    end_ts = end_ts or time.time()
+    per_symbol = {}
+    async with pool.acquire() as conn:
+        for sym in symbols:
+            rows = await conn.fetch("""
+                SELECT open_ts, open, high, low, close, volume, taker_buy FROM candle_store
+                WHERE symbol = $1 AND interval = $2 AND open_ts >= $3 AND open_ts < $4
+                ORDER BY open_ts
+            """, sym, interval, int(start_ts), int(end_ts))
+            if rows:
+                per_symbol[sym] = np.array([tuple(r) for r in rows], dtype=np.float64)
+    if not per_symbol:
+        return [], np.empty(0), np.empty((0, 0, 6))
+    grid_start = min(a[0, 0] for a in per_symbol.values())
+    grid_end = max(a[-1, 0] for a in per_symbol.values())
+    timestamps = np.arange(grid_start, grid_end + step, step)
+    names = list(per_symbol)
+    panel = np.full((len(names), len(timestamps), 6), np.nan)
+    for i, sym in enumerate(names):
+        a = per_symbol[sym]
+        panel[i, np.rint((a[:, 0] - grid_start) / step).astype(np.int64)] = a[:, 1:7]
+    return names, timestamps, panel
+
+def _rolling(frame, window, how, min_periods=None):
+    roll = frame.rolling(window, min_periods=min_periods or window)
+    return getattr(roll, how)(**({"ddof": 0} if how == "std" else {})).to_numpy().T
+
+def compute_candle_pillars(panel, params=None):
+    """
+    كل ركائز الشموع لكل (عملة، شمعة) دفعة واحدة. الحساب على محور الزمن عبر pandas/numpy
+    (الأعمدة = العملات) بنفس صيغ الرادار الحي، وبدون أي نظر للمستقبل.
+    """
+    params = {**BACKTEST_PARAMS, **(params or {})}
+    present = ~np.isnan(panel).any(axis=2)
+    # تعبئة الفجوات: ما قبل الإدراج بأول قيمة، والفجوات الداخلية بآخر سعر وحجم صفري
+    filled = np.empty_like(panel)
+    for k in range(6):
+        frame = pd.DataFrame(panel[:, :, k].T)
+        frame = frame.fillna(0.0) if k >= 4 else frame.ffill().bfill()
+        filled[:, :, k] = frame.to_numpy().T
+    o, h, l, c, v, tb = (filled[:, :, k] for k in range(6))
+    n, length = c.shape
+    cf, hf, lf, vf = (pd.DataFrame(x.T) for x in (c, h, l, v))
+
+    # 1. Z-Score الفوليوم (Winsorized) ونسبة الامتصاص LAR
+    vol_median = _rolling(vf, 720, "median", 100)
+    clipped = pd.DataFrame(np.minimum(v, vol_median * 4).T)
+    vol_std = _rolling(clipped, 720, "std", 100)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        current_z = np.nan_to_num((v - vol_median) / (vol_std + 1e-8), nan=0.0, posinf=0.0, neginf=0.0)
+        spread_pct = (h - l) / l * 100
+        avg_spread = _rolling(pd.DataFrame((np.abs(h - l) / l).T), 5, "mean", 1) * 100
+    lar_score = current_z / np.maximum(np.maximum(spread_pct, avg_spread), 0.15)
+
+    # 2. VWAP Z-Score (نافذة 24 شمعة)
+    typical = (h + l + c) / 3
+    typical_std = _rolling(pd.DataFrame(typical.T), 24, "std", 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        local_vwap = _rolling(pd.DataFrame((typical * v).T), 24, "sum", 1) / _rolling(vf, 24, "sum", 1)
+        vwap_z = np.nan_to_num((c - local_vwap) / (typical_std + 1e-8))
+
+    # 3. ضغط البولينجر بالنافذة الديناميكية (نافذة مختلفة لكل عملة ولكل شمعة)
+    returns = cf.pct_change()
+    hist_vol = returns.rolling(100).std().to_numpy().T
+    current_vol = returns.rolling(10).std().to_numpy().T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw_window = np.floor(20 * hist_vol / current_vol)
+    window = np.where((hist_vol > 0) & np.isfinite(hist_vol) & np.isfinite(current_vol),
+                      np.clip(np.nan_to_num(raw_window, posinf=100.0), 5, 100), 20).astype(np.int64)
+    current_bb = np.full((n, length), np.nan)
+    avg_bb = np.full((n, length), np.nan)
+    for w in np.unique(window):
+        mask = window == w
+        bb = 4 * cf.rolling(int(w)).std(ddof=0) / cf.rolling(int(w)).mean()
+        avg = bb.rolling(int(w) * 5).mean()
+        current_bb[mask] = bb.to_numpy().T[mask]
+        avg_bb[mask] = avg.to_numpy().T[mask]
+    squeeze_ratio = np.where(np.isfinite(avg_bb) & (avg_bb > 0), current_bb / (avg_bb + 1e-8), 1.0)
+
+    # 4. كنس السيولة: كسر قاع آخر 20 شمعة ثم الإغلاق فوقه
+    prior_low = lf.shift(1).rolling(20).min().to_numpy().T
+    liquidity_sweep = (l < prior_low) & (c > prior_low)
+
+    # 5. VCA من الشموع (نافذة حديثة 168 وتاريخية 504 قبلها)
+    recent_range = (hf.rolling(168).max() - lf.rolling(168).min()).to_numpy().T / _rolling(cf, 168, "mean")
+    hist_hi = hf.shift(168).rolling(504).max().to_numpy().T
+    hist_lo = lf.shift(168).rolling(504).min().to_numpy().T
+    hist_range = (hist_hi - hist_lo) / cf.shift(168).rolling(504).mean().to_numpy().T
+    recent_range = np.maximum(recent_range, 0.005)
+    hist_range = np.maximum(hist_range, 0.01)
+    recent_vol = _rolling(vf, 168, "sum")
+    hist_vol_avg = vf.shift(168).rolling(504).sum().to_numpy().T / 3.0
+    recent_density = recent_vol / recent_range
+    hist_density = hist_vol_avg / hist_range
+    coil = (recent_range < hist_range * 0.6) & (recent_density > hist_density * 1.8)
+    base_score = recent_density / (hist_density + 1e-8) * 6.0 + hist_range / (recent_range + 1e-8) * 4.0
+    # بديل CVD من الشموع: صافي الشراء العدواني (taker buy) للشمعة الحالية
+    cvd_units = 2 * tb - v
+    avg_vol_20 = _rolling(vf, 20, "mean", 1)
+    is_spot_driven = cvd_units * c > _rolling(vf, 168, "mean") * _rolling(cf, 168, "mean") * 0.25
+    # لا يوجد تاريخ OI في المخزن: نفترض مشتقات هادئة (is_stealth_derivatives)
+    dark_pool_coil = coil & is_spot_driven
+    deep_absorption = coil & ~is_spot_driven
+    vca_bonus = np.where(dark_pool_coil, np.minimum(50.0, base_score * 1.5), np.where(deep_absorption, np.minimum(30.0, base_score), 0.0))
+    vca_bonus = np.nan_to_num(vca_bonus)
+
+    # 6. فخ الترند الميت (EMA200 + ADX)
+    ema200 = cf.ewm(span=200).mean().to_numpy().T
+    adx = wilder_adx_series(h, l, c)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cvd_ratio = np.nan_to_num(cvd_units / avg_vol_20)
+
+    # صلاحية الشمعة: موجودة فعلاً + تاريخ كافٍ مثل الرادار الحي
+    bars_seen = np.cumsum(present, axis=1)
+    valid = present & (bars_seen > BACKTEST_WARMUP_BARS)
+    return {
+        "valid": valid, "close": c, "high": h, "low": l, "present": present,
+        "current_z": current_z, "lar_score": lar_score, "spread_pct": spread_pct, "vwap_z": vwap_z,
+        "squeeze_ratio": squeeze_ratio, "liquidity_sweep": liquidity_sweep, "vca_bonus": vca_bonus,
+        "dark_pool_coil": dark_pool_coil, "deep_absorption": deep_absorption,
+        "ema200": ema200, "adx": adx, "cvd_ratio": cvd_ratio
+    }
+
+def forward_outcomes(close, high, low, present, horizon):
+    """العائد بعد horizon شمعة + MFE/MAE (%) من إغلاق شمعة الإشارة. NaN إذا النافذة ناقصة"""
+    n, length = close.shape
+    fwd_ret = np.full((n, length), np.nan)
+    mfe = np.full((n, length), np.nan)
+    mae = np.full((n, length), np.nan)
+    if length <= horizon:
+        return fwd_ret, mfe, mae
+    sw = np.lib.stride_tricks.sliding_window_view
+    entry = close[:, :-horizon]
+    complete = sw(present[:, 1:], horizon, axis=1).all(axis=2) & present[:, :-horizon]
+    fwd_ret[:, :-horizon] = np.where(complete, (close[:, horizon:] / entry - 1) * 100, np.nan)
+    mfe[:, :-horizon] = np.where(complete, (sw(high[:, 1:], horizon, axis=1).max(axis=2) / entry - 1) * 100, np.nan)
+    mae[:, :-horizon] = np.where(complete, (1 - sw(low[:, 1:], horizon, axis=1).min(axis=2) / entry) * 100, np.nan)
+    return fwd_ret, mfe, mae
+
+def _outcome_stats(mask, fwd_ret, mfe, mae):
+    sel = mask & np.isfinite(fwd_ret)
+    count = int(sel.sum())
+    if count == 0:
+        return {"n": 0, "mean_ret": 0.0, "hit_rate": 0.0, "mean_mfe": 0.0, "mean_mae": 0.0}
+    r = fwd_ret[sel]
+    return {
+        "n": count, "mean_ret": float(r.mean()), "hit_rate": float((r > 0).mean() * 100),
+        "mean_mfe": float(mfe[sel].mean()), "mean_mae": float(mae[sel].mean())
+    }
+
+def backtest_regime_codes(names, panel, timestamps):
+    """
+    حالة السوق لكل شمعة من البيتكوين بنفس قواعد detect_market_regime
+    (ADX 14 وEMA 20/50 على فريم 4h، محولة لعدد شموع الفريم الحالي). بدون BTC: Unknown.
+    """
+    codes = np.zeros(panel.shape[1], dtype=np.int64)
+    if "BTC" not in names or len(timestamps) < 2:
+        return codes
+    scale = max(1, int(round(CANDLE_INTERVAL_SECONDS["4h"] / (timestamps[1] - timestamps[0]))))
+    btc = pd.DataFrame(panel[names.index("BTC"), :, 1:4]).ffill().bfill().to_numpy()
+    if np.isnan(btc).all():
+        return codes
+    h, l, c = (btc[:, k][None, :] for k in range(3))
+    adx = wilder_adx_series(h, l, c, window=14 * scale)[0]
+    close = pd.Series(btc[:, 2])
+    ema_fast = close.ewm(span=20 * scale).mean().to_numpy()
+    ema_slow = close.ewm(span=50 * scale).mean().to_numpy()
+    codes[:] = np.where(adx < 25, 3, np.where(ema_fast > ema_slow, 1, np.where(ema_fast < ema_slow, 2, 0)))
+    return codes
+
+def _candle_feature_rows(f, r, t, regimes):
+    """صفوف ميزات الرادار لـ (عملة، شمعة) محددة؛ الركائز اللحظية محايدة"""
+    F = np.zeros((len(r), len(RADAR_FEATURE_COLUMNS)))
+    columns = {
+        "current_z": f["current_z"][r, t], "lar_score": f["lar_score"][r, t], "cvd_ratio": f["cvd_ratio"][r, t],
+        "squeeze_ratio": f["squeeze_ratio"][r, t], "liquidity_sweep_flag": f["liquidity_sweep"][r, t],
+        "global_ob_pressure": 1.0, "vca_bonus": f["vca_bonus"][r, t],
+        "macro_coil_flag": f["dark_pool_coil"][r, t], "deep_absorption_flag": f["deep_absorption"][r, t],
+        "regime_code": regimes[t]
+    }
+    for name, values in columns.items():
+        F[:, RADAR_FEATURE_INDEX[name]] = values
+    return F
+
+def _candle_confluence(f, r, t):
+    z, lar = f["current_z"][r, t], f["lar_score"][r, t]
+    return (
+        f["dark_pool_coil"][r, t].astype(int)
+        + (((lar >= 2.0) & (z > 1.5)) | f["deep_absorption"][r, t])
+        + (f["squeeze_ratio"][r, t] < 0.8) + f["liquidity_sweep"][r, t]
+    )
+
+def run_candle_backtest(panel, timestamps, params=None, names=None, chunk_rows=200_000):
+    """
+    باك تست كامل بدون I/O (يعمل داخل عملية معزولة): الفيتو، السكور عبر نواة الرادار نفسها،
+    ثم النتائج الأمامية مجمعة حسب المرحلة وشريحة السكور والشهر (Walk-Forward).
+    """
+    started = time.perf_counter()
+    params = {**BACKTEST_PARAMS, **(params or {})}
+    f = compute_candle_pillars(panel, params)
+    regimes = backtest_regime_codes(names or [], panel, timestamps)
+    valid = f["valid"]
+    z, lar = f["current_z"], f["lar_score"]
+
+    # فيتو المراحل المشتقة من الشموع (بنفس ترتيب analyze_radar_coin)
+    late_fomo = valid & (z > params["z_threshold"]) & (f["spread_pct"] > 4.0)
+    dead_asset = valid & ~late_fomo & (lar < params["lar_threshold"]) & (z < params["z_threshold"] - 1.0)
+    stage1 = valid & ~late_fomo & ~dead_asset
+    vwap_fomo = stage1 & (f["vwap_z"] > params["vwap_z_threshold"])
+    below_ema = f["close"] < f["ema200"]
+    dead_trend = stage1 & ~vwap_fomo & below_ema & (f["adx"] < 20.0) & (z > 2.0)
+    survivors = stage1 & ~vwap_fomo & ~dead_trend
+
+    # السكور عبر نفس نواة الرادار (الركائز اللحظية محايدة) على الناجين فقط وعلى دفعات
+    scores = np.full(valid.shape, np.nan)
+    confluence = np.zeros(valid.shape, dtype=np.int64)
+    rows, cols = np.nonzero(survivors)
+    for start in range(0, len(rows), chunk_rows):
+        r, t = rows[start:start + chunk_rows], cols[start:start + chunk_rows]
+        chunk_scores, _ = radar_scores_and_pillars(_candle_feature_rows(f, r, t, regimes))
+        scores[r, t] = chunk_scores
+        confluence[r, t] = _candle_confluence(f, r, t)
+
+    required = np.where(below_ema, params["required_score"] + 5.0, params["required_score"])
+    signals = survivors & (np.nan_to_num(scores) >= required) & (confluence >= params["required_confluence"])
+
+    fwd_ret, mfe, mae = forward_outcomes(f["close"], f["high"], f["low"], f["present"], params["horizon"])
+    stats = lambda mask: _outcome_stats(mask, fwd_ret, mfe, mae)
+
+    buckets = []
+    edges = params["score_buckets"]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        buckets.append({"lo": lo, "hi": hi, **stats(survivors & (scores >= lo) & (scores < hi))})
+
+    months = np.array([datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m") for ts in timestamps])
+    monthly = []
+    for month in np.unique(months):
+        in_month = (months == month)[None, :]
+        monthly.append({"month": str(month), **stats(signals & in_month)})
+
+    return {
+        "symbols": int(panel.shape[0]), "bars": int(valid.sum()), "horizon": params["horizon"],
+        "vetoes": {
+            "stage1_late_fomo": int(late_fomo.sum()), "stage1_dead_asset": int(dead_asset.sum()),
+            "veto_vwap_fomo": int(vwap_fomo.sum()), "veto_dead_trend": int(dead_trend.sum())
+        },
+        "baseline": stats(valid), "survivors": stats(survivors), "signals": stats(signals),
+        "vetoed": stats(late_fomo | dead_asset | vwap_fomo | dead_trend),
+        "buckets": buckets, "monthly": monthly,
+        "seconds": time.perf_counter() - started
+    }
+
+async def backtest_universe(client, limit=BACKTEST_MAX_SYMBOLS):
+    """أعلى العملات سيولة في سبوت بايننس (بدون العملات المستقرة)"""
+    res = await client.get(f"{get_random_binance_base()}/api/v3/ticker/24hr", timeout=20)
+    res.raise_for_status()
+    stables = {"USDC", "FDUSD", "TUSD", "BUSD", "DAI", "USDP", "EUR", "AEUR"}
+    tickers = [
+        t for t in res.json()
+        if t["symbol"].endswith("USDT") and base_asset(t["symbol"]) not in stables
+        and symbol_on_venue(t["symbol"], "binance")
+    ]
+    tickers.sort(key=lambda t: float(t.get("quoteVolume", 0) or 0), reverse=True)
+    return [base_asset(t["symbol"]) for t in tickers[:limit]]
+
+async def refresh_backtest_panel(pool, days=BACKTEST_DEFAULT_DAYS):
+    """مزامنة كون الباك تست ثم تحميل لوحة الشموع (مشترك بين /backtest و /sweep)"""
+    async with httpx.AsyncClient(timeout=20, event_hooks={"response": [track_binance_weight]}) as client:
+        symbols = await backtest_universe(client)
+        sync = await sync_candle_store(pool, client, symbols, BACKTEST_INTERVAL, days)
+    names, timestamps, panel = await load_candle_panel(pool, symbols, BACKTEST_INTERVAL, time.time() - days * 86400)
+    return sync, names, timestamps, panel
+
+# ====================================================================
+# 🎛️ محرك مسح المعاملات المتوازي (Parallel Threshold Sweep)
+# ====================================================================
+# الركائز والنتائج الأمامية تُحسب مرة واحدة فقط، ثم تُنشر كأعمدة مسطحة في ذاكرة مشتركة
+# يقرؤها عمال مستقلون. كل إعداد (عتبات الفيتو + أوزان الركائز) يُقيّم بعمليات مقارنة ودمج فقط.
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+SWEEP_DEFAULT_CONFIGS = 300
+SWEEP_PARALLEL_MIN_CONFIGS = 200 # أقل من ذلك يكون تقييمها داخل العملية أسرع من تشغيل عمال spawn (الافتراضي 300 يمر عبر الـ Pool)
+SWEEP_MIN_SIGNALS = 30 # أقل عدد إشارات حتى يدخل الإعداد في الترتيب
+SWEEP_TOP_N = 10
+SWEEP_SPACE = {
+    "z_threshold": (2.0, 2.5, 3.0),
+    "lar_threshold": (0.6, 0.8, 1.0, 1.2),
+    "vwap_z_threshold": (2.2, 2.5, 3.2),
+    "required_score": (60.0, 65.0, 70.0, 75.0, 80.0),
+    "required_confluence": (1, 2, 3),
+    "directional_weight": (0.6, 0.7, 0.8),
+    "weights_bull": ((0.55, 0.25, 0.20), (0.45, 0.25, 0.30), (0.65, 0.15, 0.20)),
+    "weights_bear": ((0.50, 0.35, 0.15), (0.40, 0.35, 0.25), (0.60, 0.25, 0.15)),
+    "weights_other": ((0.45, 0.25, 0.30), (0.35, 0.25, 0.40), (0.55, 0.20, 0.25))
+}
+# الأعمدة المسطحة (صف لكل شمعة صالحة لها نتيجة أمامية كاملة)
+SWEEP_COLUMNS = (
+    "current_z", "lar_score", "spread_pct", "vwap_z", "below_ema", "adx", "regime",
+    "dir_cvd", "dir_deriv", "dir_tech", "ob", "volume_multiplier", "effective_z", "confluence",
+    "fwd_ret", "mfe", "mae", "month"
+)
+SWEEP_INDEX = {name: i for i, name in enumerate(SWEEP_COLUMNS)}
+_SWEEP_SHARED = {"shm": None, "data": None}
+
+def live_sweep_config():
+    """الإعداد الحالي للرادار بصيغة المسح (نقطة المقارنة الأولى دائماً)"""
+    weights = RADAR_SCORING_PARAMS["regime_weights"]
+    return {
+        "z_threshold": BACKTEST_PARAMS["z_threshold"], "lar_threshold": BACKTEST_PARAMS["lar_threshold"],
+        "vwap_z_threshold": BACKTEST_PARAMS["vwap_z_threshold"], "required_score": BACKTEST_PARAMS["required_score"],
+        "required_confluence": BACKTEST_PARAMS["required_confluence"],
+        "directional_weight": RADAR_SCORING_PARAMS["directional_weight"],
+        "weights_bull": weights[1], "weights_bear": weights[2], "weights_other": weights[0]
+    }
+
+def sweep_scoring_params(config):
+    return {
+        "regime_weights": {1: config["weights_bull"], 2: config["weights_bear"], 0: config["weights_other"]},
+        "directional_weight": config["directional_weight"],
+        "timing_weight": round(1.0 - config["directional_weight"], 6)
+    }
+
+def build_sweep_configs(space=None, mode="random", n=SWEEP_DEFAULT_CONFIGS, seed=7):
+    """
+    grid: كل التوافيق (حتى n)، random: n إعداداً عشوائياً بدون تكرار.
+    الإعداد الحي يكون أولاً دائماً حتى يظهر التحسن مقارنة به.
+    """
+    space = {**SWEEP_SPACE, **(space or {})}
+    keys = list(space)
+    configs, seen = [live_sweep_config()], set()
+    seen.add(tuple(configs[0][k] for k in keys))
+    if mode == "grid":
+        candidates = itertools.product(*(space[k] for k in keys))
+    else:
+        rng = random.Random(seed)
+        total = math.prod(len(space[k]) for k in keys)
+        candidates = (tuple(rng.choice(space[k]) for k in keys) for _ in range(min(n * 4, total * 4)))
+    for values in candidates:
+        if len(configs) >= n:
+            break
+        if values not in seen:
+            seen.add(values)
+            configs.append(dict(zip(keys, values)))
+    return configs
+
+def prepare_sweep_dataset(panel, timestamps, names=None, params=None, chunk_rows=200_000):
+    """
+    الجزء الثقيل (مرة واحدة): ركائز الشموع، ركائز نواة الرادار قبل الدمج، الإجماع، والنتائج الأمامية.
+    يرجع (data[len(SWEEP_COLUMNS), R], month_labels).
+    """
+    params = {**BACKTEST_PARAMS, **(params or {})}
+    f = compute_candle_pillars(panel, params)
+    regimes = backtest_regime_codes(names or [], panel, timestamps)
+    fwd_ret, mfe, mae = forward_outcomes(f["close"], f["high"], f["low"], f["present"], params["horizon"])
+    rows, cols = np.nonzero(f["valid"] & np.isfinite(fwd_ret))
+    month_labels, month_of_bar = np.unique(
+        [datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y-%m") for ts in timestamps],
+        return_inverse=True
+    )
+
+    data = np.empty((len(SWEEP_COLUMNS), len(rows)))
+    def put(name, values, sl=slice(None)):
+        data[SWEEP_INDEX[name], sl] = values
+    for name, source in (("current_z", "current_z"), ("lar_score", "lar_score"), ("spread_pct", "spread_pct"),
+                         ("vwap_z", "vwap_z"), ("adx", "adx")):
+        put(name, f[source][rows, cols])
+    put("below_ema", f["close"][rows, cols] < f["ema200"][rows, cols])
+    put("regime", regimes[cols])
+    put("fwd_ret", fwd_ret[rows, cols])
+    put("mfe", mfe[rows, cols])
+    put("mae", mae[rows, cols])
+    put("month", month_of_bar[cols])
+    for start in range(0, len(rows), chunk_rows):
+        sl = slice(start, start + chunk_rows)
+        r, t = rows[sl], cols[sl]
+        p = compute_radar_pillars(_candle_feature_rows(f, r, t, regimes))
+        for name, key in (("dir_cvd", "cvd"), ("dir_deriv", "deriv"), ("dir_tech", "tech"), ("ob", "ob"),
+                          ("volume_multiplier", "volume_multiplier"), ("effective_z", "effective_z")):
+            put(name, p[key], sl)
+        put("confluence", _candle_confluence(f, r, t), sl)
+    return data, [str(mo) for mo in month_labels]
+
+def evaluate_sweep_config(data, config, n_months):
+    """تقييم إعداد واحد على الأعمدة المشتركة: نفس ترتيب فيتو run_candle_backtest ثم السكور والإحصاءات"""
+    col = lambda name: data[SWEEP_INDEX[name]]
+    z, lar = col("current_z"), col("lar_score")
+    zt = config["z_threshold"]
+    late_fomo = (z > zt) & (col("spread_pct") > 4.0)
+    stage1 = ~late_fomo & ~((lar < config["lar_threshold"]) & (z < zt - 1.0))
+    below_ema = col("below_ema") > 0
+    vwap_fomo = col("vwap_z") > config["vwap_z_threshold"]
+    dead_trend = below_ema & (col("adx") < 20.0) & (z > 2.0)
+    # الإجماع لا يعتمد على المعاملات: نفلتر به أولاً حتى لا نسعّر إلا المرشحين
+    candidates = np.nonzero(stage1 & ~vwap_fomo & ~dead_trend & (col("confluence") >= config["required_confluence"]))[0]
+
+    sub = data[:, candidates]
+    scoring = sweep_scoring_params(config)
+    directional = regime_directional(
+        sub[SWEEP_INDEX["dir_cvd"]], sub[SWEEP_INDEX["dir_deriv"]], sub[SWEEP_INDEX["dir_tech"]],
+        sub[SWEEP_INDEX["regime"]], scoring["regime_weights"]
+    )
+    scores = combine_radar_score(
+        directional, sub[SWEEP_INDEX["ob"]], sub[SWEEP_INDEX["volume_multiplier"]], sub[SWEEP_INDEX["effective_z"]], scoring
+    )
+    required = np.where(sub[SWEEP_INDEX["below_ema"]] > 0, config["required_score"] + 5.0, config["required_score"])
+    sel = candidates[scores >= required]
+
+    count = len(sel)
+    result = {"config": config, "n": count, "mean_ret": 0.0, "hit_rate": 0.0, "mean_mfe": 0.0,
+              "mean_mae": 0.0, "quality": 0.0, "months_positive": 0.0}
+    if count == 0:
+        return result
+    r = data[SWEEP_INDEX["fwd_ret"], sel]
+    std = float(r.std(ddof=1)) if count > 1 else 0.0
+    months = data[SWEEP_INDEX["month"], sel].astype(np.int64)
+    month_n = np.bincount(months, minlength=n_months)
+    month_sum = np.bincount(months, weights=r, minlength=n_months)
+    active = month_n > 0
+    result.update({
+        "mean_ret": float(r.mean()), "hit_rate": float((r > 0).mean() * 100),
+        "mean_mfe": float(data[SWEEP_INDEX["mfe"], sel].mean()), "mean_mae": float(data[SWEEP_INDEX["mae"], sel].mean()),
+        # جودة الإعداد: t-stat للعائد الأمامي (يكافئ العائد والثبات وعدد الإشارات معاً)
+        "quality": float(r.mean() / std * math.sqrt(count)) if std > 0 else 0.0,
+        "months_positive": float((month_sum[active] > 0).mean() * 100)
+    })
+    return result
+
+def _sweep_worker_init(shm_name, shape):
+    """العامل يرتبط بالأعمدة المشتركة مرة واحدة (بدون نسخ ولا Pickle)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _SWEEP_SHARED["shm"] = shm
+    _SWEEP_SHARED["data"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+def _sweep_worker_eval(configs, n_months):
+    return [evaluate_sweep_config(_SWEEP_SHARED["data"], c, n_months) for c in configs]
+
+def run_param_sweep(panel, timestamps, names=None, configs=None, workers=SWEEP_WORKERS, top_n=SWEEP_TOP_N):
+    """
+    يعمل داخل عملية التدريب المعزولة: يجهز الأعمدة مرة واحدة، ينشرها في ذاكرة مشتركة،
+    ثم يوزع الإعدادات على Pool عمال (spawn) ويرتب النتائج حسب الجودة ثم نسبة النجاح.
+    الإعداد الحي يوضع أولاً هنا دائماً (بدون تكرار) لأن results[0] هو نقطة المقارنة.
+    """
+    started = time.perf_counter()
+    live = live_sweep_config()
+    configs = [live] + [c for c in (configs or build_sweep_configs()) if c != live]
+    data, month_labels = prepare_sweep_dataset(panel, timestamps, names)
+    prepared = time.perf_counter()
+    n_months, rows = len(month_labels), data.shape[1]
+
+    if len(configs) < SWEEP_PARALLEL_MIN_CONFIGS:
+        workers = 1
+    if workers <= 1:
+        results = [evaluate_sweep_config(data, c, n_months) for c in configs]
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        try:
+            np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+            shape = data.shape
+            del data
+            chunk = max(1, math.ceil(len(configs) / (workers * 4)))
+            batches = [configs[i:i + chunk] for i in range(0, len(configs), chunk)]
+            workers = min(workers, len(batches))
+            ctx = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=ctx, initializer=_sweep_worker_init, initargs=(shm.name, shape)
+            ) as executor:
+                results = list(itertools.chain.from_iterable(executor.map(_sweep_worker_eval, batches, [n_months] * len(batches))))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    eligible = [r for r in results if r["n"] >= SWEEP_MIN_SIGNALS]
+    eligible.sort(key=lambda r: (r["quality"], r["hit_rate"]), reverse=True)
+    return {
+        "configs": len(results), "eligible": len(eligible), "rows": int(rows), "workers": workers,
+        "symbols": int(panel.shape[0]), "months": month_labels[0] + " → " + month_labels[-1] if month_labels else "",
+        "live": results[0], "top": eligible[:top_n],
+        "prepare_seconds": prepared - started, "sweep_seconds": time.perf_counter() - prepared
+    }
+
+async def load_incubator_candles(client, symbols):
+    """
+    شموع 4 ساعات المغلقة فقط لكل العملات: من الكاش أولاً، والمفقود فقط يُجلب بتزامن محدود.
+    الشمعة الجارية (التي فتحت للتو عند الإغلاق) تُحذف: فوليومها شبه صفري ويُفسد Volume Z والبولينجر وADX.
+    """
+    current_open = (int(time.time()) // FOUR_HOURS) * FOUR_HOURS
+    closed_only = lambda candles: candles[candles[:, 0] < current_open][-INCUBATOR_CANDLES:]
+    symbol_candles, missing = {}, []
+    for sym in symbols:
+        cached = get_cached_candles(sym, "4h", max_age=14400)
+        # الكاش مقبول فقط إذا جُلب بعد آخر إغلاق (يحتوي شمعة الفترة الحالية) فتكون الشمعة المغلقة نهائية
+        if cached is not None and len(cached) > INCUBATOR_CANDLES and cached[-1, 0] >= current_open:
+            symbol_candles[sym] = closed_only(cached)
+        else:
+            missing.append(sym)
+
+    sem = asyncio.Semaphore(INCUBATOR_FETCH_CONCURRENCY)
+    async def fetch(sym):
+        async with sem:
+            await binance_rate_limit_event.wait()
+            return sym, await get_candles_binance(sym, "4h", limit=INCUBATOR_CANDLES + 1)
+
+    for sym, candles in await asyncio.gather(*(fetch(s) for s in missing)):
+        if candles:
+            closed = closed_only(np.asarray(candles, dtype=np.float64))
+            if len(closed):
+                symbol_candles[sym] = closed
+    return symbol_candles, len(symbols) - len(missing)
+
+async def institutional_incubator_worker(pool):
+    """
+    [The Incubation Matrix] 🧬
+    يبحث عن التجميع المؤسساتي البطيء على فريمات 4H/1D ويجهزها للرادار اللحظي.
+    كل العملات تُحسب في تمريرة متجهة واحدة (BB Width + ADX + Volume Z) بدل عملة كل ثانيتين.
+    """
+    await asyncio.sleep(10) # الغرفة مستعادة مسبقاً من قاعدة البيانات، لا داعي لانتظار طويل
+    print("🧪 [Incubator] The Matrix is Online. Scanning Macro Coils...")
+    asyncio.create_task(four_hour_close_listener())
+
+    while True:
+        try:
+            current_time = time.time()
+            # تنظيف الغرفة من العملات التي تعفنت (مر عليها أكثر من 48 ساعة دون انفجار)
+            stale_coins = [k for k, v in INCUBATION_MATRIX.items() if current_time - v['incubation_start'] > INCUBATION_TTL_SECONDS]
+            for k in stale_coins:
+                del INCUBATION_MATRIX[k]
+                print(f"🧹 [Incubator] Removed {k} from matrix (Time Expired).")
+
+            async with httpx.AsyncClient(timeout=30) as client:
+                await binance_rate_limit_event.wait()
+                base_url = get_random_binance_base()
+                res = await client.get(f"{base_url}/api/v3/ticker/24hr")
+                
+                if res.status_code == 200:
+                    tickers = [t for t in res.json() if t['symbol'].endswith("USDT") and float(t['quoteVolume']) > 2_000_000 and owns_symbol(t['symbol'])]
+                    symbols = [t['symbol'] for t in tickers if t['symbol'].replace("USDT", "") not in BLACKLISTED_COINS]
+
+                    started = time.perf_counter()
+                    symbol_candles, cache_hits = await load_incubator_candles(client, symbols)
+                    fetched_at = time.perf_counter()
+
+                    # 🧮 مصفوفة واحدة مرصوصة زمنياً ثم تمريرة متجهة واحدة لكل المقاييس
+                    syms, matrix = build_aligned_candle_matrix(symbol_candles)
+                    metrics = await asyncio.to_thread(compute_incubation_metrics, matrix)
+
+                    # 🧠 شروط الاحتضان (Macro Compression & On-Chain Synergy):
+                    # إذا كان هناك طباعة قوية للعملات المستقرة على البلوكتشين،
+                    # نتساهل في شروط الاحتضان (نوسع البولينجر المسموح به) لنصطاد عملات أكثر
+                    onchain_boost = MACRO_CACHE.get("onchain_liquidity_score", 0.0)
+                    
+                    # عتبة البولينجر الديناميكية
+                    dynamic_bb_threshold = 0.08
+                    if onchain_boost > 15.0:
+                        dynamic_bb_threshold = 0.12 # توسيع العتبة لأن الماكرو إيجابي جداً
+                    elif onchain_boost < -10.0:
+                        dynamic_bb_threshold = 0.05 # تضييق العتبة لأن الماكرو سلبي
+
+                    coiled = (
+                        metrics["valid"]
+                        & (metrics["bb_width"] < dynamic_bb_threshold)
+                        & (metrics["adx"] < 25.0)
+                        & (metrics["vol_z"] > 1.0)
+                    )
+
+                    # ⚡ تحديث الغرفة دفعة واحدة
+                    added = 0
+                    added_symbols = []
+                    for i in np.flatnonzero(coiled):
+                        sym = syms[i]
+                        if sym not in INCUBATION_MATRIX:
+                            INCUBATION_MATRIX[sym] = {
+                                "incubation_start": time.time(),
+                                "macro_z": float(metrics["vol_z"][i]),
+                                "bb_width": float(metrics["bb_width"][i]),
+                                "onchain_fueled": True if onchain_boost > 15.0 else False # 👈 بصمة البلوكتشين
+                            }
+                            added += 1
+                            added_symbols.append(sym)
+                            print(f"🧬 [Incubator] Added {sym}. On-Chain Fueled: {INCUBATION_MATRIX[sym]['onchain_fueled']}")
+
+                    print(
+                        f"🧪 [Incubator] Swept {int(metrics['valid'].sum())}/{len(symbols)} symbols "
+                        f"(cache hits: {cache_hits}) | Fetch: {fetched_at - started:.1f}s | "
+                        f"Compute: {(time.perf_counter() - fetched_at) * 1000:.0f}ms | Added: {added} | Room: {len(INCUBATION_MATRIX)}"
+                    )
+                    await persist_incubation_matrix(pool, added_symbols) # 💾 الغرفة تنجو من إعادة التشغيل
+
+        except Exception as e:
+            print(f"⚠️ [Incubator] Error: {e}")
+            
+        # ⏱️ إعادة المسح عند إغلاق شمعة 4 ساعات بالضبط بدل sleep(14400) المنجرف
+        trigger = await wait_for_4h_close()
+        print(f"🕓 [Incubator] 4H candle closed ({trigger}). Rescanning...")
+
+async def handle_binance_rate_limit(retry_after: int = 60):
+    """توقف الرادار بالكامل عند استقبال 429 لمنع حظر 418"""
+    # نتأكد أن الإشارة خضراء حتى لا نقوم بتشغيل المؤقت أكثر من مرة
+    if binance_rate_limit_event.is_set():
+        print(f"⚠️ [نظام الحماية] بايننس أرسلت تحذير (429)! إيقاف جميع الطلبات لمدة {retry_after} ثانية...")
+        
+        # تحويل الإشارة إلى حمراء (تجميد كل المهام التي تنتظر الإشارة)
+        binance_rate_limit_event.clear() 
+        
+        # ننتظر الفترة المطلوبة من بايننس
+        await asyncio.sleep(retry_after)
+        
+        print("🟢 [نظام الحماية] انتهاء فترة التوقف. استئناف عمل الرادار...")
+        
+        # إرجاع الإشارة خضراء (تستيقظ جميع المهام وتكمل عملها تلقائياً)
+        binance_rate_limit_event.set()
+
+# ⚖️ عداد وزن بايننس (يُقرأ من هيدر X-MBX-USED-WEIGHT-1M في كل استجابة)
+BINANCE_WEIGHT_LIMIT_1M = 6000
+BINANCE_WEIGHT_STATE = {"used_weight_1m": 0, "last_update": 0.0, "responses": 0, "errors": 0}
+
+BINANCE_SPOT_HOSTS = {httpx.URL(base).host for base in BINANCE_BASES}
+
+async def track_binance_weight(response):
+    """
+    Response hook لعميل httpx: يسجل الوزن المستهلك وأخطاء الضغط (429/418/5xx) من بايننس فقط.
+    نفس العملاء يطلبون منصات أخرى (Bybit، OKX...) وأخطاؤها لا تدخل في معدل أخطاء بايننس،
+    والوزن يُقرأ من مضيفات السبوت فقط (هيدر fapi يخص حد العقود المنفصل).
+    """
+    host = response.request.url.host
+    if not (host == "binance.com" or host.endswith(".binance.com")):
+        return
+    BINANCE_WEIGHT_STATE["responses"] += 1
+    if response.status_code in (418, 429) or response.status_code >= 500:
+        BINANCE_WEIGHT_STATE["errors"] += 1
+    used = response.headers.get("x-mbx-used-weight-1m")
+    if used is not None and host in BINANCE_SPOT_HOSTS:
+        try:
+            BINANCE_WEIGHT_STATE["used_weight_1m"] = int(used)
+            BINANCE_WEIGHT_STATE["last_update"] = time.time()
+        except ValueError:
+            pass
+
+def binance_weight_usage_ratio():
+    """نسبة الوزن المستهلك من حد الدقيقة (صفر إذا كانت القراءة أقدم من دقيقة)"""
+    if time.time() - BINANCE_WEIGHT_STATE["last_update"] > 60:
+        return 0.0
+    return BINANCE_WEIGHT_STATE["used_weight_1m"] / BINANCE_WEIGHT_LIMIT_1M
+
+# ====================================================================
+# 🧾 كاتب عينات التدريب الدفعي (Buffered ML Sample Writer)
+# ====================================================================
+# ترتيب الأعمدة ومفاتيح الميزات المقابلة لها في مكان واحد (column, feature_key, default, cast)
+ML_FEATURE_SPEC = [
+    ("market_regime", "market_regime", 0, int),
+    ("sp500_trend_pct", "sp500_trend", 0.0, float),
+    ("sentiment_score", "sentiment_score", 50.0, float),
+    ("vol_z_score", "z_score", 0.0, float),
+    ("cvd_to_vol_ratio", "cvd_to_vol_ratio", 0.0, float), # 👈 القيمة النسبية الأهم
+    ("imbalance_ratio", "ofi_imbalance", 0.0, float),
+    ("ob_skewness", "ob_skewness", 1.0, float),
+    ("whale_dominance_pct", "whale_inflow", 0.0, float),
+    ("adx", "adx", 0.0, float),
+    ("rsi", "rsi", 50.0, float),
+    ("micro_volatility_pct", "micro_volatility", 0.0, float),
+    ("cvd_divergence", "cvd_divergence", 0.0, float),
+    ("funding_rate", "funding_rate", 0.0, float),
+]
+ML_SAMPLE_BUCKET_SECONDS = 5 * 3600 # عينة واحدة لكل عملة في كل نافذة 5 ساعات
+
+class MLSampleWriter:
+    """
+    يجمع العينات في الذاكرة ويكتبها دفعة واحدة (executemany) كل N صف أو T ثانية.
+    منع التكرار يتم في قاعدة البيانات عبر القيد الفريد (symbol, sample_bucket) + ON CONFLICT DO NOTHING.
+    عند فشل الكتابة تبقى الصفوف في الطابور (بحد أقصى max_pending حتى لا تنفجر الذاكرة).
+    """
+    def __init__(self, batch_size=50, flush_interval=30.0, max_pending=20000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool = None
+        self.buffer = []
+        self._lock = asyncio.Lock()
+        self._task = None
+        columns = ["symbol", "entry_price", "sample_bucket"] + [col for col, _, _, _ in ML_FEATURE_SPEC] + ["shadow_model_ids", "shadow_predictions"]
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+        self._insert_sql = f"""
+            INSERT INTO ml_training_data ({", ".join(columns)}, signal_time)
+            VALUES ({placeholders}, to_timestamp(${len(columns) + 1})::timestamp)
+            ON CONFLICT (symbol, sample_bucket) DO NOTHING
+        """
+
+    def start(self, pool):
+        self.pool = pool
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, symbol: str, price: float, features: dict, predictions=None):
+        """predictions: (model_ids, preds) من attach_ai_scores إن وُجدت، وإلا تُحسب دفعياً عند التفريغ"""
+        captured_at = time.time()
+        model_ids, preds = predictions if predictions else (None, None)
+        row = (
+            symbol, float(price), int(captured_at // ML_SAMPLE_BUCKET_SECONDS),
+            *[cast(features.get(key, default)) for _, key, default, cast in ML_FEATURE_SPEC],
+            model_ids, preds, captured_at
+        )
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.buffer or self.pool is None:
+                return 0
+            pending, self.buffer = self.buffer, []
+            # تصفية التكرار داخل الدفعة نفسها قبل إرسالها
+            batch, seen = [], set()
+            for row in pending:
+                if (row[0], row[2]) not in seen:
+                    seen.add((row[0], row[2]))
+                    batch.append(row)
+            batch = self._attach_shadow_predictions(batch)
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.executemany(self._insert_sql, batch)
+            except Exception as e:
+                self.buffer = (batch + self.buffer)[-self.max_pending:] # نعيدها للطابور (الأحدث أولى بالبقاء)
+                print(f"⚠️ [ML Logger] Batch flush failed ({len(self.buffer)} rows pending): {e}")
+                return 0
+            print(f"🧠 [ML Logger] Flushed {len(batch)} institutional samples in one round trip.")
+            return len(batch)
+
+    def _attach_shadow_predictions(self, batch):
+        """العينات بدون تنبؤات (مثل الحاصد) تُقيّم بكل النماذج في نداء واحد قبل الكتابة"""
+        unscored = [i for i, row in enumerate(batch) if row[-3] is None]
+        if not unscored:
+            return batch
+        n_features = len(ML_FEATURE_SPEC)
+        matrix = np.array([batch[i][3:3 + n_features] for i in unscored], dtype=np.float32)
+        try:
+            model_ids, preds = predict_all_models(matrix)
+        except Exception as e:
+            print(f"⚠️ [ML Logger] Shadow scoring skipped: {e}")
+            return batch
+        if not model_ids:
+            return batch
+        for j, i in enumerate(unscored):
+            batch[i] = (*batch[i][:-3], model_ids, preds[:, j].tolist(), batch[i][-1])
+        return batch
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def drain(self):
+        """تفريغ كامل عند الإغلاق حتى لا تضيع أي عينة"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+ML_SAMPLE_WRITER = MLSampleWriter()
+
+async def log_signal_for_ml(pool, symbol: str, price: float, features: dict, predictions=None):
+    """واجهة التوافق: تضع العينة في طابور الكاتب الدفعي بدل رحلتين لقاعدة البيانات لكل عملة"""
+    if ML_SAMPLE_WRITER.pool is None:
+        ML_SAMPLE_WRITER.start(pool)
+    await ML_SAMPLE_WRITER.add(symbol, price, features, predictions)
+
+# ====================================================================
+# 🌊 قراءة بيانات التدريب بالبث (Binary COPY -> NumPy Columns)
+# ====================================================================
+# بدل conn.fetch (Records ثم dicts ثم DataFrame = ثلاث نسخ)، نبث COPY الثنائي من السيرفر
+# ونفك البايتات مباشرة إلى مصفوفات محجوزة مسبقاً. كل الحقول ثابتة الطول (NULL -> NaN في SQL).
+ML_TRAINING_WHERE = "is_processed = 1 AND trade_quality_score IS NOT NULL"
+ML_TRAINING_COPY = """
+    SELECT id::int8, COALESCE(EXTRACT(EPOCH FROM labeled_at)::float8, 'NaN'),
+           COALESCE(EXTRACT(EPOCH FROM signal_time)::float8, 'NaN'),
+           {features},
+           trade_quality_score::float8
+    FROM ml_training_data
+    WHERE {where}
+    ORDER BY id
+"""
+ML_EXPORT_COLUMNS = ["id", "labeled_at", "signal_time"] + [col for col, _, _, _ in ML_FEATURE_SPEC] + ["trade_quality_score"]
+# كل صف في COPY الثنائي: عدد الحقول (int16) ثم لكل حقل طوله (int32) وقيمته (Big-Endian)
+ML_COPY_ROW_DTYPE = np.dtype(
+    [("n_fields", ">i2"), ("id_len", ">i4"), ("id", ">i8")]
+    + [pair for k, name in enumerate(ML_EXPORT_COLUMNS[1:]) for pair in ((f"len_{k}", ">i4"), (name, ">f8"))]
+)
+PGCOPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+class TrainingArrayStream:
+    """
+    مستقبل COPY الثنائي: يحول كل دفعة بايتات إلى أعمدة NumPy بدون إنشاء أي Record.
+    الذاكرة = المصفوفات النهائية فقط (+ بقايا صف واحد بين الدفعات).
+    """
+    def __init__(self, capacity=0):
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.labeled_at = np.empty(capacity, dtype=np.float64)
+        self.signal_time = np.empty(capacity, dtype=np.float64)
+        self.X = np.empty((capacity, len(ML_FEATURE_SPEC)), dtype=np.float32)
+        self.y = np.empty(capacity, dtype=np.float32)
+        self.count = 0
+        self._pending = b""
+        self._header_done = False
+
+    async def __call__(self, chunk):
+        self.feed(chunk)
+
+    def _grow(self, needed):
+        capacity = max(needed, len(self.ids) * 2, 1024)
+        self.ids = np.resize(self.ids, capacity)
+        self.labeled_at = np.resize(self.labeled_at, capacity)
+        self.signal_time = np.resize(self.signal_time, capacity)
+        self.X = np.resize(self.X, (capacity, self.X.shape[1]))
+        self.y = np.resize(self.y, capacity)
+
+    def feed(self, chunk):
+        buf = self._pending + bytes(chunk)
+        offset = 0
+        if not self._header_done:
+            if len(buf) < 19:
+                self._pending = buf
+                return
+            if buf[:11] != PGCOPY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            offset = 19 + int.from_bytes(buf[15:19], "big")
+            self._header_done = True
+        rows = (len(buf) - offset) // ML_COPY_ROW_DTYPE.itemsize
+        if rows:
+            recs = np.frombuffer(buf, dtype=ML_COPY_ROW_DTYPE, count=rows, offset=offset)
+            if (recs["n_fields"] != len(ML_EXPORT_COLUMNS)).any():
+                raise ValueError("Unexpected binary COPY row layout")
+            end = self.count + rows
+            if end > len(self.ids):
+                self._grow(end)
+            self.ids[self.count:end] = recs["id"]
+            self.labeled_at[self.count:end] = recs["labeled_at"]
+            self.signal_time[self.count:end] = recs["signal_time"]
+            for k, (col, _, _, _) in enumerate(ML_FEATURE_SPEC):
+                self.X[self.count:end, k] = recs[col]
+            self.y[self.count:end] = recs["trade_quality_score"]
+            self.count = end
+        self._pending = buf[offset + rows * ML_COPY_ROW_DTYPE.itemsize:]
+
+    def finish(self):
+        if self._pending not in (b"", b"\xff\xff"): # ذيل COPY = int16(-1)
+            raise ValueError(f"Truncated binary COPY stream ({len(self._pending)} bytes left)")
+        n = self.count
+        return {
+            "ids": self.ids[:n], "labeled_at": self.labeled_at[:n], "signal_time": self.signal_time[:n],
+            "X": self.X[:n], "y": self.y[:n]
+        }
+
+async def stream_training_arrays(pool, condition="", *args):
+    """
+    كل العينات الموسومة (مع شرط SQL إضافي اختياري) كأعمدة NumPy.
+    العد والبث داخل نفس لقطة REPEATABLE READ، فالحجز المسبق دقيق ولا يتضخم شيء في الذاكرة.
+    """
+    where = ML_TRAINING_WHERE + condition
+    features = ",\n           ".join(f"COALESCE({col}::float8, 'NaN')" for col, _, _, _ in ML_FEATURE_SPEC)
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            count = await conn.fetchval(f"SELECT COUNT(*) FROM ml_training_data WHERE {where}", *args)
+            stream = TrainingArrayStream(count)
+            await conn.copy_from_query(
+                ML_TRAINING_COPY.format(features=features, where=where), *args, output=stream, format="binary"
+            )
+    return stream.finish()
+
+ML_EXPORT_MAX_UPLOAD_BYTES = 49 * 1024 * 1024 # حد رفع الملفات لبوتات تيليجرام
+
+def write_training_export(arrays, path):
+    """ملف أعمدة مضغوط (.npz): عمود لكل ميزة بنفس أسماء ml_training_data"""
+    columns = {
+        "id": arrays["ids"], "labeled_at": arrays["labeled_at"], "signal_time": arrays["signal_time"],
+        "trade_quality_score": arrays["y"]
+    }
+    for k, (col, _, _, _) in enumerate(ML_FEATURE_SPEC):
+        columns[col] = np.ascontiguousarray(arrays["X"][:, k])
+    np.savez_compressed(path, **columns)
+    return os.path.getsize(path)
+
+# ====================================================================
+# 🧱 مخزن الميزات الزمني (Feature Store): كل القيم الخام بدون فلتر الـ 5 ساعات
+# ====================================================================
+# المتجه يُحفظ كمصفوفة بترتيب FEATURE_STORE_FIELDS. الحقول الجديدة تُضاف في النهاية فقط،
+# والقراءة تملأ الصفوف القديمة الأقصر بـ NaN. القيمة المفقودة من مصدر ما = NaN (وليست صفراً).
+FEATURE_STORE_FIELDS = (
+    [key for _, key, _, _ in ML_FEATURE_SPEC]
+    + [col for col in RADAR_FEATURE_COLUMNS if col not in {key for _, key, _, _ in ML_FEATURE_SPEC}]
+    + ["vwap_z", "tick_delta", "cvd_boost"]
+)
+FEATURE_STORE_INDEX = {name: i for i, name in enumerate(FEATURE_STORE_FIELDS)}
+FEATURE_STORE_COLUMNS = ["captured_at", "symbol", "source", "price", "features", "tags"]
+# صفوف الحاصد (شموع 15 دقيقة) لا تحمل ركائز الرادار التالية: تبقى NaN والصف يُوسم بـ "partial"،
+# فلا تُخلط مع صفوف "radar" كمجموعة تدريب كاملة الميزات (الفلترة بالمصدر أو بالتاج)
+HARVESTER_MISSING_FEATURES = (
+    "spot_lead_score", "whale_score", "rs_score", "squeeze_ratio", "liquidity_sweep_flag",
+    "vca_bonus", "incubation_bonus", "macro_coil_flag", "deep_absorption_flag"
+)
+FEATURE_STORE_PARTIAL_TAG = "partial"
+
+def feature_store_vector(values: dict):
+    vector = [float("nan")] * len(FEATURE_STORE_FIELDS)
+    for name, val in values.items():
+        idx = FEATURE_STORE_INDEX.get(name)
+        if idx is not None and val is not None:
+            vector[idx] = float(val)
+    return vector
+
+class FeatureStoreWriter:
+    """
+    كاتب دفعي لمخزن الميزات: COPY واحد كل N صف أو T ثانية.
+    عند فشل الكتابة تبقى الصفوف في الطابور (بحد أقصى max_pending حتى لا تنفجر الذاكرة).
+    """
+    def __init__(self, batch_size=500, flush_interval=60.0, max_pending=20000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool = None
+        self.buffer = []
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self, pool):
+        self.pool = pool
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, symbol: str, source: str, price: float, values: dict, tags=()):
+        captured_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        self.buffer.append((captured_at, symbol, source, float(price), feature_store_vector(values), list(tags)))
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.buffer or self.pool is None:
+                return 0
+            batch, self.buffer = self.buffer, []
+            try:
+                async with self.pool.acquire() as conn:
+                    await ensure_daily_partitions(conn, "feature_store")
+                    await conn.copy_records_to_table("feature_store", records=batch, columns=FEATURE_STORE_COLUMNS)
+            except Exception as e:
+                self.buffer = (batch + self.buffer)[-self.max_pending:]
+                print(f"⚠️ [Feature Store] Bulk write failed ({len(self.buffer)} rows pending): {e}")
+                return 0
+            return len(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def drain(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+FEATURE_STORE_WRITER = FeatureStoreWriter()
+
+async def load_feature_range(pool, start_ts: float, end_ts: float, symbols=None, source=None, fields=None):
+    """
+    قراءة نطاق زمني (Range Scan) جاهزة للتدريب والباك تست:
+    الشرط على captured_at يقصّ الأقسام اليومية، والنتيجة مصفوفة numpy واحدة (صفوف × حقول).
+    captured_at توقيت UTC بدون منطقة (كما يكتبه الكاتب وكما تُقسم الأيام)، فالحدود تُحوّل إلى UTC صراحة.
+    """
+    fields = list(fields or FEATURE_STORE_FIELDS)
+    idx = [FEATURE_STORE_INDEX[f] for f in fields]
+    query = """
+        SELECT symbol, EXTRACT(EPOCH FROM captured_at) AS ts, price, features
+        FROM feature_store
+        WHERE captured_at >= (to_timestamp($1) AT TIME ZONE 'UTC') AND captured_at < (to_timestamp($2) AT TIME ZONE 'UTC')
+          AND ($3::text[] IS NULL OR symbol = ANY($3::text[]))
+          AND ($4::text IS NULL OR source = $4)
+        ORDER BY symbol, captured_at
+    """
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, float(start_ts), float(end_ts), list(symbols) if symbols else None, source)
+
+    width = len(FEATURE_STORE_FIELDS)
+    matrix = np.full((len(rows), width), np.nan)
+    for i, r in enumerate(rows):
+        vec = r["features"][:width]
+        matrix[i, :len(vec)] = vec
+    return {
+        "symbols": np.array([r["symbol"] for r in rows], dtype=object),
+        "timestamps": np.array([float(r["ts"]) for r in rows], dtype=np.float64),
+        "prices": np.array([r["price"] if r["price"] is not None else np.nan for r in rows], dtype=np.float64),
+        "matrix": matrix[:, idx],
+        "fields": fields
+    }
+import numpy as np
+
+# ====================================================================
+# 🏷️ محرك الوسم الدفعي (Batched Labeling): نافذة BTC واحدة للجميع، شموع العملات بالتوازي، ومقاييس متجهة
+# ====================================================================
+LABEL_INTERVAL_SECONDS = 900 # شموع 15 دقيقة
+LABEL_WINDOW_CANDLES = 96 # 24 ساعة
+LABEL_BATCH_LIMIT = 1000
+LABEL_FETCH_CONCURRENCY = 6
+LABEL_WEIGHT_SHARE = 0.10
+LABEL_MAX_ATTEMPTS = 6 # بعدها تصبح العينة غير قابلة للوسم نهائياً
+LABEL_BACKOFF_SECONDS = 900 # 15د، 30د، 1س، 2س... (مضاعفة مع كل محاولة فاشلة)
+LABEL_STATE_FAILED = -1 # is_processed: 0 معلقة، 1 موسومة، -1 فشل نهائي
+LABEL_HARD_STOP = 5.0 # وقف خسارة وهمي عند -5% لتصحيح التقييم (Risk Penalty)
+LABEL_BTC_SYMBOL = "BTC"
+
+CANDLE_INTERVAL_SECONDS = {"15m": 900, "1h": 3600, "4h": 14400}
+
+async def fetch_kline_span(client, pair, start_sec, end_sec, budget, interval="15m"):
+    """
+    كل الشموع التي تفتح داخل [start, end) بصفحات من 1000
+    -> مصفوفة [open_ts, open, high, low, close, volume, taker_buy]
+    """
+    step = CANDLE_INTERVAL_SECONDS[interval]
+    rows, cursor, end_ms = [], int(start_sec * 1000), int(end_sec * 1000)
+    while cursor < end_ms:
+        await budget.acquire(5)
+        res = await client.get(
+            f"{get_random_binance_base()}/api/v3/klines",
+            params={"symbol": pair, "interval": interval, "startTime": cursor, "endTime": end_ms - 1, "limit": 1000}
+        )
+        if res.status_code != 200:
+            return None
+        data = res.json()
+        if not data:
+            break
+        rows.extend(data)
+        cursor = int(data[-1][0]) + step * 1000
+        if len(data) < 1000:
+            break
+    if not rows:
+        return np.empty((0, 7))
+    return np.array([[k[0] / 1000.0, k[1], k[2], k[3], k[4], k[5], k[9]] for k in rows], dtype=np.float64)
+
+def slice_label_windows(candles, start_secs, length=LABEL_WINDOW_CANDLES):
+    """
+    نوافذ (R, length, 4) = [open, high, low, close] تبدأ من أول شمعة تفتح عند/بعد كل توقيت.
+    الشموع المفقودة تبقى NaN (نفس معنى startTime في بايننس).
+    """
+    start_secs = np.asarray(start_secs, dtype=np.float64)
+    windows = np.full((len(start_secs), length, 4), np.nan)
+    if candles is None or len(candles) == 0 or len(start_secs) == 0:
+        return windows
+    base = candles[0, 0]
+    grid_idx = np.rint((candles[:, 0] - base) / LABEL_INTERVAL_SECONDS).astype(np.int64)
+    dense = np.full((grid_idx[-1] + 1, 4), np.nan)
+    dense[grid_idx] = candles[:, 1:5]
+    first = np.ceil((start_secs - base) / LABEL_INTERVAL_SECONDS).astype(np.int64)
+    idx = first[:, None] + np.arange(length)[None, :]
+    ok = (idx >= 0) & (idx < len(dense))
+    windows[ok] = dense[idx[ok]]
+    return windows
+
+# 🗃️ مخزن الشموع المحلي للوسم: الحاصد يجلب شموع 15 دقيقة أصلاً، فنحفظ المغلقة منها في candle_store
+# ويقرأ المفتش نوافذه من هناك (ومن كاش الشموع الحي) أولاً، ولا يطلب REST إلا للفجوات.
+CANDLE_STORE_LIVE_INTERVAL = "15m"
+CANDLE_STORE_LIVE_RETENTION_DAYS = 30
+CANDLE_STORE_PRUNE_SECONDS = 6 * 3600
+
+def cache_candles_to_ohlc(candles):
+    """تخطيط الكاش [ts, volume, close, high, low, open, taker_buy] -> [open_ts, open, high, low, close, volume, taker_buy]"""
+    candles = np.asarray(candles, dtype=np.float64)
+    if candles.ndim != 2 or len(candles) == 0:
+        return np.empty((0, 7))
+    return candles[:, [0, 5, 3, 4, 2, 1, 6]]
+
+def merge_candle_arrays(*arrays):
+    """دمج مصفوفات [open_ts, ...] مرتبة بالزمن بلا تكرار (الأسبق في الوسائط يفوز عند التعارض)"""
+    parts = [a for a in arrays if a is not None and len(a)]
+    if not parts:
+        return None
+    merged = np.concatenate(parts)
+    _, first = np.unique(merged[:, 0], return_index=True)
+    return merged[first]
+
+class CandleStoreWriter:
     """
-    [The Incubation Matrix] 🧬
-    يبحث عن التجميع المؤسساتي البطيء على فريمات 4H/1D ويجهزها للرادار اللحظي.
+    كاتب دفعي لشموع الحاصد: الشموع المغلقة فقط وبعد آخر شمعة كُتبت لكل عملة (علامة في الذاكرة)،
+    فلا تكرار ولا أي طلب إضافي لبايننس. الكتابة INSERT ... ON CONFLICT DO NOTHING لأن النطاقات تتداخل.
     """
-    await asyncio.sleep(60) # انتظر استقرار السيرفر
-    print("🧪 [Incubator] The Matrix is Online. Scanning Macro Coils...")
-
-    while True:
-        try:
-            current_time = time.time()
-            # تنظيف الغرفة من العملات التي تعفنت (مر عليها أكثر من 48 ساعة دون انفجار)
-            stale_coins = [k for k, v in INCUBATION_MATRIX.items() if current_time - v['incubation_start'] > 172800]
-            for k in stale_coins:
-                del INCUBATION_MATRIX[k]
-                print(f"🧹 [Incubator] Removed {k} from matrix (Time Expired).")
-
-            async with httpx.AsyncClient(timeout=30) as client:
-                await binance_rate_limit_event.wait()
-                base_url = get_random_binance_base()
-                res = await client.get(f"{base_url}/api/v3/ticker/24hr")
-                
-                if res.status_code == 200:
-                    tickers = [t for t in res.json() if t['symbol'].endswith("USDT") and float(t['quoteVolume']) > 2_000_000]
-                    
-                    for t in tickers:
-                        sym = t['symbol']
-                        clean_sym = sym.replace("USDT", "")
-                        if clean_sym in BLACKLISTED_COINS: continue
+    def __init__(self, interval=CANDLE_STORE_LIVE_INTERVAL, batch_size=5000, flush_interval=120.0, max_pending=200000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool = None
+        self.buffer = []
+        self.last_written = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._last_prune = 0.0
+
+    def start(self, pool):
+        self.pool = pool
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, symbol: str, candles, backfill=False):
+        """candles: [open_ts, open, high, low, close, volume, taker_buy]. backfill يتجاوز العلامة (فجوات REST القديمة)"""
+        if candles is None or len(candles) == 0:
+            return
+        step = CANDLE_INTERVAL_SECONDS[self.interval]
+        sym = base_asset(symbol)
+        ts = candles[:, 0]
+        keep = ts + step <= time.time() # الشمعة الجارية لم تُغلق بعد
+        last = self.last_written.get(sym)
+        if last is not None and not backfill:
+            keep &= ts > last
+        if not keep.any():
+            return
+        fresh = candles[keep]
+        self.last_written[sym] = max(last or 0, int(fresh[-1, 0]))
+        self.buffer.extend((sym, int(c[0]), *map(float, c[1:7])) for c in fresh)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.buffer or self.pool is None:
+                return 0
+            batch, self.buffer = self.buffer, []
+            cols = list(zip(*batch))
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute("""
+                        INSERT INTO candle_store (symbol, interval, open_ts, open, high, low, close, volume, taker_buy)
+                        SELECT u.symbol, $1, u.open_ts, u.open, u.high, u.low, u.close, u.volume, u.taker_buy
+                        FROM unnest($2::text[], $3::bigint[], $4::float8[], $5::float8[], $6::float8[],
+                                    $7::float8[], $8::float8[], $9::float8[])
+                             AS u(symbol, open_ts, open, high, low, close, volume, taker_buy)
+                        ON CONFLICT (symbol, interval, open_ts) DO NOTHING
+                    """, self.interval, *[list(c) for c in cols])
+            except Exception as e:
+                self.buffer = (batch + self.buffer)[-self.max_pending:]
+                print(f"⚠️ [Candle Store] Bulk write failed ({len(self.buffer)} rows pending): {e}")
+                return 0
+            return len(batch)
+
+    async def prune(self):
+        """الوسم يحتاج 24 ساعة بعد كل إشارة فقط، فلا داعي لتضخيم الجدول بشموع 15 دقيقة قديمة"""
+        cutoff = time.time() - CANDLE_STORE_LIVE_RETENTION_DAYS * 86400
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM candle_store WHERE interval = $1 AND open_ts < $2", self.interval, int(cutoff))
+        self._last_prune = time.time()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.time() - self._last_prune > CANDLE_STORE_PRUNE_SECONDS:
+                try:
+                    await self.prune()
+                except Exception as e:
+                    print(f"⚠️ [Candle Store] Prune failed: {e}")
 
-                        await binance_rate_limit_event.wait()
-                        # جلب شموع 4 ساعات للاحتضان
-                        candles = await get_candles_binance(sym, "4h", limit=100)
-                        if not candles: continue
-
-                        df, last_rsi, current_adx, current_z, vol_mean, vol_std = await asyncio.to_thread(process_dataframe_sync, candles)
-                        dyn_window = get_dynamic_window(df, base_window=20)
-                        sma = df["close"].rolling(dyn_window).mean()
-                        std = df["close"].rolling(dyn_window).std(ddof=0)
-                        bb_width = (4 * std) / sma
-                        current_bb_width = bb_width.iloc[-1]
-                        
-                        # 🧠 شروط الاحتضان (Macro Compression & On-Chain Synergy):
-                        # إذا كان هناك طباعة قوية للعملات المستقرة على البلوكتشين،
-                        # نتساهل في شروط الاحتضان (نوسع البولينجر المسموح به) لنصطاد عملات أكثر
-                        
-                        onchain_boost = MACRO_CACHE.get("onchain_liquidity_score", 0.0)
-                        
-                        # عتبة البولينجر الديناميكية
-                        dynamic_bb_threshold = 0.08
-                        if onchain_boost > 15.0:
-                            dynamic_bb_threshold = 0.12 # توسيع العتبة لأن الماكرو إيجابي جداً
-                        elif onchain_boost < -10.0:
-                            dynamic_bb_threshold = 0.05 # تضييق العتبة لأن الماكرو سلبي
-                            
-                        if current_bb_width < dynamic_bb_threshold and current_adx < 25.0 and current_z > 1.0:
-                            if sym not in INCUBATION_MATRIX:
-                                INCUBATION_MATRIX[sym] = {
-                                    "incubation_start": time.time(),
-                                    "macro_z": current_z,
-                                    "bb_width": current_bb_width,
-                                    "onchain_fueled": True if onchain_boost > 15.0 else False # 👈 بصمة البلوكتشين
-                                }
-                                print(f"🧬 [Incubator] Added {sym}. On-Chain Fueled: {INCUBATION_MATRIX[sym]['onchain_fueled']}")
-                        
-                        await asyncio.sleep(2) # راحة لبايننس
+    async def drain(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
 
-        except Exception as e:
-            print(f"⚠️ [Incubator] Error: {e}")
-            
-        await asyncio.sleep(14400) # يمسح السوق كل 4 ساعات
+CANDLE_STORE_WRITER = CandleStoreWriter()
 
-async def handle_binance_rate_limit(retry_after: int = 60):
-    """توقف الرادار بالكامل عند استقبال 429 لمنع حظر 418"""
-    # نتأكد أن الإشارة خضراء حتى لا نقوم بتشغيل المؤقت أكثر من مرة
-    if binance_rate_limit_event.is_set():
-        print(f"⚠️ [نظام الحماية] بايننس أرسلت تحذير (429)! إيقاف جميع الطلبات لمدة {retry_after} ثانية...")
-        
-        # تحويل الإشارة إلى حمراء (تجميد كل المهام التي تنتظر الإشارة)
-        binance_rate_limit_event.clear() 
-        
-        # ننتظر الفترة المطلوبة من بايننس
-        await asyncio.sleep(retry_after)
-        
-        print("🟢 [نظام الحماية] انتهاء فترة التوقف. استئناف عمل الرادار...")
-        
-        # إرجاع الإشارة خضراء (تستيقظ جميع المهام وتكمل عملها تلقائياً)
-        binance_rate_limit_event.set() 
-async def log_signal_for_ml(pool, symbol: str, price: float, features: dict):
+async def load_local_label_candles(pool, ranges, interval=CANDLE_STORE_LIVE_INTERVAL):
+    """
+    ranges: {symbol: (start, end)} -> {symbol: [open_ts, open, high, low, close, volume, taker_buy]}
+    من candle_store في استعلام واحد (كل عملة بنطاقها عبر unnest) مدموجاً مع الشموع المغلقة في الكاش الحي.
+    """
+    syms = list(ranges)
     async with pool.acquire() as conn:
-        # منع تكرار الإشارة لنفس العملة خلال 24 ساعة لتجنب تضخم البيانات (Overfitting)
-        exists = await conn.fetchval("""
-            SELECT 1 FROM ml_training_data 
-            WHERE symbol = $1 AND signal_time > CURRENT_TIMESTAMP - INTERVAL '5 hours'
-        """, symbol)
-        if exists: return 
+        rows = await conn.fetch("""
+            SELECT c.symbol, c.open_ts, c.open, c.high, c.low, c.close, c.volume, c.taker_buy
+            FROM candle_store c
+            JOIN unnest($2::text[], $3::bigint[], $4::bigint[]) AS r(symbol, start_ts, end_ts)
+              ON c.symbol = r.symbol AND c.open_ts >= r.start_ts AND c.open_ts < r.end_ts
+            WHERE c.interval = $1
+            ORDER BY c.symbol, c.open_ts
+        """, interval, syms, [int(ranges[s][0]) for s in syms], [int(math.ceil(ranges[s][1])) for s in syms])
+    stored = {}
+    for r in rows:
+        stored.setdefault(r['symbol'], []).append(tuple(r)[1:])
+
+    step = CANDLE_INTERVAL_SECONDS[interval]
+    local = {}
+    for sym in syms:
+        start, end = ranges[sym]
+        from_db = np.array(stored[sym], dtype=np.float64) if sym in stored else None
+        from_cache = None
+        entry = CANDLE_CACHE.get((venue_symbol(sym, "binance"), interval))
+        if entry:
+            c = cache_candles_to_ohlc(entry["candles"])
+            c = c[(c[:, 0] + step <= entry["fetched"]) & (c[:, 0] >= start) & (c[:, 0] < end)]
+            from_cache = c
+        local[sym] = merge_candle_arrays(from_db, from_cache)
+    return local
+
+async def gather_label_candles(pool, client, spans, budget):
+    """
+    spans: {symbol: [signal_ts]} -> ({symbol: candles أو None}, إحصاءات).
+    المخزن المحلي أولاً؛ REST فقط لنطاق الإشارات التي بقيت نوافذها ناقصة، وما يُجلب يُحفظ محلياً للمرة القادمة.
+    """
+    tail = LABEL_WINDOW_CANDLES * LABEL_INTERVAL_SECONDS + LABEL_INTERVAL_SECONDS
+    ranges = {sym: (min(starts), max(starts) + tail) for sym, starts in spans.items()}
+    try:
+        local = await load_local_label_candles(pool, ranges)
+    except Exception as e:
+        print(f"⚠️ [Quant Labeling] Local candle read failed (REST only): {e}")
+        local = {}
+
+    stats = {"local": 0, "rest": 0}
+    sem = asyncio.Semaphore(LABEL_FETCH_CONCURRENCY)
+    async def resolve(sym, starts):
+        candles = local.get(sym)
+        gaps = np.isnan(slice_label_windows(candles, starts)).any(axis=(1, 2))
+        if not gaps.any():
+            stats["local"] += 1
+            return candles
+        gap_starts = np.asarray(starts)[gaps]
+        async with sem:
+            try:
+                fetched = await fetch_kline_span(
+                    client, venue_symbol(sym, "binance"), gap_starts.min(), gap_starts.max() + tail, budget
+                )
+            except Exception:
+                fetched = None
+        if fetched is None:
+            return candles # الإشارات المكتملة محلياً تُوسم، والباقي يعود للتأخير التصاعدي
+        stats["rest"] += 1
+        await CANDLE_STORE_WRITER.add(sym, fetched, backfill=True)
+        return merge_candle_arrays(fetched, candles)
+
+    results = await asyncio.gather(*(resolve(sym, starts) for sym, starts in spans.items()))
+    return dict(zip(spans, results)), stats
+
+def compute_label_metrics(entry, windows, btc_windows, hard_stop=LABEL_HARD_STOP):
+    """
+    MFE/MAE والوقف الوهمي وجودة الصفقة لكل الصفوف دفعة واحدة (نفس منطق الحلقة القديمة):
+    بعد أول شمعة يبلغ فيها التراجع حد الوقف لا يُحتسب أي ربح لاحق.
+    """
+    entry = np.asarray(entry, dtype=np.float64)[:, None]
+    high, low, close = windows[:, :, 1], windows[:, :, 2], windows[:, :, 3]
+    complete = ~np.isnan(windows).any(axis=(1, 2)) & ~np.isnan(btc_windows).any(axis=(1, 2))
+
+    profit = (high - entry) / entry * 100
+    drawdown = (entry - low) / entry * 100
+    hit = np.maximum.accumulate(np.nan_to_num(drawdown, nan=-np.inf), axis=1) >= hard_stop
+    stopped = hit.any(axis=1)
+    stop_idx = np.where(stopped, hit.argmax(axis=1), windows.shape[1] - 1)
+    in_path = np.arange(windows.shape[1])[None, :] <= stop_idx[:, None]
+    mfe = np.maximum(np.nanmax(np.where(in_path, profit, -np.inf), axis=1), 0.0)
+    mae = np.maximum(np.nanmax(np.where(in_path, drawdown, -np.inf), axis=1), 0.0)
+
+    # --- حساب الأهداف الزمنية (Multi-Horizon Returns): الشمعة 4 = ساعة، 16 = 4 ساعات، الأخيرة = 24 ساعة ---
+    ret_1h = (close[:, 3] - entry[:, 0]) / entry[:, 0] * 100
+    ret_4h = (close[:, 15] - entry[:, 0]) / entry[:, 0] * 100
+    ret_24h = (close[:, -1] - entry[:, 0]) / entry[:, 0] * 100
+
+    # --- حساب الـ Alpha مقارنة بالبيتكوين ---
+    btc_return_24h = (btc_windows[:, -1, 3] - btc_windows[:, 0, 0]) / btc_windows[:, 0, 0] * 100
+    alpha_24h = ret_24h - btc_return_24h
+
+    # --- The Hedge Fund Score (Trade Quality) من -1.0 إلى +1.0 ---
+    raw_quality = (mfe - mae) / (mfe + mae + 0.1)
+    alpha_bonus = np.clip(alpha_24h / 50.0, -0.2, 0.2)
+    trade_quality = np.where(stopped & (mfe < 3.0), -1.0, np.clip(raw_quality + alpha_bonus, -1.0, 1.0))
+    return {
+        "complete": complete, "ret_1h": ret_1h, "ret_4h": ret_4h, "ret_24h": ret_24h,
+        "mfe": mfe, "mae": mae, "btc_return_24h": btc_return_24h, "alpha_24h": alpha_24h,
+        "trade_quality": trade_quality
+    }
 
-        await conn.execute("""
-            INSERT INTO ml_training_data 
-            (symbol, entry_price, market_regime, sp500_trend_pct, sentiment_score, 
-             vol_z_score, cvd_to_vol_ratio, imbalance_ratio, ob_skewness, whale_dominance_pct,
-             adx, rsi, micro_volatility_pct, cvd_divergence, funding_rate)
-             VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15)
-        """, 
-        symbol, 
-        price, 
-        int(features.get('market_regime', 0)),
-        float(features.get('sp500_trend', 0.0)), 
-        float(features.get('sentiment_score', 50.0)),
-        float(features.get('z_score', 0.0)), 
-        float(features.get('cvd_to_vol_ratio', 0.0)), # 👈 القيمة النسبية الأهم
-        float(features.get('ofi_imbalance', 0.0)), 
-        float(features.get('ob_skewness', 1.0)), 
-        float(features.get('whale_inflow', 0.0)),
-        float(features.get('adx', 0.0)), 
-        float(features.get('rsi', 50.0)), 
-        float(features.get('micro_volatility', 0.0)),
-        float(features.get('cvd_divergence', 0.0)), 
-        float(features.get('funding_rate', 0.0)))
-        
-        print(f"🧠 [ML Logger] Institutional Data captured for {symbol} at ${price}")
-import numpy as np
+async def write_label_batch(pool, done, failed_ids, terminal_ids):
+    """كل النتائج في UPDATE واحد عبر unnest، والمحاولات الفاشلة بتأخير تصاعدي أو حالة نهائية"""
+    async with pool.acquire() as conn:
+        if done:
+            cols = list(zip(*done))
+            labeled = await conn.fetch("""
+                UPDATE ml_training_data AS t
+                SET ret_1h = u.ret_1h, ret_4h = u.ret_4h, ret_24h = u.ret_24h,
+                    max_favorable_excursion = u.mfe, max_adverse_excursion = u.mae,
+                    btc_return_24h = u.btc_ret, alpha_24h = u.alpha,
+                    trade_quality_score = u.quality, is_processed = 1, labeled_at = CURRENT_TIMESTAMP
+                FROM unnest($1::int[], $2::float8[], $3::float8[], $4::float8[], $5::float8[],
+                            $6::float8[], $7::float8[], $8::float8[], $9::float8[])
+                     AS u(id, ret_1h, ret_4h, ret_24h, mfe, mae, btc_ret, alpha, quality)
+                WHERE t.id = u.id
+                RETURNING t.shadow_model_ids, t.shadow_predictions, t.trade_quality_score
+            """, *[list(c) for c in cols])
+            # 🥊 الدقة المتدحرجة لكل نموذج تتحدث مع نفس دفعة الوسوم
+            try:
+                await record_shadow_outcomes(conn, [tuple(r) for r in labeled])
+            except Exception as e:
+                print(f"⚠️ [Model Registry] Shadow scoring update failed: {e}")
+        if failed_ids:
+            await conn.execute("""
+                UPDATE ml_training_data
+                SET label_attempts = COALESCE(label_attempts, 0) + 1,
+                    next_label_at = CURRENT_TIMESTAMP + make_interval(secs => $2 * power(2, COALESCE(label_attempts, 0))),
+                    is_processed = CASE WHEN COALESCE(label_attempts, 0) + 1 >= $3 THEN $4 ELSE is_processed END
+                WHERE id = ANY($1::int[])
+            """, failed_ids, float(LABEL_BACKOFF_SECONDS), LABEL_MAX_ATTEMPTS, LABEL_STATE_FAILED)
+        if terminal_ids:
+            await conn.execute(
+                "UPDATE ml_training_data SET is_processed = $2 WHERE id = ANY($1::int[])",
+                terminal_ids, LABEL_STATE_FAILED
+            )
 
 async def ml_inspector_worker(pool):
     """
     [Institutional Grade] Walk-Forward Evaluation Engine.
     يستيقظ لتقييم الصفقات المعلقة عبر قياس MFE/MAE والـ Alpha مقارنة بالبيتكوين.
+    الوسم دفعي: النوافذ تُقرأ من مخزن الشموع المحلي، وREST لا يُطلب إلا لفجوات BTC أو العملة.
     """
     await asyncio.sleep(120)
     print("🕵️‍♂️ [Quant Inspector] Institutional Labeling Engine is online...")
+    budget = BinanceWeightBudget(share=LABEL_WEIGHT_SHARE)
+    window_seconds = LABEL_WINDOW_CANDLES * LABEL_INTERVAL_SECONDS
     
     while True:
+        await wait_for_leadership("Quant Inspector")
         try:
             async with pool.acquire() as conn:
-                # جلب الإشارات التي مر عليها 24 ساعة ولم يتم معالجتها
+                # جلب الإشارات التي مر عليها 24 ساعة ولم يتم معالجتها (واحترام مهلة إعادة المحاولة)
                 pending = await conn.fetch("""
                     SELECT id, symbol, entry_price, EXTRACT(EPOCH FROM signal_time) as sig_ts
                     FROM ml_training_data 
                     WHERE is_processed = 0 AND signal_time <= CURRENT_TIMESTAMP - INTERVAL '24 hours'
-                """)
+                      AND (next_label_at IS NULL OR next_label_at <= CURRENT_TIMESTAMP)
+                    ORDER BY signal_time
+                    LIMIT $1
+                """, LABEL_BATCH_LIMIT)
                 
             if not pending:
                 await asyncio.sleep(600)
                 continue
-                
-            async with httpx.AsyncClient(timeout=15) as client:
-                for row in pending:
-                    sym = f"{row['symbol']}USDT"
-                    entry = float(row['entry_price'])
-                    start_time_ms = int(row['sig_ts'] * 1000)
-                    
-                    base_url = get_random_binance_base()
-                    
-                    # 1. جلب شموع العملة (15 دقيقة) لـ 24 ساعة (96 شمعة)
-                    res_asset = await client.get(
-                        f"{base_url}/api/v3/klines",
-                        params={"symbol": sym, "interval": "15m", "startTime": start_time_ms, "limit": 96}
-                    )
-                    
-                    # 2. جلب شموع البيتكوين لنفس الفترة لحساب الـ Alpha
-                    res_btc = await client.get(
-                        f"{base_url}/api/v3/klines",
-                        params={"symbol": "BTCUSDT", "interval": "15m", "startTime": start_time_ms, "limit": 96}
+
+            by_symbol = {}
+            terminal_ids = []
+            for row in pending:
+                if not symbol_on_venue(row['symbol'], "binance"):
+                    terminal_ids.append(row['id']) # غير مدرجة في بايننس: لن تكتمل نافذتها أبداً
+                else:
+                    by_symbol.setdefault(base_asset(row['symbol']), []).append(row)
+
+            sig_all = [float(r['sig_ts']) for rows in by_symbol.values() for r in rows]
+            done, failed_ids = [], []
+            source_stats = {"local": 0, "rest": 0}
+            if sig_all:
+                # 1+2. نوافذ BTC وكل عملة من المخزن المحلي أولاً، وREST للفجوات فقط (بالتوازي تحت ميزانية الوزن)
+                spans = {sym: [float(r['sig_ts']) for r in rows] for sym, rows in by_symbol.items()}
+                spans[LABEL_BTC_SYMBOL] = sorted(set(spans.get(LABEL_BTC_SYMBOL, [])) | set(sig_all))
+                async with httpx.AsyncClient(timeout=15, event_hooks={"response": [track_binance_weight]}) as client:
+                    candle_map, source_stats = await gather_label_candles(pool, client, spans, budget)
+                btc = candle_map[LABEL_BTC_SYMBOL]
+
+                # 3. المقاييس متجهة لكل إشارات العملة دفعة واحدة
+                for sym, rows in by_symbol.items():
+                    candles = candle_map[sym]
+                    ids = [r['id'] for r in rows]
+                    if candles is None or btc is None:
+                        failed_ids.extend(ids)
+                        continue
+                    starts = [float(r['sig_ts']) for r in rows]
+                    metrics = compute_label_metrics(
+                        [float(r['entry_price']) for r in rows],
+                        slice_label_windows(candles, starts), slice_label_windows(btc, starts)
                     )
-                    
-                    if res_asset.status_code == 200 and res_btc.status_code == 200:
-                        klines = res_asset.json()
-                        btc_klines = res_btc.json()
-                        
-                        if not klines or len(klines) < 96 or not btc_klines:
+                    for i, row_id in enumerate(ids):
+                        if not metrics["complete"][i]:
+                            failed_ids.append(row_id)
                             continue
-                            
-                        # --- حساب الأهداف الزمنية (Multi-Horizon Returns) ---
-                        # الشمعة 4 = بعد ساعة، الشمعة 16 = بعد 4 ساعات، الشمعة 95 = بعد 24 ساعة
-                        ret_1h = ((float(klines[3][4]) - entry) / entry) * 100 if len(klines) >= 4 else 0.0
-                        ret_4h = ((float(klines[15][4]) - entry) / entry) * 100 if len(klines) >= 16 else 0.0
-                        ret_24h = ((float(klines[-1][4]) - entry) / entry) * 100
-                        
-                        # --- حساب الـ Alpha مقارنة بالبيتكوين ---
-                        btc_entry = float(btc_klines[0][1])
-                        btc_exit = float(btc_klines[-1][4])
-                        btc_return_24h = ((btc_exit - btc_entry) / btc_entry) * 100
-                        alpha_24h = ret_24h - btc_return_24h
-                        
-                        # --- التقييم الزمني لمسار السعر (MFE & MAE) ---
-                        mfe = 0.0
-                        mae = 0.0
-                        is_stopped_out = False
-                        
-                        # نعتبر أن هناك وقف خسارة وهمي عند -5% لتصحيح التقييم (Risk Penalty)
-                        HARD_STOP_LOSS = 5.0 
-                        
-                        for k in klines:
-                            high = float(k[2])
-                            low = float(k[3])
-                            
-                            profit_pct = ((high - entry) / entry) * 100
-                            drawdown_pct = ((entry - low) / entry) * 100
-                            
-                            if profit_pct > mfe: mfe = profit_pct
-                            if drawdown_pct > mae: mae = drawdown_pct
-                            
-                            # إذا ضربت العملة الانعكاس قبل تحقيق ربح جيد، نوقف تحديث الـ MFE
-                            if mae >= HARD_STOP_LOSS:
-                                is_stopped_out = True
-                                break 
-                                
-                        # --- The Hedge Fund Score (Trade Quality) ---
-                        # معادلة تقييم تدمج بين الربح، الخسارة المحتملة، وسرعة الحركة
-                        # تتراوح النتيجة بين -1.0 (تدمير للمحفظة) إلى +1.0 (صفقة قناص مثالية)
-                        
-                        if is_stopped_out and mfe < 3.0:
-                            trade_quality = -1.0 # ضربت الوقف فوراً
-                        else:
-                            # Quality = (MFE - MAE) / (MFE + MAE + 0.1)
-                            # الإضافة 0.1 لمنع القسمة على صفر
-                            raw_quality = (mfe - mae) / (mfe + mae + 0.1)
-                            
-                            # نعزز التقييم إذا كانت الألفا إيجابية (العملة أقوى من البيتكوين)
-                            alpha_bonus = min(0.2, max(-0.2, alpha_24h / 50.0))
-                            trade_quality = max(-1.0, min(1.0, raw_quality + alpha_bonus))
-
-                        # --- حفظ النتائج في قاعدة البيانات ---
-                        async with pool.acquire() as conn:
-                            await conn.execute("""
-                                UPDATE ml_training_data 
-                                SET ret_1h = $1, ret_4h = $2, ret_24h = $3,
-                                    max_favorable_excursion = $4, max_adverse_excursion = $5,
-                                    btc_return_24h = $6, alpha_24h = $7,
-                                    trade_quality_score = $8, is_processed = 1
-                                WHERE id = $9
-                            """, ret_1h, ret_4h, ret_24h, mfe, mae, btc_return_24h, alpha_24h, float(trade_quality), row['id'])
-                        
-                        print(f"📊 [Quant Labeling] {sym} | MFE: +{mfe:.1f}% | MAE: -{mae:.1f}% | Quality Score: {trade_quality:.2f}")
-                        
-                    await asyncio.sleep(0.5) # الامتثال لقيود بايننس
+                        done.append((
+                            row_id, *(float(metrics[k][i]) for k in (
+                                "ret_1h", "ret_4h", "ret_24h", "mfe", "mae", "btc_return_24h", "alpha_24h", "trade_quality"
+                            ))
+                        ))
+
+            # 4. الحفظ في رحلة واحدة لكل نوع نتيجة
+            await write_label_batch(pool, done, failed_ids, terminal_ids)
+            avg_quality = sum(d[-1] for d in done) / len(done) if done else 0.0
+            print(
+                f"📊 [Quant Labeling] Labeled: {len(done)} | Retry: {len(failed_ids)} | Unlabelable: {len(terminal_ids)} | "
+                f"Symbols: {len(by_symbol)} (local: {source_stats['local']}, REST: {source_stats['rest']}) | "
+                f"Avg Quality: {avg_quality:.2f} | Weight spent: {budget.reset_cycle()}"
+            )
+            if done:
+                await maybe_promote_challenger(pool) # 🥊 الوسوم الجديدة قد تحسم المنافسة
+            if len(pending) >= LABEL_BATCH_LIMIT:
+                continue # ما زال هناك تراكم: الدفعة التالية فوراً
                     
         except Exception as e:
             print(f"⚠️ Quant Inspector Error: {e}")
@@ -2501,6 +5134,100 @@ MACRO_CACHE = {
 
 # غرفة الاحتضان (الزنبرك): { "BTCUSDT": {"incubation_start": 1712000000, "score": 85} }
 INCUBATION_MATRIX = {} 
+INCUBATION_TTL_SECONDS = 172800 # العملة تخرج من الغرفة بعد 48 ساعة دون انفجار
+FOUR_HOURS = 14400
+INCUBATOR_CANDLE_CLOSE = asyncio.Event() # يُضبط لحظة إغلاق شمعة 4 ساعات
+
+def is_incubated_pair(pair: str) -> bool:
+    """فحص العضوية مع احترام الصلاحية (لا نعتمد على آخر تنظيف للعامل)"""
+    entry = INCUBATION_MATRIX.get(pair)
+    if entry is None:
+        return False
+    if time.time() - entry['incubation_start'] > INCUBATION_TTL_SECONDS:
+        INCUBATION_MATRIX.pop(pair, None)
+        return False
+    return True
+
+async def sync_incubation_matrix(pool):
+    """
+    مزامنة الغرفة من الجدول (مع حذف المنتهية صلاحيتها): كل نسخة تحتضن شريحتها فقط،
+    فالقراءة الدورية تجعل الرادار وrun_analysis في كل النسخ يرون إضافات الشرائح الأخرى.
+    الجدول يفوز للعملات الموجودة فيه، والإضافات المحلية غير المكتوبة بعد تبقى حتى تنتهي صلاحيتها.
+    """
+    cutoff = time.time() - INCUBATION_TTL_SECONDS
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM incubation_matrix WHERE incubation_start < $1", cutoff)
+        rows = await conn.fetch("SELECT symbol, incubation_start, macro_z, bb_width, onchain_fueled FROM incubation_matrix")
+    for r in rows:
+        INCUBATION_MATRIX[r['symbol']] = {
+            "incubation_start": r['incubation_start'],
+            "macro_z": r['macro_z'],
+            "bb_width": r['bb_width'],
+            "onchain_fueled": r['onchain_fueled']
+        }
+    return len(rows)
+
+async def rehydrate_incubation_matrix(pool):
+    """استعادة الغرفة فوراً عند التشغيل من الجدول"""
+    restored = await sync_incubation_matrix(pool)
+    print(f"🧬 [Incubator] Rehydrated {restored} coins from storage.")
+
+INCUBATION_SYNC_SECONDS = 300
+
+async def incubation_sync_worker(pool):
+    while True:
+        await asyncio.sleep(INCUBATION_SYNC_SECONDS)
+        try:
+            await sync_incubation_matrix(pool)
+        except Exception as e:
+            print(f"⚠️ [Incubator] Sync Error: {e}")
+
+async def persist_incubation_matrix(pool, added_symbols):
+    """
+    حذف المنتهي (TTL) أولاً ثم كتابة الإضافات الجديدة دفعة واحدة: عملة خرجت من الذاكرة وعادت
+    ببداية جديدة تستبدل صفها القديم بدل أن يحجب الإدراج ثم يُحذف (فتضيع عند إعادة التشغيل).
+    """
+    cutoff = time.time() - INCUBATION_TTL_SECONDS
+    rows = [
+        (sym, float(v['incubation_start']), float(v['macro_z']), float(v['bb_width']), bool(v['onchain_fueled']))
+        for sym in added_symbols if (v := INCUBATION_MATRIX.get(sym))
+    ]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM incubation_matrix WHERE incubation_start < $1", cutoff)
+            if rows:
+                await conn.executemany("""
+                    INSERT INTO incubation_matrix (symbol, incubation_start, macro_z, bb_width, onchain_fueled)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT (symbol) DO UPDATE SET
+                        incubation_start = EXCLUDED.incubation_start, macro_z = EXCLUDED.macro_z,
+                        bb_width = EXCLUDED.bb_width, onchain_fueled = EXCLUDED.onchain_fueled
+                """, rows)
+
+async def four_hour_close_listener():
+    """يستمع لإغلاق شمعة BTC 4H من بايننس (k.x = true) ويطلق إعادة مسح الغرفة بالضبط عند الحد"""
+    url = "wss://stream.binance.com:9443/ws/btcusdt@kline_4h"
+    while True:
+        try:
+            async with websockets.connect(url, ping_interval=20, ping_timeout=20) as ws:
+                async for message in ws:
+                    kline = json.loads(message).get("k", {})
+                    if kline.get("x"):
+                        INCUBATOR_CANDLE_CLOSE.set()
+        except Exception as e:
+            print(f"⚠️ [Incubator] 4H close stream error: {e} - reconnecting...")
+            await asyncio.sleep(5)
+
+async def wait_for_4h_close():
+    """انتظار إغلاق الشمعة القادمة: حدث الـ WebSocket أولاً، والساعة كاحتياط (الحد + 30 ثانية)"""
+    INCUBATOR_CANDLE_CLOSE.clear()
+    next_boundary = (int(time.time()) // FOUR_HOURS + 1) * FOUR_HOURS
+    timeout = max(1.0, next_boundary - time.time() + 30)
+    try:
+        await asyncio.wait_for(INCUBATOR_CANDLE_CLOSE.wait(), timeout=timeout)
+        return "ws"
+    except asyncio.TimeoutError:
+        return "clock"
 async def get_onchain_stablecoin_flow(client: httpx.AsyncClient):
     """
     [On-Chain Macro Engine] 🐋
@@ -2550,6 +5277,7 @@ async def macro_data_worker():
     headers = {"User-Agent": "Mozilla/5.0"}
 
     while True:
+        await wait_for_leadership("Macro Engine")
         try:
             async with httpx.AsyncClient(timeout=15) as client:
                 # 1. حالة السوق الأمريكي (SPY)
@@ -2633,10 +5361,297 @@ async def check_btc_gravity_veto(client: httpx.AsyncClient):
         pass
     return False # الوضع آمن
 
+RADAR_TARGET_CYCLE_SECONDS = 240.0 # الزمن المستهدف لمسح 350 عملة
+
+# ====================================================================
+# 🥇 الطبقة الأولى (Tier-1): ترتيب الكون كاملاً من البيانات المجمعة فقط
+# ====================================================================
+RADAR_TIER2_MIN_K = 30
+RADAR_TIER2_MAX_K = 150
+# طلبات السبوت الفعلية لكل عملة في analyze_radar_coin (المسار، limit) - أي تعديل هناك يُعدل هنا
+# (ws_depth و phantom_ws عبر WebSocket، و futures/whale_inflow على حد العقود المنفصل)
+RADAR_SPOT_CALLS = (
+    ("/api/v3/klines", 750),    # شموع الساعة
+    ("/api/v3/klines", 60),     # detect_spot_perp_divergence (جزء السبوت)
+    ("/api/v3/klines", 120),    # get_micro_cvd_absorption (فريم 1m)
+    ("/api/v3/depth", 50),      # get_aggregated_orderbook (جزء بايننس)
+    ("/api/v3/depth", 500),     # analyze_orderbook_spoofing_instant
+    ("/api/v3/aggTrades", 1000),# get_institutional_orderflow
+    ("/api/v3/klines", 60),     # detect_btc_relative_strength (العملة)
+    ("/api/v3/klines", 60)      # detect_btc_relative_strength (BTCUSDT)
+)
+RADAR_TIER2_WEIGHT_PER_COIN = sum(binance_spot_weight(path, limit) for path, limit in RADAR_SPOT_CALLS) # = 44
+RADAR_WEIGHT_SHARE = 0.25 # حصة الرادار من حد الوزن في الدقيقة (الباقي للحصاد والمفتش والمستخدمين)
+
+def tier1_radar_scores(coins):
+    """
+    تقييم رخيص ومتجه (Vectorized) لكل عملات USDT بدون أي طلب شبكة إضافي:
+    - Volume Z: من الشموع المخزنة إن وجدت (آخر شمعة مقابل 24 قبلها)، وإلا Z مقطعي لـ log(حجم 24h).
+    - Spread: الفارق بين أفضل عرض وطلب بالـ bps (كلما ضاق كان أفضل).
+    - VWAP Z: بعد السعر عن الـ VWAP (من الشموع المخزنة، أو lastPrice مقابل weightedAvgPrice من التيكر).
+    """
+    n = len(coins)
+    if n == 0:
+        return np.zeros(0), 0
+
+    quote_vol = np.array([c.get("volume", 0.0) for c in coins], dtype=np.float64)
+    last = np.array([c["quote"]["USD"]["price"] for c in coins], dtype=np.float64)
+    bid = np.array([c.get("bid", 0.0) for c in coins], dtype=np.float64)
+    ask = np.array([c.get("ask", 0.0) for c in coins], dtype=np.float64)
+    wavg = np.array([c.get("weighted_avg", 0.0) for c in coins], dtype=np.float64)
+    day_range = np.array([c.get("high", 0.0) - c.get("low", 0.0) for c in coins], dtype=np.float64)
+
+    # 1. Volume Z المقطعي (بديل عند غياب الكاش)
+    log_vol = np.log1p(quote_vol)
+    vol_z = (log_vol - log_vol.mean()) / (log_vol.std() + 1e-9)
+
+    # 2. VWAP Z من التيكر: المدى اليومي / 4 كتقريب للانحراف المعياري
+    vwap_z = np.where((wavg > 0) & (day_range > 0), (last - wavg) / (day_range / 4.0 + 1e-12), 0.0)
+
+    # 3. استبدال التقريبات بقيم السلاسل الزمنية للعملات التي لديها شموع مخزنة
+    cached_hits = 0
+    for i, c in enumerate(coins):
+        arr = get_cached_candles(f"{c['symbol']}USDT", "1h")
+        if arr is None or len(arr) < 26:
+            continue
+        cached_hits += 1
+        vols = arr[-25:, 1]
+        hist = vols[:-1]
+        vol_z[i] = (vols[-1] - hist.mean()) / (hist.std() + 1e-9)
+        tail = arr[-24:]
+        typical = (tail[:, 3] + tail[:, 4] + tail[:, 2]) / 3.0
+        vwap = (typical * tail[:, 1]).sum() / (tail[:, 1].sum() + 1e-12)
+        vwap_z[i] = (tail[-1, 2] - vwap) / (typical.std() + 1e-8)
+
+    mid = (bid + ask) / 2.0
+    spread_bps = np.where((bid > 0) & (ask > 0), (ask - bid) / np.maximum(mid, 1e-12) * 1e4, 50.0)
+
+    # نكافئ النشاط (Volume Z)، ونعاقب السبريد الواسع، ونفضل السعر تحت الـ VWAP (صيد القيعان)
+    score = (
+        np.clip(vol_z, -3.0, 5.0)
+        - 0.5 * np.clip(spread_bps / 10.0, 0.0, 4.0)
+        - 0.5 * np.clip(vwap_z, -2.0, 2.0)
+    )
+    return score, cached_hits
+
+def radar_tier2_budget():
+    """عدد العملات التي يسمح حد الوزن بتحليلها بعمق خلال دورة واحدة"""
+    headroom = max(0.0, 1.0 - binance_weight_usage_ratio())
+    cycle_minutes = RADAR_TARGET_CYCLE_SECONDS / 60.0
+    budget = headroom * BINANCE_WEIGHT_LIMIT_1M * cycle_minutes * RADAR_WEIGHT_SHARE
+    k = int(budget // RADAR_TIER2_WEIGHT_PER_COIN)
+    return max(RADAR_TIER2_MIN_K, min(RADAR_TIER2_MAX_K, k))
+
+def select_radar_tier2(coins):
+    """يعيد أفضل K عملة حسب تقييم الطبقة الأولى مع تقرير مختصر (المستبعدة في info["rejected"] للأرشفة)"""
+    if not coins:
+        return [], {"universe": 0, "selected": 0, "cached": 0, "k": 0, "rejected": []}
+    scores, cached_hits = tier1_radar_scores(coins)
+    k = min(len(coins), radar_tier2_budget())
+    order = np.argsort(-scores, kind="stable")
+    for i, c in enumerate(coins):
+        c["tier1_score"] = float(scores[i])
+    selected = [coins[i] for i in order[:k]]
+    rejected = [coins[i] for i in order[k:]]
+    return selected, {"universe": len(coins), "selected": len(selected), "cached": cached_hits, "k": k, "rejected": rejected}
+
+# ====================================================================
+# ♻️ كاشف التغيير (Incremental Rescan): لا نعيد تحليل عملة لم تتغير مدخلاتها
+# ====================================================================
+RADAR_FINGERPRINTS = {}
+RADAR_PRICE_BUCKET = math.log(1.005) # نطاق سعري 0.5%
+RADAR_VOLUME_BUCKET = math.log(1.10) # نطاق حجم 10%
+RADAR_FINGERPRINT_TTL = 3600 # لا نعيد استخدام نتيجة أقدم من ساعة مهما كان
+RADAR_UNCACHEABLE_VETOES = {"error", "no_candles"} # أعطال عابرة وليست حكماً على العملة
+
+def radar_result_cacheable(rec):
+    """لا نحفظ إلا التحليل الكامل: لا خطأ ولا شموع مفقودة ولا مجس عاد بقيمة محايدة بسبب المهلة"""
+    return rec.get("veto") not in RADAR_UNCACHEABLE_VETOES and not rec.get("timed_out")
+
+def radar_fingerprint(c):
+    """بصمة المدخلات: آخر شمعة ساعة مغلقة + نطاق السعر + نطاق حجم 24h"""
+    price = float(c["quote"]["USD"]["price"])
+    vol = float(c.get("volume", 0.0))
+    last_closed_hour = int(time.time() // 3600) - 1
+    price_bucket = int(math.floor(math.log(price) / RADAR_PRICE_BUCKET)) if price > 0 else 0
+    volume_bucket = int(math.floor(math.log(vol) / RADAR_VOLUME_BUCKET)) if vol > 0 else 0
+    return (last_closed_hour, price_bucket, volume_bucket)
+
+def split_unchanged_coins(coins):
+    """يقسم العملات إلى (عملات ونتائجها المعاد استخدامها، عملات تحتاج تحليل، بصماتها)"""
+    now = time.time()
+    reused, changed, fingerprints = [], [], {}
+    for c in coins:
+        fp = radar_fingerprint(c)
+        fingerprints[c["symbol"]] = fp
+        prev = RADAR_FINGERPRINTS.get(c["symbol"])
+        if prev and prev["fp"] == fp and now - prev["ts"] < RADAR_FINGERPRINT_TTL:
+            reused.append((c, prev["result"], prev.get("record", {})))
+        else:
+            changed.append(c)
+    return reused, changed, fingerprints
+
+# ====================================================================
+# 🗃️ الأرشيف الكامل للمسح (Radar Scan Results): صف لكل عملة في كل دورة عبر COPY واحد
+# ====================================================================
+RADAR_SCAN_COLUMNS = [
+    "scanned_at", "cycle_id", "symbol", "price", "tier1_score", "score",
+    "pillar_cvd", "pillar_deriv", "pillar_tech", "pillar_ob", "pillar_vol",
+    "confluence", "signal_type", "tags", "veto_stage", "reused"
+]
+DAILY_PARTITIONS = set()
+
+async def ensure_daily_partitions(conn, table, days_ahead=1):
+    """إنشاء أقسام يومية (Daily Partitions) لليوم الحالي والأيام القادمة إن لم تكن موجودة"""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    for offset in range(days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        name = f"{table}_{day:%Y%m%d}"
+        if name in DAILY_PARTITIONS:
+            continue
+        await conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+            FOR VALUES FROM ('{day}') TO ('{day + datetime.timedelta(days=1)}')
+        """)
+        DAILY_PARTITIONS.add(name)
+
+def build_radar_scan_rows(cycle_id, coins, records, reused_flags):
+    scanned_at = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    rows = []
+    for c, rec, reused in zip(coins, records, reused_flags):
+        pillars = rec.get("pillars") or [None] * 5
+        rows.append((
+            scanned_at, cycle_id, c["symbol"], float(c["quote"]["USD"]["price"]),
+            c.get("tier1_score"), rec.get("score"), *pillars,
+            rec.get("confluence"), rec.get("signal_type"), list(rec.get("tags", [])),
+            rec.get("veto", "unknown"), reused
+        ))
+    return rows
+
+async def persist_radar_scan(pool, rows):
+    """كتابة نتائج الدورة كاملة عبر COPY واحد (بدون أي رحلة ذهاب وإياب لكل عملة)"""
+    if not rows:
+        return
+    try:
+        async with pool.acquire() as conn:
+            await ensure_daily_partitions(conn, "radar_scan_results")
+            await conn.copy_records_to_table("radar_scan_results", records=rows, columns=RADAR_SCAN_COLUMNS)
+    except Exception as e:
+        print(f"⚠️ [Scan Archive] Bulk write failed: {e}")
+
+class AdaptiveScanScheduler:
+    """
+    [AIMD Scheduler] بديل ذكي للـ Semaphore الثابت:
+    يرفع عدد المهام المتزامنة خطوة بخطوة طالما الزمن والوزن والأخطاء تحت السيطرة،
+    ويقسمه للنصف فوراً عند أول علامة ضغط (429، تأخر، أو اقتراب وزن بايننس من الحد).
+    يُستخدم مباشرة مكان sem في analyze_radar_coin (async with).
+    """
+    def __init__(self, initial_limit=5, min_limit=2, max_limit=24, target_latency=8.0,
+                 weight_ceiling=0.70, adjust_every=10, target_cycle=RADAR_TARGET_CYCLE_SECONDS):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.weight_ceiling = weight_ceiling
+        self.adjust_every = adjust_every
+        self.target_cycle = target_cycle
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+        self._started = {}
+        self._window = []
+        self._http_marker = (0, 0)
+        self.start_cycle(0)
+
+    def start_cycle(self, total_coins):
+        self.cycle_start = time.time()
+        self.total_coins = total_coins
+        self.launched = 0
+        self.latencies = []
+        self.limit_trace = [self.limit]
+        self._http_marker = (BINANCE_WEIGHT_STATE["responses"], BINANCE_WEIGHT_STATE["errors"])
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        self._started[asyncio.current_task()] = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        started = self._started.pop(asyncio.current_task(), None)
+        if started is not None:
+            self.record(time.perf_counter() - started)
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+        return False
+
+    def record(self, latency):
+        self.latencies.append(latency)
+        self._window.append(latency)
+        if len(self._window) >= self.adjust_every:
+            self._adjust()
+
+    def _http_error_rate(self):
+        responses, errors = BINANCE_WEIGHT_STATE["responses"], BINANCE_WEIGHT_STATE["errors"]
+        d_resp, d_err = responses - self._http_marker[0], errors - self._http_marker[1]
+        self._http_marker = (responses, errors)
+        return d_err / d_resp if d_resp > 0 else 0.0
+
+    def _adjust(self):
+        window_p50 = float(np.median(self._window))
+        self._window = []
+        error_rate = self._http_error_rate()
+        weight_ratio = binance_weight_usage_ratio()
+        under_pressure = (
+            not binance_rate_limit_event.is_set()
+            or error_rate > 0.05
+            or weight_ratio > self.weight_ceiling
+            or window_p50 > self.target_latency * 1.5
+        )
+        if under_pressure:
+            self.limit = max(self.min_limit, self.limit // 2) # Multiplicative Decrease
+        elif window_p50 < self.target_latency and weight_ratio < self.weight_ceiling * 0.8:
+            self.limit = min(self.max_limit, self.limit + 1) # Additive Increase
+        self.limit_trace.append(self.limit)
+        # أي مهام تنتظر تستفيد من رفع الحد فوراً
+        asyncio.get_running_loop().create_task(self._wake_waiters())
+
+    async def _wake_waiters(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def next_launch_delay(self):
+        """توزيع الإطلاق على الزمن المتبقي من الدورة بدل الاستراحة الثابتة 200ms"""
+        self.launched += 1
+        remaining = self.total_coins - self.launched
+        if remaining <= 0:
+            return 0.0
+        time_left = self.target_cycle - (time.time() - self.cycle_start)
+        # لا فائدة من الإطلاق أسرع مما تسمح به المقاعد المتاحة
+        if self.in_flight >= self.limit or time_left <= 0:
+            return 0.0
+        return min(1.0, max(0.0, time_left / remaining) / max(1, self.limit))
+
+    def cycle_report(self):
+        duration = time.time() - self.cycle_start
+        lat = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            "duration": duration,
+            "coins": len(self.latencies),
+            "p50": float(np.percentile(lat, 50)),
+            "p95": float(np.percentile(lat, 95)),
+            "throughput": len(self.latencies) / duration if duration > 0 else 0.0,
+            "limit": self.limit,
+            "limit_min": min(self.limit_trace),
+            "limit_max": max(self.limit_trace),
+            "weight_ratio": binance_weight_usage_ratio()
+        }
+
 async def ai_opportunity_radar(pool):
     print("🚀 تم تشغيل الرادار الشامل (وضع صيد القيعان)...")
-    sem = asyncio.Semaphore(5)
-    
+    scheduler = AdaptiveScanScheduler()
+
     while True:
         try:
             print("🔍 جاري جلب 1000 عملة للبحث عن الجواهر المنسية...")
@@ -2649,7 +5664,7 @@ async def ai_opportunity_radar(pool):
                 """)
                 ignored_symbols = {r['symbol'] for r in records}
 
-            async with httpx.AsyncClient(timeout=30) as client:
+            async with httpx.AsyncClient(timeout=30, event_hooks={"response": [track_binance_weight]}) as client:
                 
                 # 👇👇 هذا هو السطر الجديد (نقطة التفتيش / البريك) 👇👇
                 await binance_rate_limit_event.wait()
@@ -2678,6 +5693,7 @@ async def ai_opportunity_radar(pool):
                     clean_sym = symbol.replace("USDT", "")
                     if clean_sym in STABLE_COINS or clean_sym in ignored_symbols or clean_sym in BLACKLISTED_COINS: 
                         continue
+                    if not owns_symbol(clean_sym): continue # 🛰️ شريحة هذه النسخة فقط
                     
                     vol_usd = float(t["quoteVolume"])
                     price_change = float(t["priceChangePercent"])
@@ -2688,11 +5704,17 @@ async def ai_opportunity_radar(pool):
                             "symbol": clean_sym,
                             "quote": {"USD": {"price": float(t["lastPrice"])}},
                             "volume": vol_usd,
-                            "priceChangePercent": price_change # 👈 أضفنا هذا السطر لكي تتعرف عليه دالة الترتيب
+                            "priceChangePercent": price_change, # 👈 أضفنا هذا السطر لكي تتعرف عليه دالة الترتيب
+                            "bid": float(t.get("bidPrice") or 0),
+                            "ask": float(t.get("askPrice") or 0),
+                            "weighted_avg": float(t.get("weightedAvgPrice") or 0),
+                            "high": float(t.get("highPrice") or 0),
+                            "low": float(t.get("lowPrice") or 0)
                         })
                 
-                # الفرز بناءً على أضيق نسبة تغير في السعر (من الأقرب للصفر) لاصطياد العملات المضغوطة                # --- الكود القديم لديك ---
-                coins = sorted(coins, key=lambda x: float(x.get("volume", 0)), reverse=True)[:350]
+                # 🥇 الطبقة الأولى: ترتيب الكون كاملاً من التيكر والشموع المخزنة، وأفضل K فقط تذهب للتحليل العميق
+                coins, tier1 = select_radar_tier2(coins)
+                print(f"🥇 [Tier-1] Universe: {tier1['universe']} | Cached candles: {tier1['cached']} | Deep scan (K): {tier1['selected']}")
 
                 # 👇👇 التعديل الجديد: تفعيل الفيتو اللحظي للبيتكوين 👇👇
                 is_btc_dumping = await check_btc_gravity_veto(client)
@@ -2702,18 +5724,62 @@ async def ai_opportunity_radar(pool):
                     continue
                 # 👆👆 نهاية التعديل 👆👆
                 
-                # --- الكود القديم لديك ---
+                # ⚙️ الجدولة التكيفية: المُجدول يحدد التزامن وإيقاع الإطلاق حسب الزمن والوزن والأخطاء
+                # ♻️ تخطي العملات التي لم تتغير بصمتها منذ الدورة السابقة
+                reused_results, coins_to_scan, fingerprints = split_unchanged_coins(coins)
+                skip_ratio = len(reused_results) / len(coins) if coins else 0.0
+                print(f"♻️ [Incremental Rescan] Reused: {len(reused_results)}/{len(coins)} ({skip_ratio*100:.0f}% skipped)")
+
+                scheduler.start_cycle(len(coins_to_scan))
                 tasks = []
-                for c in coins:
-                    await asyncio.sleep(0.2) # استراحة 200 ملي ثانية بين كل عملة
-                    task = asyncio.create_task(analyze_radar_coin(c, client, market_regime, sem))
+                scan_records = [{} for _ in coins_to_scan]
+                for c, rec in zip(coins_to_scan, scan_records):
+                    task = asyncio.create_task(analyze_radar_coin(c, client, market_regime, scheduler, scan_record=rec))
                     tasks.append(task)
+                    await asyncio.sleep(scheduler.next_launch_delay())
                     
-                results = await asyncio.gather(*tasks)
+                fresh_results = await asyncio.gather(*tasks)
+
+                scanned_at = time.time()
+                for c, r, rec in zip(coins_to_scan, fresh_results, scan_records):
+                    if radar_result_cacheable(rec):
+                        RADAR_FINGERPRINTS[c["symbol"]] = {"fp": fingerprints[c["symbol"]], "result": r, "record": rec, "ts": scanned_at}
+                    else:
+                        RADAR_FINGERPRINTS.pop(c["symbol"], None) # تُعاد محاولتها في الدورة القادمة
+                results = list(fresh_results) + [r for _, r, _ in reused_results]
+                attach_ai_scores(results) # 🧠 تقييم كل الناجين في استدعاء واحد للنموذج
+
+                # 🗃️ أرشفة كل عملة (المقبولة والمرفوضة ومرحلة رفضها) عبر COPY واحد، بما فيها مستبعدو الطبقة الأولى
+                tier1_rejected = tier1["rejected"]
+                scan_rows = build_radar_scan_rows(
+                    int(scanned_at),
+                    coins_to_scan + [c for c, _, _ in reused_results] + tier1_rejected,
+                    scan_records + [rec for _, _, rec in reused_results] + [{"veto": "tier1_cut"} for _ in tier1_rejected],
+                    [False] * len(coins_to_scan) + [True] * len(reused_results) + [False] * len(tier1_rejected)
+                )
+                await persist_radar_scan(pool, scan_rows)
+                # 🧱 الركائز الخام (VCA، LAR، ارتباط السبوت، تاجات الشبح) لمخزن الميزات: التحليلات الجديدة فقط
+                for c, rec in zip(coins_to_scan, scan_records):
+                    if rec.get("features"):
+                        await FEATURE_STORE_WRITER.add(c["symbol"], "radar", float(c["quote"]["USD"]["price"]), rec["features"], rec.get("tags", []))
+
+                cycle = scheduler.cycle_report()
+                print(
+                    f"📈 [Radar Scheduler] Cycle: {cycle['duration']:.1f}s | Coins: {cycle['coins']} | "
+                    f"p50: {cycle['p50']:.2f}s | p95: {cycle['p95']:.2f}s | Throughput: {cycle['throughput']:.2f} coins/s | "
+                    f"Concurrency: {cycle['limit_min']}→{cycle['limit_max']} (now {cycle['limit']}) | Weight: {cycle['weight_ratio']*100:.0f}%"
+                )
+                print(f"⏱️ [Probe Timeouts] {probe_timeout_report()}")
                 
                 valid_signals = [r for r in results if r is not None]
                 valid_signals.sort(key=lambda x: x['score'], reverse=True)
 
+                # 🧮 حفظ مصفوفة الدورة لإعادة التسعير الفوري
+                if valid_signals:
+                    LAST_RADAR_FEATURES["symbols"] = [r['symbol'] for r in valid_signals]
+                    LAST_RADAR_FEATURES["matrix"] = np.vstack([r['radar_features'] for r in valid_signals])
+                    LAST_RADAR_FEATURES["updated"] = time.time()
+
                 if not valid_signals:
                     print("😴 لم يتم العثور على فرص حالياً... إعادة البحث التلقائي بعد 15 دقائق.")
                     await asyncio.sleep(60)
@@ -2807,7 +5873,7 @@ async def ai_opportunity_radar(pool):
                 }
                 # تشغيل التسجيل في الخلفية لكي لا يؤخر إرسال الرسالة للأدمن
                                 # 🧠 تسجيل البيانات للذكاء الاصطناعي (أخذنا البيانات الجاهزة من دالة التحليل مباشرة)
-                asyncio.create_task(log_signal_for_ml(pool, symbol, price, best_meta.get('ml_features', {})))
+                await log_signal_for_ml(pool, symbol, price, best_meta.get("ml_features", {}), best_meta.get("ml_predictions")) # 🧾 إضافة للطابور الدفعي (بدون رحلة لقاعدة البيانات)
 
 
                 admin_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -3164,6 +6230,216 @@ async def radar_cmd(m: types.Message):
     await m.answer("📡 جاري تشغيل الرادار...")
 
     asyncio.create_task(ai_opportunity_radar(dp['db_pool']))
+
+@dp.message(Command("radar_bench"))
+async def radar_bench_cmd(m: types.Message):
+    """قياس نواة التسعير الدفعي + إعادة تسعير آخر دورة بالأوزان الحالية"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    ms_per_cycle = await asyncio.to_thread(benchmark_radar_kernel, 350, 50)
+    ranked = rescore_last_radar_cycle()
+    top_lines = "\n".join(f"• #{r['symbol']}: {r['score']:.1f} ({r['confluence']}/6) {r['signal_type']}" for r in ranked[:5])
+
+    await m.answer(
+        f"🧮 <b>Batch Scoring Kernel</b>\n"
+        f"⏱️ 350 عملة: <code>{ms_per_cycle:.3f} ms</code> لكل دورة\n"
+        f"📦 آخر دورة: {len(ranked)} عملة\n{top_lines}",
+        parse_mode=ParseMode.HTML
+    )
+@dp.message(Command("ml_bench"))
+async def ml_bench_cmd(m: types.Message):
+    """قياس زمن التنبؤ: صف بصف مقابل الدفعة الواحدة"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    bench = await asyncio.to_thread(benchmark_ml_inference, 350, 5)
+    if bench is None:
+        return await m.answer("⏳ لا يوجد نموذج مدرب بعد.")
+
+    await m.answer(
+        f"🧠 <b>ML Inference Benchmark</b> ({bench['rows']} عملة)\n"
+        f"🐢 DataFrame صف بصف: <code>{bench['legacy_ms']:.1f} ms</code>\n"
+        f"🚶 inplace صف بصف: <code>{bench['single_ms']:.1f} ms</code>\n"
+        f"🚀 دفعة واحدة: <code>{bench['batch_ms']:.2f} ms</code>\n"
+        f"⚡ التسريع: <b>{bench['legacy_ms'] / max(bench['batch_ms'], 1e-6):.0f}x</b>",
+        parse_mode=ParseMode.HTML
+    )
+@dp.message(Command("ml_models"))
+async def ml_models_cmd(m: types.Message):
+    """/ml_models: البطل والمتحدون ودقتهم المتدحرجة على نفس العينات"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    _, champion, meta = AI_MODEL_ACTIVE
+    if champion is None:
+        return await m.answer("⏳ لا يوجد نموذج مدرب بعد.")
+    entries = [("👑", meta["version"], meta)] + [("🥊", v, c_meta) for v, _, c_meta in AI_CHALLENGERS]
+    async with dp['db_pool'].acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT model_id, weight, sse, hits, champion_sse, champion_hits, labels
+            FROM ml_model_scores WHERE model_id = ANY($1::int[])
+        """, [v for _, v, _ in entries])
+    scores = {r['model_id']: shadow_score_summary(r) for r in rows}
+
+    lines = []
+    for badge, version, model_meta in entries:
+        sc = scores.get(version)
+        shadow = (
+            f"RMSE {sc['rmse']:.4f} (👑 {sc['champion_rmse']:.4f}) | hit {sc['hit_rate']:.1f}% (👑 {sc['champion_hit_rate']:.1f}%) | {sc['labels']} وسم"
+            if sc else "بانتظار الوسوم..."
+        )
+        holdout = model_meta['metrics'].get('holdout_rmse')
+        holdout = f"{holdout:.4f}" if holdout is not None else "-"
+        lines.append(f"{badge} v{version} ({model_meta['kind']}, {model_meta['sample_count']} عينة, holdout {holdout})\n   {shadow}")
+    await m.answer(
+        f"🥊 <b>Champion / Challengers</b>\n<code>{chr(10).join(lines)}</code>\n\n"
+        f"⚖️ الترقية: {ML_PROMOTION_MIN_LABELS}+ وسم، RMSE أقل بـ {ML_PROMOTION_MARGIN * 100:.0f}% ونسبة إصابة لا تقل عن البطل.",
+        parse_mode=ParseMode.HTML
+    )
+@dp.message(Command("backtest"))
+async def backtest_cmd(m: types.Message):
+    """/backtest [days]: مزامنة تزايدية لمخزن الشموع ثم باك تست متجه لركائز الشموع"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    parts = (m.text or "").split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else BACKTEST_DEFAULT_DAYS
+    await m.answer(f"🧪 جاري مزامنة الشموع وتشغيل الباك تست ({days} يوم)...")
+    try:
+        sync, names, timestamps, panel = await refresh_backtest_panel(dp['db_pool'], days)
+        if not names:
+            return await m.answer("⚠️ لا توجد شموع مخزنة بعد.")
+        report = await run_training_task(run_candle_backtest, panel, timestamps, None, names)
+    except Exception as e:
+        return await m.answer(f"⚠️ Backtest Error: {e}")
+
+    line = lambda title, st: f"{title}: n={st['n']:,} | ret {st['mean_ret']:+.2f}% | hit {st['hit_rate']:.0f}% | MFE {st['mean_mfe']:.2f}% | MAE {st['mean_mae']:.2f}%"
+    bucket_lines = "\n".join(line(f"• {b['lo']}-{b['hi']}", b) for b in report["buckets"] if b["n"])
+    month_lines = "\n".join(line(f"• {mo['month']}", mo) for mo in report["monthly"][-6:] if mo["n"])
+    vetoes = " | ".join(f"{k}: {v:,}" for k, v in report["vetoes"].items())
+    await m.answer(
+        f"🧪 <b>Candle Backtest</b> ({report['symbols']} عملة، {report['bars']:,} شمعة، أفق {report['horizon']}h)\n"
+        f"⏱️ {report['seconds']:.1f}s | مزامنة: +{sync['candles']:,} شمعة\n\n"
+        f"<code>{line('Baseline', report['baseline'])}\n{line('Vetoed', report['vetoed'])}\n"
+        f"{line('Survivors', report['survivors'])}\n{line('Signals', report['signals'])}</code>\n\n"
+        f"🚫 {vetoes}\n\n📊 <b>حسب السكور</b>\n<code>{bucket_lines}</code>\n\n"
+        f"🗓️ <b>آخر الشهور (Signals)</b>\n<code>{month_lines}</code>",
+        parse_mode=ParseMode.HTML
+    )
+@dp.message(Command("sweep"))
+async def sweep_cmd(m: types.Message):
+    """/sweep [عدد|grid] [days]: مسح متوازي لعتبات الرادار وأوزانه على مخزن الشموع"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    parts = (m.text or "").split()
+    mode = "grid" if len(parts) > 1 and parts[1].lower() == "grid" else "random"
+    n = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else SWEEP_DEFAULT_CONFIGS
+    days = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else BACKTEST_DEFAULT_DAYS
+    configs = build_sweep_configs(mode=mode, n=n if mode == "random" else math.prod(len(v) for v in SWEEP_SPACE.values()) + 1)
+    await m.answer(f"🎛️ جاري مسح {len(configs):,} إعداد ({mode}) على {days} يوم...")
+    try:
+        sync, names, timestamps, panel = await refresh_backtest_panel(dp['db_pool'], days)
+        if not names:
+            return await m.answer("⚠️ لا توجد شموع مخزنة بعد.")
+        report = await run_training_task(run_param_sweep, panel, timestamps, names, configs)
+    except Exception as e:
+        return await m.answer(f"⚠️ Sweep Error: {e}")
+
+    def describe(res):
+        c = res["config"]
+        return (
+            f"q {res['quality']:+.1f} | hit {res['hit_rate']:.0f}% | ret {res['mean_ret']:+.2f}% | n={res['n']:,} | +M {res['months_positive']:.0f}%\n"
+            f"   z{c['z_threshold']} lar{c['lar_threshold']} vwap{c['vwap_z_threshold']} "
+            f"score{c['required_score']:.0f} conf{c['required_confluence']} dir{c['directional_weight']}\n"
+            f"   bull{c['weights_bull']} bear{c['weights_bear']} other{c['weights_other']}"
+        )
+    top_lines = "\n".join(f"#{i} {describe(res)}" for i, res in enumerate(report["top"][:5], 1))
+    await m.answer(
+        f"🎛️ <b>Radar Parameter Sweep</b> ({report['symbols']} عملة، {report['rows']:,} شمعة، {report['months']})\n"
+        f"⏱️ تجهيز {report['prepare_seconds']:.1f}s | مسح {report['sweep_seconds']:.1f}s بـ {report['workers']} عمال | "
+        f"{report['eligible']}/{report['configs']} إعداد بـ {SWEEP_MIN_SIGNALS}+ إشارة\n\n"
+        f"📌 <b>الإعداد الحالي</b>\n<code>{describe(report['live'])}</code>\n\n"
+        f"🏆 <b>الأفضل</b>\n<code>{top_lines or 'لا يوجد'}</code>",
+        parse_mode=ParseMode.HTML
+    )
+@dp.message(Command("ml_search"))
+async def ml_search_cmd(m: types.Message):
+    """/ml_search [هدف الزمن µs] [apply]: بحث متوازي بطيات زمنية مطهرة، واعتماد الفائز كمتحدٍ عند apply"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    parts = (m.text or "").split()
+    target = next((float(p) for p in parts[1:] if p.replace(".", "", 1).isdigit()), ML_SEARCH_LATENCY_TARGET_US)
+    apply = any(p.lower() == "apply" for p in parts[1:])
+    configs = build_search_configs()
+    await m.answer(f"🔬 جاري بحث {len(configs)} إعداد × {ML_SEARCH_FOLDS} طيات زمنية بـ {ML_SEARCH_WORKERS} عمال (هدف الزمن {target:.0f}µs)...")
+    try:
+        train = await stream_training_arrays(dp['db_pool'], f" AND id % {ML_HOLDOUT_MODULUS} <> 0")
+        report = await run_training_task(
+            run_hyperparam_search, train["X"], train["y"], train["signal_time"], configs, ML_SEARCH_WORKERS, target
+        )
+        del train
+    except Exception as e:
+        return await m.answer(f"⚠️ Search Error: {e}")
+
+    describe = lambda r: (
+        f"{r['config']['n_estimators']}×d{r['config']['max_depth']} lr{r['config']['learning_rate']} | "
+        f"RMSE {r['rmse']:.4f}±{r['rmse_std']:.4f} | {r['latency_p50_us']:.0f}µs (p95 {r['latency_p95_us']:.0f}) | "
+        f"batch {r['batch_row_us']:.1f}µs/row"
+    )
+    _, champion, meta = AI_MODEL_ACTIVE
+    live = meta["metrics"].get("params") or {
+        "n_estimators": 400, "max_depth": ML_XGB_PARAMS["max_depth"], "learning_rate": ML_XGB_PARAMS["learning_rate"]
+    }
+    live_line = next((describe(r) for r in report["results"] if r["config"] == live), "خارج فضاء البحث")
+    folds = " | ".join(f"{f['train']:,}→{f['test']:,}" for f in report["folds"])
+    winner = report["winner"]
+    text = (
+        f"🔬 <b>Hyper-Parameter Search</b> ({report['rows']:,} عينة، {report['configs']} إعداد، {report['workers']} عمال)\n"
+        f"⏱️ CV {report['cv_seconds']:.1f}s | قياس الزمن {report['bench_seconds']:.1f}s | طيات (تدريب→اختبار): {folds}\n\n"
+        f"📌 <b>الحالي</b>\n<code>{live_line if champion is not None else 'لا يوجد نموذج'}</code>\n\n"
+        f"📈 <b>حد الدقة/الزمن (Pareto)</b>\n<code>{chr(10).join(describe(r) for r in report['pareto'])}</code>\n\n"
+        f"🏆 <b>الفائز ضمن {report['latency_target_us']:.0f}µs</b>\n<code>{describe(winner) if winner else 'لا يوجد إعداد يحقق الهدف'}</code>"
+    )
+    await m.answer(text, parse_mode=ParseMode.HTML)
+
+    if apply and winner:
+        try:
+            version, metrics = await register_search_winner(dp['db_pool'], winner["config"])
+        except Exception as e:
+            return await m.answer(f"⚠️ Search Apply Error: {e}")
+        if version is None:
+            return await m.answer(f"🛡️ الفائز رُفض في حارس الاختبار: RMSE {metrics['holdout_rmse']:.4f} vs {metrics['prev_holdout_rmse']:.4f}.")
+        await m.answer(f"🥊 الفائز حُفظ كنسخة v{version} ({metrics['n_trees']} شجرة، holdout RMSE {metrics['holdout_rmse']}) ودخل المنافسة الظلية.")
+@dp.message(Command("export_ml"))
+async def export_ml_cmd(m: types.Message):
+    """/export_ml: كل العينات الموسومة كملف أعمدة مضغوط (.npz) عبر نفس مسار البث"""
+    if m.from_user.id != ADMIN_USER_ID:
+        return await m.answer("❌ هذا الأمر للأدمن فقط")
+
+    await m.answer("🌊 جاري بث بيانات التدريب وتصديرها...")
+    path = os.path.join(tempfile.gettempdir(), f"ml_training_{int(time.time())}.npz")
+    keep_file = False
+    try:
+        started = time.perf_counter()
+        arrays = await stream_training_arrays(dp['db_pool'])
+        rows = len(arrays["y"])
+        if rows == 0:
+            return await m.answer("⏳ لا توجد عينات موسومة بعد.")
+        size = await asyncio.to_thread(write_training_export, arrays, path)
+        del arrays
+        caption = f"🌊 {rows:,} عينة × {len(ML_EXPORT_COLUMNS)} عمود | {size / 1024 / 1024:.1f} MB | {time.perf_counter() - started:.1f}s"
+        if size > ML_EXPORT_MAX_UPLOAD_BYTES:
+            keep_file = True
+            return await m.answer(f"{caption}\n📁 الملف أكبر من حد تيليجرام، محفوظ على السيرفر:\n<code>{path}</code>", parse_mode=ParseMode.HTML)
+        await m.answer_document(FSInputFile(path), caption=caption)
+    except Exception as e:
+        await m.answer(f"⚠️ Export Error: {e}")
+    finally:
+        if not keep_file and os.path.exists(path):
+            os.remove(path)
 @dp.message(Command("clean"))
 async def clean_db_cmd(m: types.Message):
     if m.from_user.id != ADMIN_USER_ID:
@@ -3507,10 +6783,27 @@ def gate_sign(params: dict):
     return {}
 
 # --- جلب الشموع ---
+# 🗄️ كاش الشموع (Write-Through): كل تحميل ناجح يُحفظ هنا لتستفيد منه الطبقة الأولى للرادار
+# نخزن آخر CANDLE_CACHE_KEEP شمعة فقط كمصفوفة float64 [ts, volume, close, high, low, open, taker_buy]
+CANDLE_CACHE = {}
+CANDLE_CACHE_KEEP = 200
+CANDLE_CACHE_MAX_AGE = {"1h": 7200, "4h": 4 * 3600 * 2, "1d": 86400 * 2}
+
+def get_cached_candles(symbol: str, interval: str, max_age: float = None):
+    """يعيد الشموع المخزنة إذا كانت حديثة بما يكفي، وإلا None (بدون أي طلب شبكة)"""
+    entry = CANDLE_CACHE.get((symbol.replace("_", ""), interval))
+    if not entry:
+        return None
+    if max_age is None:
+        max_age = CANDLE_CACHE_MAX_AGE.get(interval, 3600)
+    if time.time() - entry["fetched"] > max_age:
+        return None
+    return entry["candles"]
+
 async def get_candles_binance(symbol: str, interval: str, limit: int = 500, retries: int = 3):
     clean_symbol = symbol.replace("_", "") 
     
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(event_hooks={"response": [track_binance_weight]}) as client:
         for attempt in range(retries):
             # 🛑 انتظار الإشارة الخضراء قبل إرسال أي طلب لبايننس
             await binance_rate_limit_event.wait()
@@ -3530,6 +6823,15 @@ async def get_candles_binance(symbol: str, interval: str, limit: int = 500, retr
                         formatted_candles.append([
                             str(int(c[0] / 1000)), c[5], c[4], c[2], c[3], c[1], c[9]
                         ])
+                    if formatted_candles:
+                        candle_arr = np.asarray(formatted_candles, dtype=np.float64)
+                        CANDLE_CACHE[(clean_symbol, interval)] = {
+                            "candles": candle_arr[-CANDLE_CACHE_KEEP:],
+                            "fetched": time.time()
+                        }
+                        # 🗃️ شموع 15 دقيقة تُحفظ أيضاً في المخزن المحلي ليقرأ منها المفتش نوافذ الوسم
+                        if interval == CANDLE_STORE_WRITER.interval:
+                            await CANDLE_STORE_WRITER.add(clean_symbol, cache_candles_to_ohlc(candle_arr))
                     return formatted_candles
                 
                 # 🚨 هنا يتم اصطياد التحذير قبل الحظر!
@@ -3975,7 +7277,7 @@ async def analyze_macro_derivatives_divergence(symbol: str, client: httpx.AsyncC
     [Macro Derivatives Engine] - محرك المشتقات الكلي للفريمات الكبيرة
     يستبدل الأوردر بوك اللحظي بقراءة بناء المراكز (Short/Long) على المدى الطويل.
     """
-    clean_sym = symbol.replace("USDT", "") + "USDT"
+    clean_sym = venue_symbol(symbol, "binance")
     
     # تحديد نطاق جلب البيانات بناءً على الفريم
     period = "1d" if tf in ["1w", "weekly", "1d", "daily"] else "4h"
@@ -4053,7 +7355,7 @@ async def analyze_orderbook_advanced_manual(symbol: str, client: httpx.AsyncClie
     يستخدم WebSocket لالتقاط 20 إطاراً في ثانيتين (100ms interval) لكشف الخوارزميات، 
     مع وجود Fallback لـ REST API في حال فشل الاتصال لضمان استقرار البوت.
     """
-    clean_symbol = symbol.replace("USDT", "").lower() + "usdt"
+    clean_symbol = venue_symbol(symbol, "binance").lower() # اسم الستريم بالحروف الصغيرة
     ws_url = f"wss://stream.binance.com:9443/ws/{clean_symbol}@depth10@100ms"
 
     frames = []
@@ -4296,7 +7598,7 @@ def extract_institutional_memory(symbol: str):
     onchain_fueled_macro = MACRO_CACHE.get("onchain_liquidity_score", 0.0) > 15.0
     
     # 2. فحص غرفة الاحتضان (Incubation Check)
-    is_incubated = pair in INCUBATION_MATRIX
+    is_incubated = is_incubated_pair(pair)
     
     alert_ar = ""
     alert_en = ""
@@ -4506,7 +7808,7 @@ async def run_analysis(cb: types.CallbackQuery):
             return await cb.message.answer(error_msg, parse_mode=ParseMode.HTML)
 
     # 🧠 تشغيل محرك التوافق الزمني في الخلفية
-    mtfa_context = await asyncio.to_thread(calculate_mtfa_context_sync, candles_4h, candles_1d, candles_1w)
+    mtfa_context = await run_cpu_task(calculate_mtfa_context_sync, candles_4h, candles_1d, candles_1w)
     # ====================================================================
 
 
@@ -4732,7 +8034,7 @@ async def run_analysis(cb: types.CallbackQuery):
     # ====================================================================
     # 🧲 محرك خريطة السيولة المؤسساتية (VPVR Confluence Overwrite)
     # ====================================================================
-    conf_sl, conf_tp1, conf_tp2, conf_tp3 = await asyncio.to_thread(
+    conf_sl, conf_tp1, conf_tp2, conf_tp3 = await run_cpu_task(
         calculate_institutional_vpvr_confluence, candles_4h, candles_1d, price, final_trend_dir
     )
     if conf_sl is not None:
@@ -4817,7 +8119,7 @@ async def run_analysis(cb: types.CallbackQuery):
             'cvd_divergence': 1.0 if (price > df['close'].ewm(span=200).mean().iloc[-1] and delta_usd < 0) else 0.0,
             'funding_rate': float(funding_val)
         }
-        ai_conviction = await asyncio.to_thread(predict_signal_sync, ml_features)
+        ai_conviction = predict_signal_sync(ml_features)
     except: ai_conviction = -1.0
 
     final_conviction_score = ai_conviction if ai_conviction != -1.0 else conviction_score
@@ -5244,6 +8546,141 @@ async def on_startup(app):
             )
         """)
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_ml_pending ON ml_training_data(is_processed, signal_time)")
+        # 🧾 منع التكرار بقيد فريد على (العملة، نافذة 5 ساعات) بدل SELECT قبل كل INSERT
+        # الصفوف القديمة تبقى sample_bucket = NULL فلا تتعارض مع القيد
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS sample_bucket BIGINT")
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS labeled_at TIMESTAMP")
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS label_attempts SMALLINT DEFAULT 0")
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS next_label_at TIMESTAMP")
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS shadow_model_ids INTEGER[]")
+        await conn.execute("ALTER TABLE ml_training_data ADD COLUMN IF NOT EXISTS shadow_predictions REAL[]")
+        await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_ml_symbol_bucket ON ml_training_data(symbol, sample_bucket)")
+
+        # 🗃️ أرشيف المسح الكامل: مقسم يومياً مع فهرس BRIN صغير جداً على الزمن
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS radar_scan_results (
+                scanned_at TIMESTAMP NOT NULL,
+                cycle_id BIGINT,
+                symbol TEXT,
+                price DOUBLE PRECISION,
+                tier1_score DOUBLE PRECISION,
+                score DOUBLE PRECISION,
+                pillar_cvd DOUBLE PRECISION,
+                pillar_deriv DOUBLE PRECISION,
+                pillar_tech DOUBLE PRECISION,
+                pillar_ob DOUBLE PRECISION,
+                pillar_vol DOUBLE PRECISION,
+                confluence INTEGER,
+                signal_type TEXT,
+                tags TEXT[],
+                veto_stage TEXT,
+                reused BOOLEAN DEFAULT FALSE
+            ) PARTITION BY RANGE (scanned_at)
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_radar_scan_time_brin ON radar_scan_results USING BRIN (scanned_at)")
+        await ensure_daily_partitions(conn, "radar_scan_results")
+
+        # 🧱 مخزن الميزات الزمني: متجه لكل عملة بإيقاع ثابت (مقسم يومياً، captured_at بتوقيت UTC)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS feature_store (
+                captured_at TIMESTAMP NOT NULL,
+                symbol TEXT NOT NULL,
+                source TEXT NOT NULL,
+                price DOUBLE PRECISION,
+                features DOUBLE PRECISION[] NOT NULL,
+                tags TEXT[]
+            ) PARTITION BY RANGE (captured_at)
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_feature_store_time_brin ON feature_store USING BRIN (captured_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_feature_store_symbol_time ON feature_store (symbol, captured_at)")
+        await ensure_daily_partitions(conn, "feature_store")
+
+        # 🧪 مخزن الشموع التاريخية للباك تست (مع علامة مائية لكل عملة وفريم)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS candle_store (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                open_ts BIGINT NOT NULL,
+                open DOUBLE PRECISION,
+                high DOUBLE PRECISION,
+                low DOUBLE PRECISION,
+                close DOUBLE PRECISION,
+                volume DOUBLE PRECISION,
+                taker_buy DOUBLE PRECISION,
+                PRIMARY KEY (symbol, interval, open_ts)
+            )
+        """)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS candle_store_watermarks (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                last_open_ts BIGINT NOT NULL,
+                PRIMARY KEY (symbol, interval)
+            )
+        """)
+
+        # 💾 أرشيف النماذج المدربة (نسخة + قائمة الميزات + عدد العينات + المقاييس)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS ml_models (
+                id SERIAL PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                model_blob BYTEA NOT NULL,
+                feature_list TEXT[] NOT NULL,
+                sample_count INTEGER NOT NULL,
+                metrics TEXT,
+                kind TEXT DEFAULT 'full',
+                label_watermark TIMESTAMP,
+                full_refit_at TIMESTAMP,
+                parent_id INTEGER
+            )
+        """)
+        await conn.execute("ALTER TABLE ml_models ADD COLUMN IF NOT EXISTS role TEXT DEFAULT 'archived'")
+        # 🥊 الدقة المتدحرجة (تضاؤل أسّي) لكل نموذج مقابل البطل الحالي على نفس العينات
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS ml_model_scores (
+                model_id INTEGER PRIMARY KEY,
+                weight DOUBLE PRECISION NOT NULL,
+                sse DOUBLE PRECISION NOT NULL,
+                hits DOUBLE PRECISION NOT NULL,
+                champion_sse DOUBLE PRECISION NOT NULL,
+                champion_hits DOUBLE PRECISION NOT NULL,
+                labels BIGINT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # 🧬 غرفة الاحتضان الدائمة (تنجو من إعادة التشغيل، والصلاحية 48 ساعة)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS incubation_matrix (
+                symbol TEXT PRIMARY KEY,
+                incubation_start DOUBLE PRECISION NOT NULL,
+                macro_z DOUBLE PRECISION,
+                bb_width DOUBLE PRECISION,
+                onchain_fueled BOOLEAN DEFAULT FALSE
+            )
+        """)
+
+        # 🛰️ جداول التنسيق بين النسخ (حجز الأقسام، الأعضاء، القائد، الحالة المشتركة)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS scan_shard_leases (
+                shard_id INTEGER PRIMARY KEY,
+                owner TEXT,
+                lease_until TIMESTAMP
+            )
+        """)
+        await conn.execute("""
+            INSERT INTO scan_shard_leases (shard_id)
+            SELECT generate_series(0, $1 - 1) ON CONFLICT DO NOTHING
+        """, SCAN_SHARD_COUNT)
+        await conn.execute("CREATE TABLE IF NOT EXISTS cluster_members (replica_id TEXT PRIMARY KEY, last_seen TIMESTAMP)")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_leader (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                owner TEXT,
+                lease_until TIMESTAMP
+            )
+        """)
+        await conn.execute("CREATE TABLE IF NOT EXISTS cluster_shared_state (key TEXT PRIMARY KEY, value JSONB, updated_at TIMESTAMP)")
 
         # 2. إجبار تحديث الجداول القديمة (للمشتركين الحاليين)
         await conn.execute("ALTER TABLE users_info ADD COLUMN IF NOT EXISTS last_active DATE")
@@ -5257,21 +8694,64 @@ async def on_startup(app):
         for uid in initial_paid_users:
             await conn.execute("INSERT INTO paid_users (user_id) VALUES ($1) ON CONFLICT DO NOTHING", uid)
 
+    start_compute_pool() # 🏭 تشغيل عمال الحوسبة الدافئة قبل بدء المسح
+    ML_SAMPLE_WRITER.start(pool) # 🧾 الكاتب الدفعي لعينات التدريب
+    FEATURE_STORE_WRITER.start(pool) # 🧱 الكاتب الدفعي لمخزن الميزات
+    CANDLE_STORE_WRITER.start(pool) # 🗃️ شموع الحاصد لمخزن الشموع المحلي (نوافذ الوسم)
+
+    # 🧬 استعادة غرفة الاحتضان فوراً حتى يراها الرادار والتحليل من أول طلب
+    try:
+        await rehydrate_incubation_matrix(pool)
+    except Exception as e:
+        print(f"⚠️ [Incubator] Rehydrate failed: {e}")
+    asyncio.create_task(incubation_sync_worker(pool)) # 🧬 إضافات الشرائح الأخرى تصل لكل النسخ
+
+    # 💾 تحميل البطل والمتحدين: التنبؤات متاحة من أول دورة بدل -1 حتى أول تدريب
+    try:
+        await load_model_registry(pool)
+    except Exception as e:
+        print(f"⚠️ [Model Registry] Load failed: {e}")
+
+    # 📇 تحميل سجل الرموز مرة واحدة قبل أي مسح (الفشل لا يوقف البوت: Fail-Open)
+    try:
+        await refresh_symbol_registry()
+    except Exception as e:
+        print(f"⚠️ [Symbol Registry] Initial load failed: {e}")
+    asyncio.create_task(symbol_registry_worker())
+
+    # 🛰️ حجز الأقسام وانتخاب القائد قبل تشغيل أي عامل مسح
+    try:
+        await cluster_heartbeat_tick(pool)
+    except Exception as e:
+        print(f"⚠️ [Cluster] Initial Heartbeat Error: {e}")
+    asyncio.create_task(cluster_coordinator_worker(pool))
+
     asyncio.create_task(smart_radar_watchdog(pool))
     asyncio.create_task(silent_data_harvester_worker(pool))
     asyncio.create_task(macro_data_worker()) # 🌍 تشغيل عامل الماكرو
     asyncio.create_task(radar_worker_process(pool))
     asyncio.create_task(institutional_incubator_worker(pool))
     asyncio.create_task(ai_trainer_worker(pool)) # 🧠 تشغيل مدرب الذكاء الاصطناعي
+    asyncio.create_task(model_registry_worker(pool)) # 🥊 مزامنة البطل والمتحدين في كل النسخ
     asyncio.create_task(ml_inspector_worker(pool)) # 🧠 تشغيل محقق الذكاء الاصطناعي
     await bot.set_webhook(f"{WEBHOOK_URL}/")
 
+async def on_shutdown(app):
+    stop_compute_pool()
+    stop_training_pool()
+    await ML_SAMPLE_WRITER.drain() # 🧾 لا نفقد أي عينة عالقة في الذاكرة
+    await FEATURE_STORE_WRITER.drain()
+    await CANDLE_STORE_WRITER.drain()
+    if 'db_pool' in app:
+        await release_cluster_leases(app['db_pool'])
+
 
 app = web.Application()
 app.router.add_post("/", handle_webhook)
 app.router.add_post("/webhook/nowpayments", nowpayments_ipn)
 app.router.add_get("/health", lambda r: web.Response(text="ok"))
 app.on_startup.append(on_startup)
+app.on_shutdown.append(on_shutdown)
 
 if __name__ == "__main__":
     web.run_app(app, host="0.0.0.0", port=PORT)
\ No newline at end of file